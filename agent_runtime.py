@@ -0,0 +1,122 @@
+import os
+import threading
+
+from crewai import LLM
+
+from metrics import agent_span, record_token_usage
+
+LLM_MODEL = os.environ.get('LLM_MODEL', '<your_model>')
+LLM_API_KEY = os.environ.get('AZURE_OPENAI_API_KEY', '<your_api_key>')
+LLM_BASE_URL = os.environ.get('AZURE_OPENAI_ENDPOINT', '<your_endpoint>')
+LLM_API_VERSION = os.environ.get('AZURE_OPENAI_API_VERSION', '<your_api_version>')
+# Kept-alive HTTP connections to the model endpoint, shared by every agent
+LLM_MAX_CONNECTIONS = int(os.environ.get('LLM_MAX_CONNECTIONS', 32))
+LLM_TIMEOUT_SECONDS = float(os.environ.get('LLM_TIMEOUT_SECONDS', 120))
+LLM_PROMPT_CACHING = os.environ.get('LLM_PROMPT_CACHING', 'true').lower() == 'true'
+
+# Providers that only cache a prompt prefix when it is explicitly marked; OpenAI
+# and Azure OpenAI cache identical prefixes automatically
+_EXPLICIT_CACHE_PROVIDERS = ('anthropic/', 'bedrock/', 'vertex_ai/')
+
+# Stand-in set with set_llm, used by every thread
+_llm = None
+_llm_lock = threading.Lock()
+_http_pool_ready = False
+
+# Agents and crews are built once per worker thread; CrewAI keeps per-run state on
+# them, so threads never share one. They are built with cache=False: the tools
+# read the dataset, approximate flag and question from the request context rather
+# than their arguments, so CrewAI's tool cache, keyed on the arguments, would
+# serve one request's results to the next.
+_local = threading.local()
+
+
+def _configure_http_pool():
+    """Route all model calls through one kept-alive, pooled HTTP client"""
+    try:
+        import httpx
+        import litellm
+    except ImportError:
+        return
+    limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+    litellm.client_session = httpx.Client(limits=limits, timeout=LLM_TIMEOUT_SECONDS)
+    litellm.aclient_session = httpx.AsyncClient(limits=limits, timeout=LLM_TIMEOUT_SECONDS)
+
+
+def get_llm():
+    """
+    This thread's LLM client. The HTTP connection pool is shared by all of them;
+    the client is not, as CrewAI counts a run's tokens on it.
+    """
+    global _http_pool_ready
+    if _llm is not None:
+        return _llm
+    llm = getattr(_local, 'llm', None)
+    if llm is None:
+        with _llm_lock:
+            if not _http_pool_ready:
+                _configure_http_pool()
+                _http_pool_ready = True
+        options = {}
+        if LLM_PROMPT_CACHING and LLM_MODEL.startswith(_EXPLICIT_CACHE_PROVIDERS):
+            # Mark the static system prompt (role, goal, backstory, tools) as cacheable
+            options['cache_control_injection_points'] = [{'location': 'message', 'role': 'system'}]
+        llm = _local.llm = LLM(
+            model=LLM_MODEL,
+            api_version=LLM_API_VERSION,
+            base_url=LLM_BASE_URL,
+            api_key=LLM_API_KEY,
+            timeout=LLM_TIMEOUT_SECONDS,
+            **options
+        )
+    return llm
+
+
+def set_llm(llm):
+    """Use llm for all agents built from now on, e.g. a scripted stand-in for benchmarks"""
+    global _llm
+    with _llm_lock:
+        _llm = llm
+
+
+def get_crew(name, build):
+    """
+    Return this thread's crew called name, building it with build() on first use.
+    build returns (crew, task); the task description is a template filled in by
+    crew.kickoff(inputs=...), so the agent prompts stay identical across requests
+    and can be served from the provider's prompt-prefix cache.
+    """
+    crews = getattr(_local, 'crews', None)
+    if crews is None:
+        crews = _local.crews = {}
+    if name not in crews:
+        crews[name] = build()
+    return crews[name]
+
+
+def _usage(usage):
+    if usage is None:
+        return None
+    if not isinstance(usage, dict):
+        usage = usage.model_dump() if hasattr(usage, 'model_dump') else vars(usage)
+    return {key: value for key, value in usage.items() if isinstance(value, (int, float))}
+
+
+def _crew_usage(crew):
+    # The agents' token counters accumulate over every kickoff of a reused crew
+    try:
+        return _usage(crew.calculate_usage_metrics())
+    except Exception:
+        return None
+
+
+def run_crew(name, crew, inputs):
+    """Kick off a crew, recording its duration and the token usage of this run under name"""
+    before = _crew_usage(crew)
+    with agent_span(name):
+        output = crew.kickoff(inputs=inputs)
+    usage = _usage(getattr(output, 'token_usage', None) or getattr(crew, 'usage_metrics', None))
+    if usage and before:
+        usage = {key: value - before.get(key, 0) for key, value in usage.items()}
+    record_token_usage(usage)
+    return output
@@ -0,0 +1,170 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+
+from get_tools.dataset_cache import dataset_fingerprint
+
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get('ANSWER_CACHE_MAX_ENTRIES', 1000))
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get('ANSWER_CACHE_TTL_SECONDS', 24 * 3600))
+# Minimum cosine similarity for a differently worded question to count as a hit; 0 disables
+ANSWER_CACHE_SIMILARITY = float(os.environ.get('ANSWER_CACHE_SIMILARITY', 0.9))
+# Sentence-transformers model for matching differently worded questions; unset matches exact questions only
+ANSWER_CACHE_EMBEDDING_MODEL = os.environ.get('ANSWER_CACHE_EMBEDDING_MODEL', '')
+
+# Words that do not change what is being asked
+_FILLER_WORDS = {
+    'please', 'can', 'could', 'would', 'you', 'me', 'show', 'give', 'tell', 'list',
+    'display', 'what', 'whats', 'which', 'is', 'are', 'the', 'a', 'an', 'of', 'in',
+    'for', 'on', 'to', 'i', 'want', 'need', 'see', 'us', 'some', 'my', 'this', 'data',
+    'dataset',
+}
+# Words asking for the same thing, so "revenue per region" shares the key of "revenue by region"
+_SYNONYMS = {'per': 'by', 'each': 'by', 'every': 'by', 'avg': 'average', 'mean': 'average', 'sum': 'total'}
+
+# (dataset fingerprint, chart enabled, chart type, normalized query) -> entry
+_entries = OrderedDict()
+_lock = threading.Lock()
+_stats = {'hits': 0, 'semantic_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expirations': 0}
+
+_embedding_model = None
+_embedding_failed = False
+
+
+def normalize_query(user_query):
+    """Lowercase, strip punctuation and filler words so trivially different phrasings share a key"""
+    words = re.findall(r'[a-z0-9]+(?:\.[0-9]+)?', user_query.lower())
+    return ' '.join(_SYNONYMS.get(w, w) for w in words if w not in _FILLER_WORDS)
+
+
+def _embed(normalized):
+    """
+    Unit embedding of a normalized question, or None without an embedding model.
+    Word overlap alone cannot tell "revenue in North" from "revenue in South",
+    so there is no fallback to matching words.
+    """
+    global _embedding_model, _embedding_failed
+    if not ANSWER_CACHE_EMBEDDING_MODEL or ANSWER_CACHE_SIMILARITY <= 0 or _embedding_failed:
+        return None
+    try:
+        if _embedding_model is None:
+            from sentence_transformers import SentenceTransformer
+            _embedding_model = SentenceTransformer(ANSWER_CACHE_EMBEDDING_MODEL)
+    except Exception as e:
+        print(f"Embedding model unavailable, caching exact questions only: {str(e)}")
+        _embedding_failed = True
+        return None
+    try:
+        values = _embedding_model.encode(normalized, normalize_embeddings=True)
+    except Exception as e:
+        print(f"Failed to embed question: {str(e)}")
+        return None
+    return dict(enumerate(float(v) for v in values))
+
+
+def _similarity(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(v * b.get(k, 0.0) for k, v in a.items())
+
+
+def _numbers(normalized):
+    # "top 5" and "top 10" must never share an answer
+    return sorted(w for w in normalized.split() if w[0].isdigit())
+
+
+def _scope(filepath, chart_enabled, chart_type, approximate=False):
+    # Estimates from a sample never answer a question asked of the full data
+    return (dataset_fingerprint(filepath), bool(chart_enabled), chart_type if chart_enabled else None, bool(approximate))
+
+
+def _expire(now):
+    for key in [k for k, entry in _entries.items() if now - entry['created'] > ANSWER_CACHE_TTL_SECONDS]:
+        del _entries[key]
+        _stats['expirations'] += 1
+
+
+def lookup(user_query, filepath, chart_enabled=False, chart_type='auto', approximate=False):
+    """Return the cached {'response', 'visualization'} for this question, or None"""
+    scope = _scope(filepath, chart_enabled, chart_type, approximate)
+    normalized = normalize_query(user_query)
+    key = scope + (normalized,)
+    now = time.time()
+
+    with _lock:
+        _expire(now)
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+            _stats['hits'] += 1
+            return {'response': entry['response'], 'visualization': entry['visualization']}
+
+        if ANSWER_CACHE_EMBEDDING_MODEL and ANSWER_CACHE_SIMILARITY > 0 and normalized:
+            candidates = [(k, e) for k, e in _entries.items() if k[:len(scope)] == scope and e['vector']]
+        else:
+            candidates = []
+
+    vector = _embed(normalized) if candidates else None
+    if vector is not None:
+        numbers = _numbers(normalized)
+        best_key, best_entry, best_score = None, None, ANSWER_CACHE_SIMILARITY
+        for candidate_key, candidate in candidates:
+            if candidate['numbers'] != numbers:
+                continue
+            score = _similarity(vector, candidate['vector'])
+            if score >= best_score:
+                best_key, best_entry, best_score = candidate_key, candidate, score
+        if best_entry is not None:
+            with _lock:
+                if best_key in _entries:
+                    _entries.move_to_end(best_key)
+                _stats['hits'] += 1
+                _stats['semantic_hits'] += 1
+            return {'response': best_entry['response'], 'visualization': best_entry['visualization']}
+
+    with _lock:
+        _stats['misses'] += 1
+    return None
+
+
+def store(user_query, filepath, chart_enabled, chart_type, response, visualization, approximate=False):
+    """Cache a successful answer; failed agent runs are never cached"""
+    if not response or response == 'An error occurred, please try again later.':
+        return
+    if isinstance(visualization, dict) and 'error' in visualization:
+        return
+
+    scope = _scope(filepath, chart_enabled, chart_type, approximate)
+    normalized = normalize_query(user_query)
+    entry = {
+        'response': response,
+        'visualization': visualization,
+        'created': time.time(),
+        'vector': _embed(normalized),
+        'numbers': _numbers(normalized),
+    }
+    with _lock:
+        _entries[scope + (normalized,)] = entry
+        _entries.move_to_end(scope + (normalized,))
+        _stats['stores'] += 1
+        while len(_entries) > ANSWER_CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+            _stats['evictions'] += 1
+
+
+def invalidate(filepath=None):
+    """Drop cached answers for one dataset, or all of them"""
+    with _lock:
+        if filepath is None:
+            _entries.clear()
+            return
+        fingerprint = dataset_fingerprint(filepath)
+        for key in [k for k in _entries if k[0] == fingerprint]:
+            del _entries[key]
+
+
+def stats():
+    with _lock:
+        lookups = _stats['hits'] + _stats['misses']
+        return dict(_stats, size=len(_entries), hit_rate=round(_stats['hits'] / lookups, 4) if lookups else 0.0)
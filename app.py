@@ -1,12 +1,24 @@
-from flask import Flask, render_template, request, jsonify
-from insight_agent import Multi_agent_Conversation
-from visualization import execute_visualization_agent
-from crewai import LLM
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
+from query_pipeline import run_agents
+from get_tools.dataset_profile import get_profile
+from get_tools.ingestion import ingest_file
+from get_tools.upload_store import store_upload, retain_upload, release_chat, collect_garbage, upload_stats
+from job_queue import submit_job, completed_job, get_job, emit_progress, QueueFullError
+from get_tools.dataset_cache import cache_info
+from get_tools.data_sources import is_source, open_source, DataSourceError
+import answer_cache
+from get_tools.dataset_context import dataset_context, forget_chat
+from get_tools.chat_session import record_turn, is_follow_up, forget_session, session_stats
+from get_tools.approximate import (APPROXIMATE_MODE, APPROXIMATE_MIN_ROWS, ensure_synopsis,
+                                   wants_approximation)
+from get_tools.sandbox import start_sandbox_pool, preload_dataset
+from agent_runtime import get_llm
 import os
 from werkzeug.utils import secure_filename
-import pyodbc
+from chat_repository import repository
+from metrics import span, start_request, increment, render_prometheus
+from http_cache import cacheable_json, make_etag, not_modified
 import json
-from datetime import datetime
 import uuid
 
 app = Flask(__name__)
@@ -17,42 +29,32 @@ os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'xls'}
 
-# SQL Server Connection String
-# Configure in .env file
-DB_CONNECTION_STRING = '<your_db_connection_string>'
-
-llm = LLM(
-    model="<your_model>",
-    api_version="<your_api_version>",
-    base_url="<your_endpoint>",
-    api_key="<your_api_key>"
-)
-
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def save_to_database(chat_id, question, insight, visualization, filename):
-    """Save chat history to SQL Server"""
+def save_to_database(chat_id, question, insight, visualization, filename, filepath=None):
+    """Queue chat history for the batched background writer"""
     try:
-        conn = pyodbc.connect(DB_CONNECTION_STRING)
-        cursor = conn.cursor()
-        
-        # Convert visualization to JSON string
-        viz_json = json.dumps(visualization) if visualization else None
-        
-        cursor.execute('''
-            INSERT INTO ChatHistory (ChatID, Question, Insight, Visualization, Filename, DateTime)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (chat_id, question, insight, viz_json, filename, datetime.now()))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print(f"Chat {chat_id} saved to database")
-        return True
+        repository.save_chat(chat_id, question, insight, visualization, filename)
     except Exception as e:
         print(f"Database error: {str(e)}")
         return False
+    
+    # The stored upload is kept for as long as a chat refers to it
+    if filepath:
+        try:
+            retain_upload(filepath, chat_id, app.config['UPLOAD_FOLDER'])
+        except Exception as e:
+            print(f"Upload reference error: {str(e)}")
+    return True
+
+def release_uploads(chat_id=None):
+    """Drop the upload references of deleted chats and delete uploads nothing uses any more"""
+    try:
+        release_chat(chat_id, app.config['UPLOAD_FOLDER'])
+        collect_garbage(app.config['UPLOAD_FOLDER'])
+    except Exception as e:
+        print(f"Upload garbage collection failed: {str(e)}")
 
 
 @app.route('/')
@@ -77,9 +79,63 @@ def upload_file():
     
     try:
         filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
-        return jsonify({'success': True, 'filepath': filepath, 'filename': filename})
+        # Stored under its content hash: identical files share one copy, and with it
+        # the columnar copy, profile and cached answers derived from it
+        with span('upload.save'):
+            filepath, is_new = store_upload(file, filename, app.config['UPLOAD_FOLDER'])
+        if not is_new:
+            increment('uploads_deduplicated_total')
+        
+        # Convert to a compact, memory-mapped columnar copy the tools load from
+        with span('upload.ingest'):
+            ingest_file(filepath)
+        
+        # Profile once now; this also loads the file into the dataset cache
+        # so the first question reuses the cached DataFrame
+        try:
+            with span('upload.profile'):
+                get_profile(filepath)
+        except Exception as e:
+            print(f"Dataset profiling failed: {str(e)}")
+        
+        # In auto approximate mode large datasets get their sample and sketches right away
+        if APPROXIMATE_MODE == 'auto':
+            try:
+                if get_profile(filepath)['shape'][0] >= APPROXIMATE_MIN_ROWS:
+                    with span('upload.synopsis'):
+                        ensure_synopsis(filepath)
+            except Exception as e:
+                print(f"Sample and sketches not built: {str(e)}")
+        
+        # Let the code execution workers map the dataset before the first question
+        preload_dataset(filepath)
+        
+        # Uploads no chat ever used are otherwise never released
+        try:
+            collect_garbage(app.config['UPLOAD_FOLDER'], keep=[filepath])
+        except Exception as e:
+            print(f"Upload garbage collection failed: {str(e)}")
+        
+        return jsonify({'success': True, 'filepath': filepath, 'filename': filename, 'deduplicated': not is_new})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/connect', methods=['POST'])
+def connect_source():
+    """Use a SQL table or a directory of partitioned files as the dataset instead of an upload"""
+    source = (request.json or {}).get('source', '')
+    if not source or not is_source(source):
+        return jsonify({'error': 'Source must be sqlite:<path>?table=<name>, sqlserver:<schema.table>, '
+                                 'or a directory or glob of data files; upload single files through /upload'}), 400
+    
+    try:
+        # Profiled at the source, so nothing is copied here; the spec is the filepath from now on
+        with span('connect.profile'):
+            profile = get_profile(source)
+        return jsonify({'success': True, 'filepath': source, 'filename': open_source(source).name,
+                        'rows': profile['shape'][0]})
+    except DataSourceError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -89,72 +145,42 @@ def upload_file():
 
 @app.route('/get-conversations', methods=['GET'])
 def get_conversations():
-    """Fetch all conversations from SQL Server"""
+    """Fetch one page of conversation summaries; full messages load through /get-chat"""
+    limit = request.args.get('limit', 50, type=int)
+    cursor = request.args.get('cursor')
     try:
-        conn = pyodbc.connect(DB_CONNECTION_STRING)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT DISTINCT ChatID, Question, Insight, Visualization, Filename, DateTime FROM ChatHistory ORDER BY DateTime DESC')
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        conversations = []
-        for row in rows:
-            conversations.append({
-                'chatId': row[0],
-                'question': row[1],
-                'insight': row[2],
-                'visualization': json.loads(row[3]) if row[3] else None,
-                'filename': row[4],
-                'dateTime': row[5].isoformat() if row[5] else None
-            })
-        
-        return jsonify(conversations)
+        conversations, next_cursor = repository.get_conversations(limit, cursor)
+        return cacheable_json({'conversations': conversations, 'nextCursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         print(f"Database error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/get-chat/<chat_id>', methods=['GET'])
 def get_chat(chat_id):
-    """Fetch specific chat history from SQL Server"""
+    """Fetch specific chat history from the database"""
     try:
-        conn = pyodbc.connect(DB_CONNECTION_STRING)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT Question, Insight, Visualization FROM ChatHistory WHERE ChatID = ? ORDER BY DateTime ASC', (chat_id,))
-        rows = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        messages = []
-        for row in rows:
-            messages.append({
-                'role': 'user',
-                'content': row[0]
-            })
-            messages.append({
-                'role': 'assistant',
-                'content': row[1],
-                'visualization': json.loads(row[2]) if row[2] else None
-            })
-        
-        return jsonify({'messages': messages})
+        # The chat's summary row identifies its history, so a current client copy costs one key lookup
+        version = repository.chat_version(chat_id)
+        etag = make_etag('chat', chat_id, *version) if version else None
+        if etag:
+            cached = not_modified(etag)
+            if cached is not None:
+                return cached
+        return cacheable_json({'messages': repository.get_chat(chat_id)}, etag)
     except Exception as e:
         print(f"Database error: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/delete-chat/<chat_id>', methods=['DELETE'])
 def delete_chat(chat_id):
-    """Delete a specific chat from SQL Server"""
+    """Delete a specific chat from the database"""
     try:
-        conn = pyodbc.connect(DB_CONNECTION_STRING)
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM ChatHistory WHERE ChatID = ?', (chat_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        repository.delete_chat(chat_id)
+        forget_chat(chat_id)
+        forget_session(chat_id)
+        release_uploads(chat_id)
         
         return jsonify({'success': True, 'message': 'Chat deleted'})
     except Exception as e:
@@ -163,21 +189,70 @@ def delete_chat(chat_id):
 
 @app.route('/clear-all', methods=['DELETE'])
 def clear_all():
-    """Delete all chats from SQL Server"""
+    """Delete all chats from the database"""
     try:
-        conn = pyodbc.connect(DB_CONNECTION_STRING)
-        cursor = conn.cursor()
-        
-        cursor.execute('DELETE FROM ChatHistory')
-        conn.commit()
-        cursor.close()
-        conn.close()
+        repository.clear_all()
+        forget_chat()
+        forget_session()
+        release_uploads()
         
         return jsonify({'success': True, 'message': 'All conversations cleared'})
     except Exception as e:
         print(f"Database error: {str(e)}")
         return jsonify({'error': str(e)}), 500 
 
+def run_query(user_query, filepath, chart_enabled, chart_type, filename, chat_id, include_timings=False, approximate=False):
+    """Run both agents for one question and save the result; executed on the job queue"""
+    request_metrics = start_request()
+    # Answers to follow-ups depend on the chat they were asked in, so they are not shared
+    follow_up = is_follow_up(chat_id, user_query)
+    if approximate:
+        # Built on first use unless it was built at upload
+        with span('approximate.synopsis'):
+            approximate = ensure_synopsis(filepath) is not None
+        if approximate:
+            increment('approximate_queries_total')
+    # Tools resolve the dataset of this request, not whichever file another request loaded
+    with dataset_context(filepath, chat_id, approximate, user_query), span('query.pipeline'):
+        # Visualization is only generated if chart is enabled
+        response, visualizations = run_agents(user_query, filepath, chart_enabled, chart_type, chat_id)
+    
+    # Visualizations arrive as dicts with the data already bound on the server
+    if isinstance(visualizations, str):
+        try:
+            visualizations = json.loads(visualizations.replace('```json','').replace('```',''))
+        except:
+            visualizations = {"error": "Could not parse visualization"}
+    
+    if not follow_up:
+        answer_cache.store(user_query, filepath, chart_enabled, chart_type, response, visualizations, approximate)
+    record_turn(chat_id, user_query, response)
+    
+    # Save to database with received chatId
+    emit_progress('stage', {'name': 'saving'})
+    with span('db.save'):
+        save_to_database(chat_id, user_query, response, visualizations, filename, filepath)
+    
+    result = {
+        'chatId': chat_id,
+        'response': response,
+        'visualization': visualizations
+    }
+    if approximate:
+        result['approximate'] = True
+    if include_timings:
+        result['timings'] = request_metrics.summary()
+    return result
+
+def job_accepted(chat_id, job):
+    return jsonify({
+        'chatId': chat_id,
+        'jobId': job.id,
+        'status': job.status,
+        'statusUrl': f'/query/{job.id}',
+        'streamUrl': f'/query/{job.id}/stream'
+    }), 202
+
 @app.route('/query', methods=['POST'])
 def query():
     user_query = request.json.get('query', '')
@@ -186,6 +261,10 @@ def query():
     chart_type = request.json.get('chartType', 'auto')
     filename = request.json.get('filename', '')
     chat_id = request.json.get('chatId', '')  # Receive chatId from frontend
+    # Optional per-stage timing breakdown in the result
+    include_timings = bool(request.json.get('timings', False))
+    # Opt in to (true) or out of (false) answers estimated from samples and sketches
+    approximate = request.json.get('approximate')
     
     if not user_query:
         return jsonify({'error': 'Query cannot be empty'}), 400
@@ -196,34 +275,98 @@ def query():
     if not chat_id:
         return jsonify({'error': 'Chat ID missing'}), 400
     
+    request_metrics = start_request()
+    approximate = wants_approximation(user_query, filepath, None if approximate is None else bool(approximate))
+    cached = None
     try:
-        # Get response from the agent
-        response = Multi_agent_Conversation(user_query, filepath)
-        
-        visualizations = None
-        
-        # Only generate visualization if chart is enabled
-        if chart_enabled:
-            visualizations = execute_visualization_agent(user_query, response, filepath, chart_type)
-            visualizations = visualizations.replace('```json','').replace('```','')
-            
-            # Parse visualization JSON if it's a string
-            try:
-                if isinstance(visualizations, str):
-                    visualizations = json.loads(visualizations)
-            except:
-                visualizations = {"error": "Could not parse visualization"}
-        
-        # Save to database with received chatId
-        save_to_database(chat_id, user_query, response, visualizations, filename)
-        
-        return jsonify({
+        # Repeated questions on the same dataset skip the agents entirely, unless
+        # they build on earlier answers of this chat
+        if not is_follow_up(chat_id, user_query):
+            with span('answer_cache.lookup'):
+                cached = answer_cache.lookup(user_query, filepath, chart_enabled, chart_type, approximate)
+    except Exception as e:
+        print(f"Answer cache lookup failed: {str(e)}")
+    
+    if cached is not None:
+        increment('queries_total', path='cached')
+        record_turn(chat_id, user_query, cached['response'])
+        with span('db.save'):
+            save_to_database(chat_id, user_query, cached['response'], cached['visualization'], filename, filepath)
+        result = {
             'chatId': chat_id,
-            'response': response,
-            'visualization': visualizations
-        })
+            'response': cached['response'],
+            'visualization': cached['visualization'],
+            'cached': True
+        }
+        if approximate:
+            result['approximate'] = True
+        if include_timings:
+            result['timings'] = request_metrics.summary()
+        return job_accepted(chat_id, completed_job(result))
+    
+    try:
+        # Agents run on the background pool; the client polls or streams the job
+        job = submit_job(run_query, user_query, filepath, chart_enabled, chart_type, filename, chat_id,
+                         include_timings, approximate)
+    except QueueFullError as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '5'}
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    
+    return job_accepted(chat_id, job)
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    """Hit/miss counters of the answer cache, size of the dataset cache, upload store and chat sessions"""
+    return jsonify({
+        'answers': answer_cache.stats(),
+        'datasets': cache_info(),
+        'uploads': upload_stats(app.config['UPLOAD_FOLDER']),
+        'sessions': session_stats()
+    })
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Stage latencies, LLM and tool counters and memory in the Prometheus text format"""
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/query/<job_id>', methods=['GET'])
+def query_status(job_id):
+    """Poll the status, progress events and result of a query job"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    after = request.args.get('after', 0, type=int)
+    return jsonify(job.snapshot(after))
+
+@app.route('/query/<job_id>/stream', methods=['GET'])
+def query_stream(job_id):
+    """Stream the progress events of a query job as server-sent events"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def generate():
+        sent = 0
+        while True:
+            events = job.wait_for_events(sent, timeout=15)
+            if not events:
+                # Keep the connection alive through proxies while the agents work
+                yield ': keep-alive\n\n'
+                continue
+            for event in events:
+                yield f"event: {event['type']}\ndata: {json.dumps(event['data'], default=str)}\n\n"
+            sent += len(events)
+            if job.done and sent >= len(job.events):
+                break
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
\ No newline at end of file
+    # With the debug reloader only the serving child process needs the workers
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_sandbox_pool()
+        # Set up the shared LLM connection pool before the first question
+        get_llm()
+    app.run(debug=True, port=5000, threaded=True)
\ No newline at end of file
@@ -0,0 +1,67 @@
+"""
+Synthetic sales datasets of a requested size for the benchmarks.
+
+Files are generated once per (size, format) and kept in the cache directory,
+since writing a 50 MB spreadsheet takes longer than most benchmark runs.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+BRANDS = [f'Brand {i:02d}' for i in range(40)]
+CATEGORIES = ['Electronics', 'Home', 'Garden', 'Toys', 'Sports', 'Beauty', 'Books', 'Grocery']
+REGIONS = ['North', 'South', 'East', 'West', 'Central']
+CHANNELS = ['Online', 'Retail', 'Wholesale']
+SAMPLE_ROWS = 20_000
+
+
+def make_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    units = rng.integers(1, 20, rows)
+    price = rng.gamma(2.0, 25.0, rows).round(2)
+    return pd.DataFrame({
+        'Order ID': np.arange(1, rows + 1),
+        'Order Date': pd.Timestamp('2022-01-01') + pd.to_timedelta(rng.integers(0, 3 * 365, rows), unit='D'),
+        'Brand': rng.choice(BRANDS, rows),
+        'Category': rng.choice(CATEGORIES, rows),
+        'Region': rng.choice(REGIONS, rows),
+        'Channel': rng.choice(CHANNELS, rows),
+        'Customer': [f'Customer {i}' for i in rng.integers(0, 50_000, rows)],
+        'Units': units,
+        'Price': price,
+        'Discount': rng.choice([0.0, 0.05, 0.1, 0.2], rows),
+        'Revenue': (units * price).round(2),
+    })
+
+
+def _write(df, path, file_format):
+    if file_format == 'csv':
+        df.to_csv(path, index=False)
+    else:
+        df.to_excel(path, index=False)
+
+
+def _bytes_per_row(file_format, directory):
+    sample_path = os.path.join(directory, f'.sample.{file_format}')
+    _write(make_frame(SAMPLE_ROWS), sample_path, file_format)
+    size = os.path.getsize(sample_path)
+    os.remove(sample_path)
+    return size / SAMPLE_ROWS
+
+
+def dataset_path(size_mb, file_format, directory):
+    """Path of a synthetic dataset of about size_mb megabytes, generating it if needed"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'sales_{size_mb:g}mb.{file_format}')
+    if os.path.exists(path):
+        return path
+
+    target = size_mb * 1_000_000
+    rows = max(1, int(target / _bytes_per_row(file_format, directory)))
+    print(f"Generating {path} ({rows:,} rows)")
+    tmp_path = os.path.join(directory, f'.partial_{os.path.basename(path)}')
+    # Write under a temporary name so an interrupted run does not leave a short file behind
+    _write(make_frame(rows), tmp_path, file_format)
+    os.replace(tmp_path, path)
+    return path
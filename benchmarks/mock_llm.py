@@ -0,0 +1,100 @@
+"""
+Scripted stand-in for the LLM so the request path can be benchmarked offline.
+
+Every agent gets a fixed script: a few tool calls in CrewAI's ReAct text format,
+then a final answer. Tool calls run for real, so the benchmark measures the
+tools, chart binding and persistence, with MOCK_LLM_LATENCY_MS standing in for
+model round-trips.
+"""
+import os
+import re
+import json
+import time
+
+try:
+    from crewai import BaseLLM
+except ImportError:
+    from crewai.llms.base_llm import BaseLLM
+
+MOCK_LLM_LATENCY_MS = float(os.environ.get('MOCK_LLM_LATENCY_MS', 0))
+
+EXTRACTION_CODE = "answer = df.groupby('Region')['Revenue'].agg(['sum', 'mean', 'count']).round(2).reset_index()"
+INSIGHT_CODE = "answer = df.groupby('Brand')['Revenue'].sum().sort_values(ascending=False).round(2)"
+FILTER_CODE = "answer = df[df['Units'] > 5]"
+
+SINGLE_CHART_SPEC = {
+    'visualizationType': 'line', 'title': 'Revenue over time', 'dimension': 'Order Date',
+    'measures': ['Revenue'], 'aggregation': 'sum', 'timeGrain': 'day',
+}
+DASHBOARD_SPEC = {
+    'visualizationType': 'dashboard', 'title': 'Sales overview',
+    'charts': [
+        {'visualizationType': 'bar', 'title': 'Revenue by brand', 'dimension': 'Brand', 'measures': ['Revenue'], 'topN': 10},
+        {'visualizationType': 'pie', 'title': 'Orders by region', 'dimension': 'Region', 'aggregation': 'count'},
+        {'visualizationType': 'line', 'title': 'Monthly revenue', 'dimension': 'Order Date', 'measures': ['Revenue'], 'timeGrain': 'month'},
+        {'visualizationType': 'gauge', 'title': 'Average price', 'measures': ['Price'], 'aggregation': 'mean'},
+        {'visualizationType': 'scatter', 'title': 'Price vs units', 'measures': ['Price', 'Units']},
+        {'visualizationType': 'box', 'title': 'Revenue by category', 'dimension': 'Category', 'measures': ['Revenue']},
+    ],
+}
+
+
+def _action(tool, arguments):
+    return f"Thought: I need more data.\nAction: {tool}\nAction Input: {json.dumps(arguments)}"
+
+
+def _final(answer):
+    return f"Thought: I now know the final answer\nFinal Answer: {answer}"
+
+
+class ScriptedLLM(BaseLLM):
+    """Replays a fixed sequence of tool calls per agent role"""
+
+    def __init__(self, model='mock/scripted', **kwargs):
+        super().__init__(model=model, **kwargs)
+
+    def supports_function_calling(self):
+        # Tool calls are given as ReAct text, which CrewAI parses itself
+        return False
+
+    def supports_stop_words(self):
+        return True
+
+    def get_context_window_size(self):
+        return 128000
+
+    def _script(self, system, task):
+        filepath = re.search(r'Dataset filepath: (\S+)', task)
+        eda = _action('get_data_eda', {'filepath': filepath.group(1) if filepath else ''})
+        if 'data_extraction_agent' in system:
+            return [eda, _action('execute_python_code', {'code': EXTRACTION_CODE}), None]
+        if 'visualization_agent' in system:
+            spec = DASHBOARD_SPEC if 'dashboard' in task.lower() else SINGLE_CHART_SPEC
+            return [eda, _final(json.dumps(spec))]
+        return [
+            eda,
+            _action('execute_python_code', {'code': INSIGHT_CODE}),
+            _action('execute_python_code', {'code': FILTER_CODE}),
+            _final("Sure! Here are some useful insights:\n1. Revenue is concentrated in a few brands.\n"
+                   "2. Regions contribute evenly to total revenue."),
+        ]
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None, **kwargs):
+        if MOCK_LLM_LATENCY_MS:
+            time.sleep(MOCK_LLM_LATENCY_MS / 1000)
+        if isinstance(messages, str):
+            messages = [{'role': 'user', 'content': messages}]
+
+        system = ' '.join(m['content'] for m in messages if m.get('role') == 'system')
+        task = ' '.join(m['content'] for m in messages if m.get('role') == 'user')
+        conversation = ' '.join(m['content'] for m in messages if m.get('role') != 'system')
+        # Each earlier tool call left one observation in the conversation
+        step = max(0, conversation.count('Observation:') - task.count('Observation:'))
+
+        script = self._script(system or task, task)
+        reply = script[min(step, len(script) - 1)]
+        if reply is None:
+            # Hand back the last tool result as the answer, as the extraction agent does
+            observations = conversation.rsplit('Observation:', 1)
+            reply = _final(observations[-1].strip() if len(observations) > 1 else '{}')
+        return reply
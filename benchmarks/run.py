@@ -0,0 +1,212 @@
+"""
+End-to-end benchmark of /upload -> /query -> /get-chat with a scripted LLM.
+
+    python -m benchmarks.run --sizes 1,10,50 --formats csv,xlsx --iterations 5
+
+Every request goes through the Flask test client and the real job queue,
+tools, code sandbox, chart binding and chat repository; only the model is
+replaced by benchmarks.mock_llm.ScriptedLLM. Chat history goes to a
+throwaway SQLite database and uploads to a temporary directory.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Questions per scenario: (name, body fields). Each query scenario clears the
+# answer cache first so the pipeline runs every time.
+QUERY_SCENARIOS = [
+    ('query.fast_path', {'query': 'total Revenue by Region'}),
+    ('query.insight', {'query': 'Explain what drives revenue across brands'}),
+    ('query.chart', {'query': 'Explain how revenue changes over time', 'chartEnabled': True, 'chartType': 'line'}),
+    ('query.dashboard', {'query': 'Build a sales dashboard', 'chartEnabled': True, 'chartType': 'dashboard'}),
+]
+JOB_POLL_SECONDS = 0.005
+JOB_TIMEOUT_SECONDS = 600
+
+
+class RssSampler:
+    """Tracks the peak resident memory of this process while it runs"""
+
+    def __init__(self, interval=0.01):
+        from metrics import current_rss_bytes
+        self._read = current_rss_bytes
+        self._interval = interval
+        self._stop = threading.Event()
+        self.peak = self._read()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self):
+        while not self._stop.wait(self._interval):
+            self.peak = max(self.peak, self._read())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._read())
+
+
+def _prepare_environment(workdir):
+    """Point the app at throwaway storage; must run before the app is imported"""
+    os.environ.setdefault('DB_BACKEND', 'sqlite')
+    os.environ.setdefault('SQLITE_PATH', os.path.join(workdir, 'chat_history.db'))
+    os.chdir(workdir)
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+
+
+def _wait_for_job(client, status_url):
+    deadline = time.monotonic() + JOB_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        job = client.get(status_url).get_json()
+        if job['status'] in ('completed', 'failed'):
+            return job
+        time.sleep(JOB_POLL_SECONDS)
+    raise TimeoutError(f'{status_url} did not finish in {JOB_TIMEOUT_SECONDS}s')
+
+
+def _check(response, what):
+    if response.status_code >= 400:
+        raise RuntimeError(f'{what} failed with {response.status_code}: {response.get_data(as_text=True)[:500]}')
+    return response
+
+
+def upload(app, path, name=None):
+    with open(path, 'rb') as f:
+        response = app.test_client().post('/upload', data={'file': (f, name or os.path.basename(path))},
+                                          content_type='multipart/form-data')
+    return _check(response, 'upload').get_json()
+
+
+def ask(app, filepath, filename, body):
+    client = app.test_client()
+    payload = {'filepath': filepath, 'filename': filename, 'chatId': str(uuid.uuid4()), **body}
+    accepted = _check(client.post('/query', json=payload), 'query').get_json()
+    job = _wait_for_job(client, accepted['statusUrl'])
+    if job['status'] != 'completed':
+        raise RuntimeError(f"query '{body['query']}' failed: {job['error']}")
+    return payload['chatId']
+
+
+def get_chat(app, chat_id):
+    _check(app.test_client().get(f'/get-chat/{chat_id}'), 'get-chat')
+
+
+def measure(name, operation, iterations, concurrency, nbytes=0):
+    """Run operation(i) iterations times on concurrency threads and summarize the latencies"""
+    def timed(i):
+        start = time.perf_counter()
+        operation(i)
+        return time.perf_counter() - start
+
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(timed, range(iterations)))
+        wall = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    result = {
+        'scenario': name,
+        'iterations': iterations,
+        'concurrency': concurrency,
+        'throughput_per_s': round(iterations / wall, 3),
+        'p50_ms': round(p50 * 1000, 1),
+        'p95_ms': round(p95 * 1000, 1),
+        'p99_ms': round(p99 * 1000, 1),
+        'peak_rss_mb': round(rss.peak / 1024**2, 1),
+    }
+    if nbytes:
+        result['mb_per_s'] = round(nbytes * iterations / 1e6 / wall, 2)
+    return result
+
+
+def benchmark_dataset(app, path, iterations, concurrency):
+    import answer_cache
+    from chat_repository import repository
+
+    size = os.path.getsize(path)
+    # Only the first upload stores the file; repeats of the same content are deduplicated
+    results = [measure('upload', lambda i: upload(app, path, f'{i}_{os.path.basename(path)}'),
+                       iterations, concurrency, size)]
+    uploaded = upload(app, path)
+
+    chat_ids = []
+    for name, body in QUERY_SCENARIOS:
+        def run(i, body=body):
+            answer_cache.invalidate()
+            chat_ids.append(ask(app, uploaded['filepath'], uploaded['filename'], body))
+        results.append(measure(name, run, iterations, concurrency))
+
+    repository.flush()
+    results.append(measure('get-chat', lambda i: get_chat(app, chat_ids[i % len(chat_ids)]), iterations, concurrency))
+    results.append(measure('get-conversations', lambda i: _check(app.test_client().get('/get-conversations'),
+                                                                  'get-conversations'), iterations, concurrency))
+    for result in results:
+        result['dataset'] = os.path.basename(path)
+        result['dataset_mb'] = round(size / 1e6, 1)
+    return results
+
+
+def print_table(results):
+    columns = ['dataset', 'scenario', 'throughput_per_s', 'mb_per_s', 'p50_ms', 'p95_ms', 'p99_ms', 'peak_rss_mb']
+    rows = [[str(r.get(c, '')) for c in columns] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+    print('  '.join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print('  '.join(v.ljust(w) for v, w in zip(row, widths)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='1,10,50', help='dataset sizes in MB, comma separated')
+    parser.add_argument('--formats', default='csv,xlsx', help='csv and/or xlsx, comma separated')
+    parser.add_argument('--iterations', type=int, default=5, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=1, help='requests in flight per scenario')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'dataanalyzer-benchmark-data'),
+                        help='where generated datasets are kept between runs')
+    parser.add_argument('--json', dest='json_path', help='also write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    data_dir = os.path.abspath(args.data_dir)
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+    workdir = tempfile.mkdtemp(prefix='dataanalyzer-benchmark-')
+    _prepare_environment(workdir)
+
+    from benchmarks.datasets import dataset_path
+    from benchmarks.mock_llm import ScriptedLLM
+    from agent_runtime import set_llm
+    from get_tools.sandbox import start_sandbox_pool
+    from app import app
+
+    set_llm(ScriptedLLM())
+    start_sandbox_pool()
+
+    results = []
+    for file_format in args.formats.split(','):
+        for size in args.sizes.split(','):
+            path = dataset_path(float(size), file_format.strip(), data_dir)
+            results.extend(benchmark_dataset(app, path, args.iterations, args.concurrency))
+
+    print_table(results)
+    if json_path:
+        with open(json_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {json_path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,368 @@
+import os
+import math
+import operator
+
+import numpy as np
+import pandas as pd
+
+# Line, area and scatter series longer than this are downsampled
+CHART_MAX_POINTS = int(os.environ.get('CHART_MAX_POINTS', 1000))
+# Categories shown on bar, pie and treemap charts without an explicit topN
+CHART_MAX_CATEGORIES = int(os.environ.get('CHART_MAX_CATEGORIES', 50))
+
+CHART_TYPES = {'bar', 'line', 'area', 'pie', 'scatter', 'box', 'treemap', 'gauge', 'heatmap'}
+AGGREGATIONS = {'sum', 'mean', 'median', 'min', 'max', 'count'}
+TIME_GRAINS = {'day': 'D', 'week': 'W', 'month': 'M', 'quarter': 'Q', 'year': 'Y'}
+# Chart types drawn from a grouped aggregate, which a data source can compute itself
+_GROUPED_TYPES = {'bar', 'line', 'area', 'pie', 'treemap', 'heatmap'}
+# Per-group results of these stay exact when dates are grouped again into periods
+_COMBINABLE_AGGREGATIONS = {'sum', 'count', 'min', 'max'}
+_FILTER_OPERATORS = {
+    '==': operator.eq, '!=': operator.ne, '>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le,
+}
+
+COLORS = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#FFA07A', '#98D8C8', '#F7DC6F', '#B6FF6B', '#FFA06B']
+GRADIENT = ['#FF6B6B', '#FFA06B', '#FFD06B', '#FFFF6B', '#B6FF6B', '#6BFF6B']
+
+
+class ChartSpecError(ValueError):
+    """The chart spec is malformed or refers to columns the dataset does not have"""
+
+
+def is_chart_spec(value):
+    """A compact spec names columns instead of carrying an echartsOption"""
+    return isinstance(value, dict) and 'echartsOption' not in value and (
+        'dimension' in value or 'measures' in value or 'charts' in value
+    )
+
+
+def lttb_indices(values, threshold):
+    """Indices of the points kept by Largest-Triangle-Three-Buckets downsampling"""
+    n = len(values)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    y = np.nan_to_num(np.asarray(values, dtype=float))
+    x = np.arange(n, dtype=float)
+    every = (n - 2) / (threshold - 2)
+    kept = [0]
+    a = 0
+    for i in range(threshold - 2):
+        avg_start = int(math.floor((i + 1) * every)) + 1
+        avg_end = min(int(math.floor((i + 2) * every)) + 1, n)
+        avg_x, avg_y = x[avg_start:avg_end].mean(), y[avg_start:avg_end].mean()
+
+        start = int(math.floor(i * every)) + 1
+        end = int(math.floor((i + 1) * every)) + 1
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        kept.append(a)
+    kept.append(n - 1)
+    return np.asarray(kept)
+
+
+def _column(df, name):
+    if name not in df.columns:
+        raise ChartSpecError(f"Unknown column: {name}")
+    return df[name]
+
+
+def _apply_filters(df, filters):
+    for condition in filters or []:
+        column, op, value = condition.get('column'), condition.get('op', '=='), condition.get('value')
+        series = _column(df, column)
+        if op in ('in', 'not in'):
+            mask = series.isin(value if isinstance(value, list) else [value])
+            if op == 'not in':
+                mask = ~mask
+        elif op in _FILTER_OPERATORS:
+            mask = _FILTER_OPERATORS[op](series, value)
+        else:
+            raise ChartSpecError(f"Unsupported filter operator: {op}")
+        df = df[mask]
+    return df
+
+
+def _group_keys(series, grain):
+    if grain is None and not pd.api.types.is_datetime64_any_dtype(series):
+        return series, False
+    dates = series if pd.api.types.is_datetime64_any_dtype(series) else pd.to_datetime(series, errors='coerce')
+    if dates.notna().mean() < 0.8:
+        raise ChartSpecError(f"{series.name} is not a date column")
+    return dates.dt.to_period(TIME_GRAINS.get(grain, 'M')), True
+
+
+def aggregate(df, spec):
+    """Execute a spec's grouping; returns a DataFrame indexed by the dimension with one column per measure"""
+    aggregation = spec.get('aggregation') or 'sum'
+    if aggregation not in AGGREGATIONS:
+        raise ChartSpecError(f"Unsupported aggregation: {aggregation}")
+    measures = spec.get('measures') or []
+    for measure in measures:
+        if not pd.api.types.is_numeric_dtype(_column(df, measure)) and aggregation != 'count':
+            raise ChartSpecError(f"{measure} is not numeric")
+
+    keys, is_time = _group_keys(_column(df, spec['dimension']), spec.get('timeGrain'))
+    group_by = [keys]
+    if spec.get('series'):
+        group_by.append(_column(df, spec['series']))
+
+    if aggregation == 'count' or not measures:
+        result = df.groupby(group_by, observed=True).size().to_frame('count')
+    else:
+        result = df[measures].groupby(group_by, observed=True).agg(aggregation)
+
+    if spec.get('series'):
+        # One column per series value, e.g. revenue by month for each region
+        result = result.iloc[:, 0].unstack(fill_value=0)
+
+    sort = spec.get('sort') or ('none' if is_time else 'desc')
+    if is_time or sort == 'none':
+        result = result.sort_index()
+    else:
+        result = result.sort_values(result.columns[0], ascending=sort == 'asc')
+    if spec.get('topN'):
+        result = result.head(int(spec['topN']))
+    elif not is_time and spec.get('visualizationType') in ('bar', 'pie', 'treemap'):
+        result = result.head(CHART_MAX_CATEGORIES)
+
+    result.index = result.index.astype(str)
+    return result
+
+
+def _values(series):
+    return [None if pd.isna(v) else round(float(v), 2) for v in series]
+
+
+def echarts_option(chart_type, labels, columns, title):
+    """ECharts option for category labels and {series name: values}"""
+    option = {
+        'title': {'text': title, 'left': 'center'},
+        'tooltip': {'trigger': 'item' if chart_type in ('pie', 'treemap', 'gauge', 'scatter') else 'axis'},
+        'color': COLORS,
+        'animationDuration': 1000,
+        'animationEasing': 'cubicOut',
+    }
+    names = list(columns)
+
+    if chart_type in ('pie', 'treemap'):
+        values = columns[names[0]]
+        option['series'] = [{
+            'type': chart_type,
+            'name': names[0],
+            'data': [{'name': label, 'value': value} for label, value in zip(labels, values)],
+        }]
+        if chart_type == 'pie':
+            option['legend'] = {'type': 'scroll', 'orient': 'vertical', 'left': 'left'}
+            option['series'][0]['radius'] = ['35%', '65%']
+        return option
+
+    option['grid'] = {'left': '3%', 'right': '4%', 'bottom': '3%', 'containLabel': True}
+    option['legend'] = {'top': 'bottom'} if len(names) > 1 else {'show': False}
+    option['xAxis'] = {'type': 'category', 'data': labels}
+    option['yAxis'] = {'type': 'value'}
+    series = []
+    for name in names:
+        entry = {'type': 'bar' if chart_type == 'bar' else 'line', 'name': name, 'data': columns[name]}
+        if chart_type == 'bar' and len(names) == 1:
+            entry['colorBy'] = 'data'
+        if chart_type in ('line', 'area'):
+            entry['smooth'] = True
+            entry['showSymbol'] = len(labels) <= 50
+        if chart_type == 'area':
+            entry['areaStyle'] = {'opacity': 0.3}
+        series.append(entry)
+    if chart_type == 'bar' and len(names) == 1:
+        option['color'] = GRADIENT
+    option['series'] = series
+    return option
+
+
+def _bind_scatter(df, spec, title):
+    measures = spec.get('measures') or []
+    if len(measures) != 2:
+        raise ChartSpecError("A scatter chart needs exactly two measures")
+    points = df[[_column(df, m).name for m in measures]].dropna()
+    if len(points) > CHART_MAX_POINTS:
+        points = points.sample(CHART_MAX_POINTS, random_state=0)
+    return {
+        'title': {'text': title, 'left': 'center'},
+        'tooltip': {'trigger': 'item'},
+        'color': COLORS,
+        'grid': {'left': '3%', 'right': '4%', 'bottom': '3%', 'containLabel': True},
+        'xAxis': {'type': 'value', 'name': measures[0]},
+        'yAxis': {'type': 'value', 'name': measures[1]},
+        'series': [{'type': 'scatter', 'symbolSize': 6, 'data': points.round(2).values.tolist()}],
+    }
+
+
+def _bind_gauge(df, spec, title):
+    measures = spec.get('measures') or []
+    if len(measures) != 1:
+        raise ChartSpecError("A gauge needs exactly one measure")
+    series = _column(df, measures[0])
+    aggregation = spec.get('aggregation') or 'mean'
+    value = float(len(series) if aggregation == 'count' else series.agg(aggregation))
+    # A typical value is shown against the largest one; totals against some headroom
+    maximum = float(series.max()) if aggregation in ('mean', 'median', 'min', 'max') else value * 1.25
+    return {
+        'title': {'text': title, 'left': 'center'},
+        'tooltip': {'trigger': 'item'},
+        'series': [{
+            'type': 'gauge', 'min': 0, 'max': round(maximum or 1, 2),
+            'detail': {'valueAnimation': True}, 'data': [{'value': round(value, 2), 'name': measures[0]}],
+        }],
+    }
+
+
+def _bind_boxplot(df, spec, title):
+    measures = spec.get('measures') or []
+    if len(measures) != 1:
+        raise ChartSpecError("A box plot needs exactly one measure")
+    values = _column(df, measures[0])
+    if spec.get('dimension'):
+        keys = _column(df, spec['dimension'])
+        # The most frequent groups, computed with one vectorized quantile pass
+        groups = keys.value_counts().index[:int(spec.get('topN') or CHART_MAX_CATEGORIES)]
+        mask = keys.isin(groups)
+        stats = values[mask].groupby(keys[mask], observed=True).quantile([0, 0.25, 0.5, 0.75, 1]).unstack()
+        stats = stats.reindex(groups)
+    else:
+        stats = values.quantile([0, 0.25, 0.5, 0.75, 1]).to_frame(measures[0]).T
+    return {
+        'title': {'text': title, 'left': 'center'},
+        'tooltip': {'trigger': 'item'},
+        'color': COLORS,
+        'grid': {'left': '3%', 'right': '4%', 'bottom': '3%', 'containLabel': True},
+        'xAxis': {'type': 'category', 'data': [str(label) for label in stats.index]},
+        'yAxis': {'type': 'value', 'name': measures[0]},
+        'series': [{'type': 'boxplot', 'name': measures[0], 'data': [_values(row) for row in stats.itertuples(index=False)]}],
+    }
+
+
+def _bind_heatmap(df, spec, title):
+    if not spec.get('series'):
+        raise ChartSpecError("A heatmap needs a dimension and a series column")
+    table = aggregate(df, dict(spec, sort='none'))
+    x_labels, y_labels = list(table.index), [str(c) for c in table.columns]
+    data = [[i, j, v] for i, row in enumerate(table.itertuples(index=False)) for j, v in enumerate(_values(row))]
+    values = [v for _, _, v in data if v is not None]
+    return {
+        'title': {'text': title, 'left': 'center'},
+        'tooltip': {'position': 'top'},
+        'grid': {'left': '3%', 'right': '4%', 'bottom': '15%', 'containLabel': True},
+        'xAxis': {'type': 'category', 'data': x_labels},
+        'yAxis': {'type': 'category', 'data': y_labels},
+        'visualMap': {
+            'min': min(values, default=0), 'max': max(values, default=1), 'calculable': True,
+            'orient': 'horizontal', 'left': 'center', 'bottom': '0%', 'inRange': {'color': ['#4ECDC4', '#F7DC6F', '#FF6B6B']},
+        },
+        'series': [{'type': 'heatmap', 'data': data}],
+    }
+
+
+def _source_frame(source, spec):
+    """
+    Rows a data source returns for spec, and the spec that binds them: grouped at the
+    source for aggregated charts, otherwise only the used columns with filters applied.
+    """
+    chart_type = spec.get('visualizationType') or 'bar'
+    aggregation = spec.get('aggregation') or 'sum'
+    measures = spec.get('measures') or []
+    dimension = spec.get('dimension')
+    keys = [c for c in (dimension, spec.get('series')) if c]
+
+    if chart_type in _GROUPED_TYPES and dimension:
+        regrouped = spec.get('timeGrain') or pd.api.types.is_datetime64_any_dtype(_column(source.sample(), dimension))
+        if aggregation in _COMBINABLE_AGGREGATIONS or (aggregation == 'mean' and not regrouped):
+            if aggregation == 'count' or not measures:
+                frame = source.group(keys, {'count': ('count', None)}, spec.get('filters'))
+                return frame, dict(spec, filters=None, aggregation='sum', measures=['count'])
+            frame = source.group(keys, {m: (aggregation, m) for m in measures}, spec.get('filters'))
+            return frame, dict(spec, filters=None)
+
+    if chart_type == 'gauge' and len(measures) == 1 and aggregation in ('sum', 'count'):
+        # One total computed at the source; the gauge then shows that single row
+        column = None if aggregation == 'count' else measures[0]
+        frame = source.group([], {measures[0]: (aggregation, column)}, spec.get('filters'))
+        return frame, dict(spec, filters=None, aggregation='sum')
+
+    columns = keys + [m for m in measures if m not in keys]
+    return source.load(columns=columns, filters=spec.get('filters')), dict(spec, filters=None)
+
+
+def bind_chart(spec, df):
+    """
+    Execute one chart spec against df, a DataFrame or data source, and return a
+    visualization in the format the frontend renders: {'visualizationType', 'meta', 'echartsOption'}.
+    """
+    chart_type = spec.get('visualizationType') or 'bar'
+    if chart_type not in CHART_TYPES:
+        raise ChartSpecError(f"Unsupported chart type: {chart_type}")
+    approximation = None
+    if not isinstance(df, pd.DataFrame):
+        # A SQL table, partitioned files or a sample: filter and group at the source
+        source = df
+        df, spec = _source_frame(source, spec)
+        if getattr(source, 'approximate', False):
+            # Estimates from a sample come with '<name> ±' confidence half-widths
+            approximation = source.approximation(df)
+            df = df[[c for c in df.columns if not str(c).endswith(' ±')]]
+    df = _apply_filters(df, spec.get('filters'))
+    title = spec.get('title') or ''
+
+    if chart_type == 'scatter':
+        option = _bind_scatter(df, spec, title)
+    elif chart_type == 'gauge':
+        option = _bind_gauge(df, spec, title)
+    elif chart_type == 'box':
+        option = _bind_boxplot(df, spec, title)
+    elif chart_type == 'heatmap':
+        option = _bind_heatmap(df, spec, title)
+    else:
+        if not spec.get('dimension'):
+            raise ChartSpecError("A dimension column is required")
+        table = aggregate(df, spec)
+        if chart_type in ('line', 'area') and len(table) > CHART_MAX_POINTS:
+            # Keep the shape of long series while sending a bounded number of points
+            table = table.iloc[lttb_indices(table.iloc[:, 0].values, CHART_MAX_POINTS)]
+        columns = {str(name): _values(table[name]) for name in table.columns}
+        option = echarts_option(chart_type, list(table.index), columns, title)
+
+    meta = {
+        'title': title,
+        'description': spec.get('description', ''),
+        'insights': spec.get('insights', []),
+    }
+    if approximation:
+        meta['approximate'] = approximation
+    return {
+        'visualizationType': chart_type,
+        'meta': meta,
+        'echartsOption': option,
+    }
+
+
+def bind_visualization(spec, df):
+    """Bind a single chart spec, or a dashboard spec with a 'charts' list, to the data"""
+    if spec.get('visualizationType') != 'dashboard' and 'charts' not in spec:
+        return bind_chart(spec, df)
+
+    layouts = []
+    for chart in spec.get('charts') or []:
+        try:
+            layouts.append(bind_chart(chart, df))
+        except Exception as e:
+            # One bad panel should not cost the whole dashboard
+            print(f"Dashboard panel failed: {str(e)}")
+            layouts.append({
+                'visualizationType': chart.get('visualizationType', 'bar'),
+                'meta': {'title': chart.get('title', ''), 'error': str(e)},
+            })
+    if not any('echartsOption' in layout for layout in layouts):
+        raise ChartSpecError("No dashboard panel could be built")
+    return {
+        'visualizationType': 'dashboard',
+        'meta': {'title': spec.get('title', 'Dashboard'), 'description': spec.get('description', '')},
+        'layouts': layouts,
+    }
@@ -0,0 +1,480 @@
+import os
+import json
+import time
+import queue
+import atexit
+import base64
+import sqlite3
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+from metrics import span
+from visualization_store import pack_visualization, compress_style, unpack_visualizations
+
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
+
+# 'sqlserver' for production, 'sqlite' for tests and local development
+DB_BACKEND = os.environ.get('DB_BACKEND', 'sqlserver')
+# SQL Server Connection String
+# Configure in .env file
+DB_CONNECTION_STRING = os.environ.get('DB_CONNECTION_STRING', '<your_db_connection_string>')
+SQLITE_PATH = os.environ.get('SQLITE_PATH', 'chat_history.db')
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+# Inserts are written in batches of up to this many rows ...
+DB_WRITE_BATCH_SIZE = int(os.environ.get('DB_WRITE_BATCH_SIZE', 100))
+# ... or after waiting this long for the batch to fill up
+DB_WRITE_FLUSH_SECONDS = float(os.environ.get('DB_WRITE_FLUSH_SECONDS', 0.5))
+DB_WRITE_RETRIES = 3
+# Messages that still cannot be written are kept here and retried later instead of being lost
+DB_FAILED_WRITES_PATH = os.environ.get('DB_FAILED_WRITES_PATH', 'chat_history_failed.jsonl')
+FAILED_WRITES_RETRY_SECONDS = 60
+
+# Conversation list page sizes
+CONVERSATIONS_PAGE_SIZE = 50
+CONVERSATIONS_MAX_PAGE_SIZE = 200
+
+INSERT_CHAT_SQL = '''
+    INSERT INTO ChatHistory (ChatID, Question, Insight, Visualization, Filename, DateTime)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+
+class SqlServerBackend:
+    name = 'sqlserver'
+
+    # ChatSummary holds one lightweight row per chat for the conversation list
+    upsert_summary_sql = '''
+        MERGE ChatSummary WITH (HOLDLOCK) AS target
+        USING (SELECT ? AS ChatID, ? AS FirstQuestion, ? AS Filename, ? AS LastDateTime, ? AS MessageCount) AS source
+        ON target.ChatID = source.ChatID
+        WHEN MATCHED THEN UPDATE SET
+            Filename = source.Filename,
+            LastDateTime = CASE WHEN source.LastDateTime > target.LastDateTime THEN source.LastDateTime ELSE target.LastDateTime END,
+            MessageCount = target.MessageCount + source.MessageCount
+        WHEN NOT MATCHED THEN INSERT (ChatID, FirstQuestion, Filename, LastDateTime, MessageCount)
+            VALUES (source.ChatID, source.FirstQuestion, source.Filename, source.LastDateTime, source.MessageCount);
+    '''
+
+    # Style templates are shared by every chart styled alike, so each is written once
+    insert_style_sql = '''
+        MERGE VisualizationStyle WITH (HOLDLOCK) AS target
+        USING (SELECT ? AS StyleHash, ? AS Template) AS source
+        ON target.StyleHash = source.StyleHash
+        WHEN NOT MATCHED THEN INSERT (StyleHash, Template) VALUES (source.StyleHash, source.Template);
+    '''
+
+    def page_sql(self, where):
+        return f'''
+            SELECT TOP (?) ChatID, FirstQuestion, Filename, LastDateTime, MessageCount
+            FROM ChatSummary {where}
+            ORDER BY LastDateTime DESC, ChatID DESC
+        '''
+
+    def page_params(self, limit, params):
+        return (limit,) + params
+
+    def connect(self):
+        if pyodbc is None:
+            raise RuntimeError('pyodbc is not installed')
+        return pyodbc.connect(DB_CONNECTION_STRING)
+
+    def prepare_batch(self, cursor):
+        # Send the whole batch in one round trip instead of one per row
+        cursor.fast_executemany = True
+
+    def ensure_schema(self, conn):
+        # The SQL Server schema is created by the setup script in README.md
+        pass
+
+
+class SqliteBackend:
+    name = 'sqlite'
+
+    upsert_summary_sql = '''
+        INSERT INTO ChatSummary (ChatID, FirstQuestion, Filename, LastDateTime, MessageCount)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(ChatID) DO UPDATE SET
+            Filename = excluded.Filename,
+            LastDateTime = MAX(LastDateTime, excluded.LastDateTime),
+            MessageCount = MessageCount + excluded.MessageCount
+    '''
+
+    insert_style_sql = 'INSERT OR IGNORE INTO VisualizationStyle (StyleHash, Template) VALUES (?, ?)'
+
+    def page_sql(self, where):
+        return f'''
+            SELECT ChatID, FirstQuestion, Filename, LastDateTime, MessageCount
+            FROM ChatSummary {where}
+            ORDER BY LastDateTime DESC, ChatID DESC
+            LIMIT ?
+        '''
+
+    def page_params(self, limit, params):
+        return params + (limit,)
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+
+    def connect(self):
+        return sqlite3.connect(self.path, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES)
+
+    def prepare_batch(self, cursor):
+        pass
+
+    def ensure_schema(self, conn):
+        conn.executescript('''
+            CREATE TABLE IF NOT EXISTS ChatHistory (
+                Id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ChatID TEXT NOT NULL,
+                Question TEXT,
+                Insight TEXT,
+                Visualization TEXT,
+                Filename TEXT,
+                DateTime TIMESTAMP
+            );
+            CREATE INDEX IF NOT EXISTS idx_ChatID ON ChatHistory(ChatID);
+            CREATE INDEX IF NOT EXISTS idx_DateTime ON ChatHistory(DateTime);
+
+            CREATE TABLE IF NOT EXISTS ChatSummary (
+                ChatID TEXT PRIMARY KEY,
+                FirstQuestion TEXT,
+                Filename TEXT,
+                LastDateTime TIMESTAMP,
+                MessageCount INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_ChatSummary_LastDateTime ON ChatSummary(LastDateTime DESC, ChatID DESC);
+
+            CREATE TABLE IF NOT EXISTS VisualizationStyle (
+                StyleHash TEXT PRIMARY KEY,
+                Template TEXT NOT NULL
+            );
+        ''')
+        # Backfill summaries for history written before the table existed
+        conn.execute('''
+            INSERT INTO ChatSummary (ChatID, FirstQuestion, Filename, LastDateTime, MessageCount)
+            SELECT h.ChatID,
+                   (SELECT Question FROM ChatHistory f WHERE f.ChatID = h.ChatID ORDER BY f.DateTime, f.Id LIMIT 1),
+                   (SELECT Filename FROM ChatHistory l WHERE l.ChatID = h.ChatID ORDER BY l.DateTime DESC, l.Id DESC LIMIT 1),
+                   MAX(h.DateTime), COUNT(*)
+            FROM ChatHistory h
+            WHERE h.ChatID NOT IN (SELECT ChatID FROM ChatSummary)
+            GROUP BY h.ChatID
+        ''')
+        conn.commit()
+
+
+def encode_cursor(last_time, chat_id):
+    raw = json.dumps([last_time.isoformat(), chat_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Return (datetime, chat ID) from a page cursor, raising ValueError if it is malformed"""
+    try:
+        last_time, chat_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(last_time), chat_id
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def make_backend(name=DB_BACKEND):
+    if name == 'sqlite':
+        return SqliteBackend()
+    if name == 'sqlserver':
+        return SqlServerBackend()
+    raise ValueError(f"Unknown DB_BACKEND: {name}")
+
+
+class ConnectionPool:
+    """Keeps up to max_size idle connections open so requests skip the login handshake"""
+
+    def __init__(self, backend, max_size=DB_POOL_SIZE):
+        self.backend = backend
+        self._idle = queue.LifoQueue(maxsize=max_size)
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+
+    def _new_connection(self):
+        conn = self.backend.connect()
+        if not self._schema_ready:
+            with self._schema_lock:
+                if not self._schema_ready:
+                    self.backend.ensure_schema(conn)
+                    self._schema_ready = True
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._new_connection()
+        try:
+            yield conn
+        except Exception:
+            # The connection may be broken; do not hand it out again
+            try:
+                conn.close()
+            except Exception:
+                pass
+            raise
+        else:
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ChatRepository:
+    """
+    ChatHistory persistence with pooled connections and a write-behind queue:
+    saves return immediately and a background thread inserts them in batches.
+    Reads and deletes first wait for the saves queued before them, so they
+    always see them, but not for saves queued while they wait.
+    """
+
+    def __init__(self, backend):
+        self.pool = ConnectionPool(backend)
+        self._pending = queue.Queue()
+        # Saves queued and saves written (or given up on) so far; the writer takes them in queue order
+        self._progress = threading.Condition()
+        self._queued = 0
+        self._written = 0
+        self._failed_retried_at = None
+        self._writer = None
+        self._writer_lock = threading.Lock()
+        self._closed = False
+
+    # Writes
+
+    def save_chat(self, chat_id, question, insight, visualization, filename):
+        # Compressed, with the styling of its charts split out into shared templates
+        viz_text, styles = pack_visualization(visualization) if visualization else (None, {})
+        with self._progress:
+            self._pending.put(((chat_id, question, insight, viz_text, filename, datetime.now()), styles))
+            self._queued += 1
+        self._ensure_writer()
+
+    def _ensure_writer(self):
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._writer_lock:
+            if self._writer is None or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_loop, name='chat-writer', daemon=True)
+                self._writer.start()
+
+    def _next_batch(self):
+        batch = [self._pending.get()]
+        deadline = time.monotonic() + DB_WRITE_FLUSH_SECONDS
+        while len(batch) < DB_WRITE_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_loop(self):
+        self._requeue_failed()
+        while True:
+            batch = self._next_batch()
+            for attempt in range(1, DB_WRITE_RETRIES + 1):
+                try:
+                    self._insert_batch(batch)
+                    print(f"Saved {len(batch)} chat message(s) to database")
+                    if time.monotonic() - self._failed_retried_at >= FAILED_WRITES_RETRY_SECONDS:
+                        self._requeue_failed()
+                    break
+                except Exception as e:
+                    print(f"Database error (attempt {attempt}): {str(e)}")
+                    if attempt == DB_WRITE_RETRIES:
+                        self._keep_failed(batch)
+                    else:
+                        time.sleep(0.5 * attempt)
+            with self._progress:
+                self._written += len(batch)
+                self._progress.notify_all()
+
+    def _keep_failed(self, batch):
+        """Append a batch that could not be written to DB_FAILED_WRITES_PATH"""
+        chats = sorted({row[0] for row, _ in batch})
+        try:
+            with open(DB_FAILED_WRITES_PATH, 'a', encoding='utf-8') as f:
+                for row, styles in batch:
+                    record = {'row': list(row[:5]) + [row[5].isoformat()], 'styles': styles}
+                    f.write(json.dumps(record) + '\n')
+            print(f"Could not save {len(batch)} chat message(s) of chats {', '.join(chats)}; "
+                  f"kept in {DB_FAILED_WRITES_PATH} to retry")
+        except Exception as e:
+            print(f"Could not save or keep {len(batch)} chat message(s) of chats {', '.join(chats)}: {str(e)}")
+
+    def _requeue_failed(self):
+        """Queue the messages kept in DB_FAILED_WRITES_PATH again; ones that fail again are kept again"""
+        self._failed_retried_at = time.monotonic()
+        retrying = DB_FAILED_WRITES_PATH + '.retry'
+        try:
+            # A .retry file left by a process that stopped while requeueing is read first
+            if not os.path.exists(retrying):
+                if not os.path.exists(DB_FAILED_WRITES_PATH):
+                    return
+                os.replace(DB_FAILED_WRITES_PATH, retrying)
+            with open(retrying, encoding='utf-8') as f:
+                records = [json.loads(line) for line in f if line.strip()]
+        except Exception as e:
+            print(f"Could not read kept chat messages: {str(e)}")
+            return
+        with self._progress:
+            for record in records:
+                row = tuple(record['row'][:5]) + (datetime.fromisoformat(record['row'][5]),)
+                self._pending.put((row, record['styles']))
+                self._queued += 1
+        os.remove(retrying)
+        print(f"Retrying {len(records)} kept chat message(s)")
+
+    def _insert_batch(self, batch):
+        rows = [row for row, _ in batch]
+        styles = {}
+        for _, row_styles in batch:
+            styles.update(row_styles)
+
+        # One summary row per chat in the batch: first question, latest filename and time, message count
+        summaries = {}
+        for chat_id, question, _, _, filename, saved_at in rows:
+            summary = summaries.setdefault(chat_id, [chat_id, question, filename, saved_at, 0])
+            summary[2], summary[3] = filename, max(summary[3], saved_at)
+            summary[4] += 1
+
+        with span('db.insert_batch'), self.pool.connection() as conn:
+            cursor = conn.cursor()
+            self.pool.backend.prepare_batch(cursor)
+            # In the same transaction as the rows that refer to them
+            if styles:
+                cursor.executemany(self.pool.backend.insert_style_sql,
+                                   [(key, compress_style(template)) for key, template in styles.items()])
+            cursor.executemany(INSERT_CHAT_SQL, rows)
+            cursor.executemany(self.pool.backend.upsert_summary_sql, [tuple(s) for s in summaries.values()])
+            conn.commit()
+            cursor.close()
+
+    def flush(self):
+        """Block until every save queued before this call has been written (or given up on)"""
+        with self._progress:
+            queued = self._queued
+            self._progress.wait_for(lambda: self._written >= queued)
+
+    # Reads
+
+    def _fetch(self, sql, params=()):
+        self.flush()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            cursor.close()
+            return rows
+
+    def _execute(self, sql, params=()):
+        self.flush()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            conn.commit()
+            cursor.close()
+
+    def get_conversations(self, limit=CONVERSATIONS_PAGE_SIZE, cursor=None):
+        """
+        Return one page of conversation summaries, newest first, and the cursor of
+        the next page (None on the last page). Pages are keyed on (last time, chat ID)
+        so each one is an index seek regardless of how deep the client has scrolled.
+        """
+        limit = max(1, min(int(limit), CONVERSATIONS_MAX_PAGE_SIZE))
+        where, params = '', ()
+        if cursor:
+            last_time, last_chat_id = decode_cursor(cursor)
+            where = 'WHERE LastDateTime < ? OR (LastDateTime = ? AND ChatID < ?)'
+            params = (last_time, last_time, last_chat_id)
+
+        backend = self.pool.backend
+        # Fetch one extra row to know whether another page follows
+        rows = self._fetch(backend.page_sql(where), backend.page_params(limit + 1, params))
+        conversations = [{
+            'chatId': row[0],
+            'question': row[1],
+            'filename': row[2],
+            'dateTime': row[3].isoformat() if row[3] else None,
+            'messageCount': row[4]
+        } for row in rows[:limit]]
+
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            next_cursor = encode_cursor(last[3], last[0])
+        return conversations, next_cursor
+
+    def _fetch_styles(self, keys):
+        placeholders = ', '.join('?' for _ in keys)
+        rows = self._fetch(f'SELECT StyleHash, Template FROM VisualizationStyle WHERE StyleHash IN ({placeholders})',
+                           tuple(keys))
+        return {row[0]: row[1] for row in rows}
+
+    def chat_version(self, chat_id):
+        """
+        (last message time, message count) of a chat from its summary row, or None
+        if it has none. Changes whenever messages are added, so it stands in for
+        the whole history when revalidating a client's copy.
+        """
+        rows = self._fetch('SELECT LastDateTime, MessageCount FROM ChatSummary WHERE ChatID = ?', (chat_id,))
+        if not rows:
+            return None
+        return (rows[0][0].isoformat() if rows[0][0] else None, rows[0][1])
+
+    def get_chat(self, chat_id):
+        rows = self._fetch('SELECT Question, Insight, Visualization FROM ChatHistory WHERE ChatID = ? ORDER BY DateTime ASC', (chat_id,))
+        visualizations = unpack_visualizations([row[2] for row in rows], self._fetch_styles)
+        messages = []
+        for row, visualization in zip(rows, visualizations):
+            messages.append({
+                'role': 'user',
+                'content': row[0]
+            })
+            messages.append({
+                'role': 'assistant',
+                'content': row[1],
+                'visualization': visualization
+            })
+        return messages
+
+    def delete_chat(self, chat_id):
+        self._execute('DELETE FROM ChatHistory WHERE ChatID = ?', (chat_id,))
+        self._execute('DELETE FROM ChatSummary WHERE ChatID = ?', (chat_id,))
+
+    def clear_all(self):
+        self._execute('DELETE FROM ChatHistory')
+        self._execute('DELETE FROM ChatSummary')
+        self._execute('DELETE FROM VisualizationStyle')
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._writer is not None and self._writer.is_alive():
+            self.flush()
+        self.pool.close()
+
+
+repository = ChatRepository(make_backend())
+atexit.register(repository.close)
@@ -0,0 +1,159 @@
+import os
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from chart_binding import bind_chart, is_chart_spec
+from get_tools.approximate import open_for_charts
+from get_tools.dataset_profile import get_profile
+from get_tools.schema_summary import is_identifier
+from query_planner import is_date_column
+from visualization import plan_chart_spec, chart_instruction, repair_instruction
+from job_queue import emit_progress
+from metrics import span
+
+DASHBOARD_PANELS = 6
+# Panels built at the same time across all dashboards
+DASHBOARD_WORKERS = int(os.environ.get('DASHBOARD_WORKERS', 6))
+# Time limit of each panel, counted from when a worker starts it; a panel still
+# waiting for a worker after this long is dropped as well
+DASHBOARD_PANEL_TIMEOUT_SECONDS = float(os.environ.get('DASHBOARD_PANEL_TIMEOUT_SECONDS', 90))
+# Times a failed panel spec is sent back to the agent with its error
+DASHBOARD_PANEL_RETRIES = int(os.environ.get('DASHBOARD_PANEL_RETRIES', 1))
+
+_panel_executor = ThreadPoolExecutor(max_workers=DASHBOARD_WORKERS, thread_name_prefix='dashboard-panel')
+
+
+def default_dashboard_specs(profile):
+    """Six chart specs chosen from the profile alone, used when the agent cannot plan a dashboard"""
+    cardinality = profile.get('cardinality', {})
+    # Chunked profiles store a lower bound such as '>100000' for very large counts
+    categories = [c for c in profile['categorical_columns']
+                  if isinstance(cardinality.get(c), int) and 2 <= cardinality[c] <= 50
+                  and not is_date_column(c, profile)]
+    measures = [c for c in profile['numeric_columns'] if not is_identifier(profile, c)]
+    dates = [c for c in profile['columns'] if is_date_column(c, profile)]
+
+    specs = []
+    if measures and categories:
+        specs.append({'visualizationType': 'bar', 'title': f'Total {measures[0]} by {categories[0]}',
+                      'dimension': categories[0], 'measures': [measures[0]], 'aggregation': 'sum', 'topN': 10})
+    if categories:
+        category = categories[1] if len(categories) > 1 else categories[0]
+        specs.append({'visualizationType': 'pie', 'title': f'Rows by {category}',
+                      'dimension': category, 'aggregation': 'count', 'topN': 8})
+    if measures and dates:
+        specs.append({'visualizationType': 'line', 'title': f'{measures[0]} over time',
+                      'dimension': dates[0], 'measures': [measures[0]], 'aggregation': 'sum', 'timeGrain': 'month'})
+    if measures:
+        specs.append({'visualizationType': 'gauge', 'title': f'Average {measures[0]}',
+                      'measures': [measures[0]], 'aggregation': 'mean'})
+    if len(measures) > 1:
+        specs.append({'visualizationType': 'scatter', 'title': f'{measures[0]} vs {measures[1]}',
+                      'measures': measures[:2]})
+    if measures and categories:
+        specs.append({'visualizationType': 'box', 'title': f'{measures[0]} distribution by {categories[0]}',
+                      'dimension': categories[0], 'measures': [measures[0]]})
+        measure = measures[1] if len(measures) > 1 else measures[0]
+        specs.append({'visualizationType': 'treemap', 'title': f'Total {measure} by {categories[-1]}',
+                      'dimension': categories[-1], 'measures': [measure], 'aggregation': 'sum', 'topN': 20})
+    return specs[:DASHBOARD_PANELS]
+
+
+def _plan(user_query, agent_response, filepath, extracted_data, chat_context):
+    try:
+        plan = plan_chart_spec(user_query, agent_response, filepath, chart_instruction('dashboard'),
+                               extracted_data, chat_context)
+        charts = [c for c in plan.get('charts') or plan.get('layouts') or [] if is_chart_spec(c)]
+        if charts:
+            return plan.get('title', 'Dashboard'), charts[:DASHBOARD_PANELS]
+        print("Dashboard plan had no chart specs, using the default layout")
+    except Exception as e:
+        print(f"Dashboard planning failed, using the default layout: {str(e)}")
+    return 'Dashboard', default_dashboard_specs(get_profile(filepath))
+
+
+def _build_panel(spec, df, user_query, filepath, state):
+    """
+    Bind one panel, asking the agent to repair its spec after a failure. No repair
+    is started once the panel's time limit has passed or it was given up on.
+    """
+    state['started'] = time.monotonic()
+    deadline = state['started'] + DASHBOARD_PANEL_TIMEOUT_SECONDS
+    for attempt in range(DASHBOARD_PANEL_RETRIES + 1):
+        try:
+            with span('dashboard.panel'):
+                return bind_chart(spec, df)
+        except Exception as e:
+            if (attempt == DASHBOARD_PANEL_RETRIES or state['cancelled'].is_set()
+                    or time.monotonic() >= deadline):
+                raise
+            print(f"Dashboard panel '{spec.get('title', '')}' failed, retrying: {str(e)}")
+            spec = plan_chart_spec(user_query, None, filepath, repair_instruction(spec, str(e)))
+
+
+def _failed_panel(spec, error):
+    return {
+        'visualizationType': spec.get('visualizationType', 'bar'),
+        'meta': {'title': spec.get('title', ''), 'error': error},
+    }
+
+
+def generate_dashboard(user_query, agent_response, filepath, extracted_data=None, chat_context=''):
+    """
+    Plan the dashboard's chart specs in one agent call, then build every panel
+    concurrently. A panel that still fails after its retries, or runs past its
+    own time limit, is returned with an error instead of failing the dashboard.
+    """
+    title, specs = _plan(user_query, agent_response, filepath, extracted_data, chat_context)
+    if not specs:
+        return {'error': 'Visualization generation failed: no charts could be planned for this dataset'}
+
+    # A SQL table, partitioned files or a sample in approximate mode stay at the
+    # source; each panel pushes its grouping down
+    df = open_for_charts(filepath)
+    emit_progress('dashboard', {'panels': len(specs)})
+    submitted = time.monotonic()
+    states = [{'started': None, 'cancelled': threading.Event()} for _ in specs]
+    futures = {
+        _panel_executor.submit(contextvars.copy_context().run, _build_panel, spec, df, user_query, filepath, state): index
+        for index, (spec, state) in enumerate(zip(specs, states))
+    }
+
+    layouts = [None] * len(specs)
+
+    def finish(index, layout):
+        layouts[index] = layout
+        emit_progress('panel', {'index': index, 'ok': 'echartsOption' in layout})
+
+    pending = set(futures)
+    while pending:
+        for future in wait(pending, timeout=0, return_when=FIRST_COMPLETED)[0]:
+            pending.discard(future)
+            index = futures[future]
+            try:
+                finish(index, future.result())
+            except Exception as e:
+                print(f"Dashboard panel '{specs[index].get('title', '')}' failed: {str(e)}")
+                finish(index, _failed_panel(specs[index], str(e)))
+
+        # Each panel's limit runs from its own start, or from submission while it waits for a worker
+        now = time.monotonic()
+        expiries = {}
+        for future in list(pending):
+            expiry = (states[futures[future]]['started'] or submitted) + DASHBOARD_PANEL_TIMEOUT_SECONDS
+            if expiry > now:
+                expiries[future] = expiry
+                continue
+            # A queued panel never starts; a running one stops before its next repair
+            pending.discard(future)
+            future.cancel()
+            states[futures[future]]['cancelled'].set()
+            finish(futures[future], _failed_panel(specs[futures[future]], 'Timed out'))
+        if pending:
+            wait(pending, timeout=min(expiries.values()) - now, return_when=FIRST_COMPLETED)
+
+    if not any('echartsOption' in layout for layout in layouts):
+        return {'error': 'Visualization generation failed: no dashboard panel could be built'}
+    return {'visualizationType': 'dashboard', 'meta': {'title': title}, 'layouts': layouts}
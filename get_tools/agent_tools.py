@@ -1,55 +1,50 @@
 from crewai.tools import tool
-import pandas as pd
-import json
-from io import StringIO
-import sys
-
-# Global variable to store loaded dataframe
-loaded_dataframe = None
+from get_tools.schema_summary import eda_json
+from get_tools.data_sources import is_source
+from get_tools.dataset_context import bind_dataset, current_dataset, resolve_filepath, is_approximate
+from get_tools.approximate import approximate_profile_json, load_synopsis, result_note
+from get_tools.sandbox import execute_code
+from get_tools.chat_session import referenced_results, remember_result
+from metrics import tool_span, increment
 
 @tool('get_data_eda')
-def get_data_eda(filepath: str) -> str:
+def get_data_eda(filepath: str, columns: str = '') -> str:
     '''
-    Load a CSV or Excel file and return comprehensive EDA information including:
+    Load a CSV or Excel file, SQL table or directory of partitioned files and
+    return comprehensive EDA information including:
     - Dataset shape, columns, data types
     - Missing values summary
     - Basic statistics
+    - Most frequent values and cardinality per column
     - Sample data
+    
+    For wide tables it returns every column name grouped by type, with details
+    only for the columns most relevant to the question. Pass columns as a comma
+    separated list of names (e.g. columns='Region,Revenue') for details of others.
     '''
-    global loaded_dataframe
-    try:
-        if filepath.endswith('.csv'):
-            df = pd.read_csv(filepath)
-        elif filepath.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(filepath)
-        else:
-            return "Error: Unsupported file format. Use CSV or Excel files."
-        
-        loaded_dataframe = df
-        
-        data_types_dict = {col: str(dtype) for col, dtype in df.dtypes.items()}
+    with tool_span('get_data_eda'):
+        try:
+            if not filepath.endswith(('.csv', '.xlsx', '.xls')) and not is_source(filepath):
+                return "Error: Unsupported file format. Use CSV or Excel files."
         
-        eda_info = {
-            "shape": df.shape,
-            "columns": df.columns.tolist(),
-            "data_types": data_types_dict,
-            "missing_values": df.isnull().sum().to_dict(),
-            "numeric_columns": df.select_dtypes(include=['number']).columns.tolist(),
-            "categorical_columns": df.select_dtypes(include=['object']).columns.tolist(),
-            "basic_stats": df.describe().to_dict(),
-            "sample_data": df.head(5).to_dict(),
-            "memory_usage": str(df.memory_usage(deep=True).sum() / 1024**2) + " MB"
-        }
+            # Outside a request context (e.g. scripts), remember the dataset for execute_python_code
+            if current_dataset() is None:
+                bind_dataset(filepath)
         
-        return json.dumps(eda_info, indent=2)
-    except Exception as e:
-        return f"Error loading dataset: {str(e)}"
+            # Precomputed at upload and stored next to the file
+            question = (current_dataset() or {}).get('question') or ''
+            if is_approximate():
+                return approximate_profile_json(filepath, question, columns)
+            return eda_json(filepath, question, columns)
+        except Exception as e:
+            return f"Error loading dataset: {str(e)}"
     
 @tool('execute_python_code')
-def execute_python_code(code: str) -> str:
+def execute_python_code(code: str, filepath: str = '') -> str:
     '''
     Execute Python code for data processing and analysis.
-    The global 'df' variable contains the loaded dataset.
+    The global 'df' variable contains the dataset of the current request,
+    or the dataset at 'filepath' when it is given.
     
     IMPORTANT: Always store results in a variable called 'answer' at the end of your code.
     
@@ -58,52 +53,48 @@ def execute_python_code(code: str) -> str:
     2. For calculations: answer = df['Revenue'].sum()
     3. For filtering: answer = df[df['Category'] == 'Electronics']
     
-    Return results as JSON string.
-    '''
-    global loaded_dataframe
+    For SQL tables and partitioned datasets (filepath starting with 'sqlite:' or
+    'sqlserver:', or a directory), prefer query(sql), which runs a SELECT at the
+    source with the dataset as the table 'data' and returns a DataFrame:
+    answer = query('SELECT Brand, SUM(Revenue) AS revenue FROM data GROUP BY Brand ORDER BY revenue DESC')
+    df is then only loaded when the code uses it.
     
-    if loaded_dataframe is None:
-        return "Error: No dataset loaded. Use get_data_eda first."
+    Return results as compact JSON string. Large results are summarized (row count,
+    head/tail rows, column stats) with a 'handle'; continue from such a result with
+    result = load_result('<handle>') instead of recomputing it.
     
-    try:
-        # Create a safe execution environment
-        local_env = {
-            'df': loaded_dataframe,
-            'pd': pd,
-            'json': json,
-            'answer': None
-        }
-        
-        # Capture output
-        old_stdout = sys.stdout
-        sys.stdout = StringIO()
-        
+    DataFrame answers are kept for follow-up questions in the same chat as
+    results['r1'], results['r2'], ...; refine those instead of starting over:
+    answer = results['r2'].groupby('Region')['Revenue'].sum()
+    
+    When the result starts with [Approximate: ...], df is a uniform random sample
+    of a large dataset. Means, shares and rankings carry over; for totals and
+    counts with confidence bounds use estimate_total(values), estimate_count(mask)
+    and estimate_mean(values), which return {'estimate', 'margin', 'confidence'}.
+    '''
+    with tool_span('execute_python_code'):
         try:
-            # Execute the code
-            exec(code, local_env)
-            result = local_env.get('answer', None)
-        except Exception as exec_error:
-            sys.stdout = old_stdout
-            return f"Error in code execution: {str(exec_error)}"
-        
-        output = sys.stdout.getvalue()
-        sys.stdout = old_stdout
-        
-        # Return the evaluated result
-        if result is not None:
-            if isinstance(result, pd.DataFrame):
-                return result.to_json(orient='records', indent=2, default_handler=str)
-            elif isinstance(result, pd.Series):
-                return json.dumps(result.to_dict(), indent=2, default=str)
-            elif isinstance(result, dict):
-                return json.dumps(result, indent=2, default=str)
-            elif isinstance(result, list):
-                return json.dumps(result, indent=2, default=str)
-            else:
-                return str(result)
-        
-        return output if output else "Code executed successfully"
+            resolved = resolve_filepath(filepath)
+        except Exception as e:
+            return f"Error loading dataset: {str(e)}"
+    
+        if resolved is None:
+            return "Error: No dataset loaded. Use get_data_eda first."
+    
+        binding = current_dataset() or {}
+        chat_id = binding.get('chat_id')
+        results = referenced_results(chat_id, code)
+        if results:
+            increment('session_results_reused_total', len(results))
     
-    except Exception as e:
-        sys.stdout = old_stdout
-        return f"Error: {str(e)}"
+        approximate = bool(binding.get('approximate'))
+        # Runs in a resource-limited worker process so runaway code cannot stall the server
+        reply, answer = execute_code(resolved, code, results, approximate)
+        if chat_id and answer is not None:
+            name = remember_result(chat_id, resolved, code, answer)
+            reply = f"{reply}\n[kept as results['{name}']]"
+        if approximate and not reply.startswith('Error'):
+            synopsis = load_synopsis(resolved)
+            if synopsis is not None:
+                reply = f"{result_note(synopsis)}\n{reply}"
+        return reply
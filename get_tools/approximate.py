@@ -0,0 +1,494 @@
+import os
+import re
+import math
+import threading
+from collections import OrderedDict
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from get_tools.dataset_cache import dataset_key, open_dataset
+from get_tools.dataset_context import is_approximate
+from get_tools.dataset_profile import cached_profile, get_profile
+from get_tools.data_sources import DataSource, DataSourceError, GROUP_AGGREGATIONS, filter_frame, is_source
+from get_tools.ingestion import iter_chunks
+from get_tools.result_shaping import compact_json
+from get_tools.schema_summary import eda_json, requested_columns, tiered_profile
+
+# 'off': approximate only when a query asks for it; 'auto': also for exploratory questions on large datasets
+APPROXIMATE_MODE = os.environ.get('APPROXIMATE_MODE', 'off')
+# Datasets smaller than this are always analysed exactly
+APPROXIMATE_MIN_ROWS = int(os.environ.get('APPROXIMATE_MIN_ROWS', 500_000))
+# Rows in the stratified sample, shared out evenly across the strata
+APPROXIMATE_SAMPLE_ROWS = int(os.environ.get('APPROXIMATE_SAMPLE_ROWS', 100_000))
+# Confidence level of the reported bounds
+APPROXIMATE_CONFIDENCE = float(os.environ.get('APPROXIMATE_CONFIDENCE', 0.95))
+# A text column with at most this many values in the first chunk stratifies the sample
+APPROXIMATE_STRATA_MAX = 64
+# HyperLogLog registers per column: 2**12, about 1.6% standard error
+HLL_PRECISION = 12
+# Misra-Gries counters per text column
+HEAVY_HITTER_COUNTERS = 64
+HEAVY_HITTERS_REPORTED = 10
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+# Sketch results keyed by column, cut down with the EDA profile of wide tables
+_PER_COLUMN_SKETCHES = ('totals_exact', 'missing_exact', 'distinct_estimate', 'quantiles', 'heavy_hitters')
+SYNOPSIS_CACHE_SIZE = 8
+
+# Questions that need every row counted
+_EXACT_PATTERN = re.compile(r"\b(exact|exactly|precise|precisely|audit|reconcile)\b", re.IGNORECASE)
+# Questions that explore the data, where estimates with bounds answer as well as exact figures
+_EXPLORATORY_PATTERN = re.compile(
+    r"\b(insights?|overview|explore|exploratory|summar\w*|analy[sz]e|analysis|trends?|patterns?|"
+    r"distributions?|drivers?|dashboard)\b",
+    re.IGNORECASE,
+)
+
+_KEY, _STRATUM = '__key__', '__stratum__'
+_OTHER, _MISSING = '(other)', '(missing)'
+
+# dataset key -> synopsis, least recently used first
+_synopses = OrderedDict()
+_synopses_lock = threading.Lock()
+_build_locks = {}
+
+
+def synopsis_path(filepath):
+    """Return the path of the samples and sketches stored next to the dataset file"""
+    return filepath + '.synopsis.pkl'
+
+
+def _z():
+    return NormalDist().inv_cdf((1 + APPROXIMATE_CONFIDENCE) / 2)
+
+
+def _is_text(series):
+    return isinstance(series.dtype, (pd.CategoricalDtype, pd.StringDtype)) or series.dtype == object
+
+
+def _hll_update(registers, series):
+    """Fold the values of series into HyperLogLog registers"""
+    values = series.dropna()
+    if values.empty:
+        return
+    hashes = pd.util.hash_pandas_object(values, index=False).to_numpy(dtype=np.uint64)
+    index = (hashes >> np.uint64(64 - HLL_PRECISION)).astype(np.intp)
+    # A guard bit below the shifted hash caps the rank at 65 - precision
+    rest = (hashes << np.uint64(HLL_PRECISION)) | np.uint64(1 << (HLL_PRECISION - 1))
+    rank = 64 - np.floor(np.log2(rest.astype(np.float64))).astype(np.int64)
+    np.maximum.at(registers, index, np.clip(rank, 1, 64).astype(np.uint8))
+
+
+def hll_estimate(registers):
+    """Distinct count estimated from HyperLogLog registers, with linear counting for small counts"""
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / float(np.sum(np.exp2(-registers.astype(np.float64))))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * math.log(m / zeros)
+    return estimate
+
+
+def _misra_gries(counters, series):
+    """Merge one chunk into Misra-Gries counters; returns the counters and the count subtracted from each"""
+    merged = series.value_counts() if counters is None else counters.add(series.value_counts(), fill_value=0)
+    if len(merged) <= HEAVY_HITTER_COUNTERS:
+        return merged, 0
+    cut = merged.nlargest(HEAVY_HITTER_COUNTERS + 1).iloc[-1]
+    return merged[merged > cut] - cut, float(cut)
+
+
+def _strata_column(chunk):
+    """The text column with the most values, up to APPROXIMATE_STRATA_MAX, to stratify by"""
+    best, best_count = None, 1
+    for col in chunk.columns:
+        if _is_text(chunk[col]):
+            count = chunk[col].nunique()
+            if best_count < count <= APPROXIMATE_STRATA_MAX:
+                best, best_count = col, count
+    return best
+
+
+def build_synopsis(filepath, seed=0):
+    """
+    One pass over the dataset that builds a stratified bottom-k sample with exact
+    stratum sizes, HyperLogLog registers per column, Misra-Gries heavy hitters per
+    text column and exact numeric totals. Stored next to the file.
+    """
+    rng = np.random.default_rng(seed)
+    rows = 0
+    sample = None
+    strata_column = known_strata = per_stratum = None
+    strata_sizes = pd.Series(dtype='float64')
+    registers, heavy, heavy_error, totals, missing = {}, {}, {}, {}, {}
+
+    for chunk in iter_chunks(filepath):
+        if sample is None:
+            strata_column = _strata_column(chunk)
+            known_strata = set(chunk[strata_column].dropna().astype(str)) if strata_column else set()
+            per_stratum = max(APPROXIMATE_SAMPLE_ROWS // max(len(known_strata), 1), 1)
+        rows += len(chunk)
+
+        for col in chunk.columns:
+            series = chunk[col]
+            missing[col] = missing.get(col, 0) + int(series.isna().sum())
+            _hll_update(registers.setdefault(col, np.zeros(2 ** HLL_PRECISION, dtype=np.uint8)), series)
+            if _is_text(series) or pd.api.types.is_bool_dtype(series):
+                heavy[col], cut = _misra_gries(heavy.get(col), series)
+                heavy_error[col] = heavy_error.get(col, 0) + cut
+            elif pd.api.types.is_numeric_dtype(series):
+                values = series.dropna()
+                if len(values):
+                    entry = totals.setdefault(col, {'count': 0, 'sum': 0.0, 'min': math.inf, 'max': -math.inf})
+                    entry['count'] += int(len(values))
+                    entry['sum'] += float(values.sum())
+                    entry['min'] = min(entry['min'], float(values.min()))
+                    entry['max'] = max(entry['max'], float(values.max()))
+
+        if strata_column:
+            labels = chunk[strata_column].astype(object)
+            strata = labels.where(labels.isna(), labels.astype(str))
+            strata = strata.where(strata.isin(known_strata) | strata.isna(), _OTHER).fillna(_MISSING)
+        else:
+            strata = pd.Series(_OTHER, index=chunk.index)
+        strata_sizes = strata_sizes.add(strata.value_counts(), fill_value=0)
+
+        # Bottom-k per stratum: the rows with the smallest random keys are a uniform sample of it
+        candidates = chunk.assign(**{_KEY: rng.random(len(chunk)), _STRATUM: strata.values})
+        candidates = candidates if sample is None else pd.concat([sample, candidates], ignore_index=True)
+        sample = (candidates.sort_values(_KEY, kind='stable')
+                  .groupby(_STRATUM, sort=False).head(per_stratum)
+                  .reset_index(drop=True))
+
+    if sample is None:
+        raise ValueError(f"{filepath} has no rows to sample")
+
+    sampled = sample[_STRATUM].value_counts()
+    strata = {str(h): [int(strata_sizes[h]), int(sampled.get(h, 0))] for h in strata_sizes.index}
+    # Every stratum holds the rows under its own key threshold, so all of them are
+    # in the sample below the smallest threshold of a full stratum: a uniform sample
+    thresholds = sample.groupby(_STRATUM)[_KEY].max()
+    full = [h for h, (size, taken) in strata.items() if taken < size]
+    fraction = float(thresholds[full].min()) if full else 1.0
+
+    synopsis = {
+        'source': list(dataset_key(filepath)[1:]),
+        'rows': rows,
+        'strata_column': strata_column,
+        'strata': strata,
+        'fraction': fraction,
+        'sample': sample,
+        'registers': registers,
+        'heavy_hitters': {col: (counts.sort_values(ascending=False).head(HEAVY_HITTERS_REPORTED), heavy_error[col])
+                          for col, counts in heavy.items()},
+        'totals': totals,
+        'missing': missing,
+    }
+    target = synopsis_path(filepath)
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    pd.to_pickle(synopsis, tmp_path)
+    os.replace(tmp_path, target)
+    return synopsis
+
+
+def _weighted_quantiles(values, weights):
+    order = np.argsort(values, kind='stable')
+    values, weights = values[order], weights[order]
+    cumulative = (np.cumsum(weights) - 0.5 * weights) / weights.sum()
+    return np.interp(QUANTILES, cumulative, values)
+
+
+def _summary(synopsis):
+    """Sketch results for the EDA: estimated distinct counts, quantiles and heavy hitters, with their bounds"""
+    z = _z()
+    sample = synopsis['sample']
+    weights = sample[_STRATUM].map({h: size / taken for h, (size, taken) in synopsis['strata'].items() if taken})
+    hll_error = z * 1.04 / math.sqrt(2 ** HLL_PRECISION)
+
+    quantiles = {}
+    for col in synopsis['totals']:
+        values = pd.to_numeric(sample[col], errors='coerce')
+        present = values.notna()
+        w = weights[present].to_numpy(dtype='float64')
+        if not len(w):
+            continue
+        effective = w.sum() ** 2 / (w ** 2).sum()
+        # Dvoretzky-Kiefer-Wolfowitz: every estimated quantile is within this many ranks of the truth
+        rank_error = math.sqrt(math.log(2 / (1 - APPROXIMATE_CONFIDENCE)) / (2 * effective))
+        estimates = _weighted_quantiles(values[present].to_numpy(dtype='float64'), w)
+        quantiles[col] = {f'p{round(q * 100):02d}': round(float(v), 4) for q, v in zip(QUANTILES, estimates)}
+        quantiles[col]['rank_error'] = round(rank_error, 4)
+
+    heavy_hitters = {}
+    for col, (counts, error) in synopsis['heavy_hitters'].items():
+        heavy_hitters[col] = [{'value': str(value), 'count_min': int(count), 'count_max': int(count + error)}
+                              for value, count in counts.items()]
+
+    totals = {}
+    for col, entry in synopsis['totals'].items():
+        totals[col] = dict(entry, mean=entry['sum'] / entry['count'] if entry['count'] else None)
+
+    return {
+        'rows': synopsis['rows'],
+        'sample_rows': int(len(sample)),
+        'uniform_sample_fraction': round(synopsis['fraction'], 6),
+        'strata_column': synopsis['strata_column'],
+        'confidence': APPROXIMATE_CONFIDENCE,
+        'totals_exact': totals,
+        'missing_exact': synopsis['missing'],
+        'distinct_estimate': {col: int(round(hll_estimate(r))) for col, r in synopsis['registers'].items()},
+        'distinct_relative_error': round(hll_error, 4),
+        'quantiles': quantiles,
+        'heavy_hitters': heavy_hitters,
+    }
+
+
+def load_synopsis(filepath):
+    """Return the synopsis of filepath, or None if it is missing or stale"""
+    key = dataset_key(filepath)
+    with _synopses_lock:
+        if key in _synopses:
+            _synopses.move_to_end(key)
+            return _synopses[key]
+    try:
+        synopsis = pd.read_pickle(synopsis_path(filepath))
+    except (OSError, ValueError, EOFError):
+        return None
+    if synopsis.get('source') != list(key[1:]):
+        return None
+    synopsis['summary'] = _summary(synopsis)
+    with _synopses_lock:
+        for stale in [k for k in _synopses if k[0] == key[0]]:
+            del _synopses[stale]
+        _synopses[key] = synopsis
+        while len(_synopses) > SYNOPSIS_CACHE_SIZE:
+            _synopses.popitem(last=False)
+    return synopsis
+
+
+def ensure_synopsis(filepath):
+    """Return the synopsis of filepath, building it first if needed; None when it cannot be built"""
+    synopsis = load_synopsis(filepath)
+    if synopsis is not None:
+        return synopsis
+    with _synopses_lock:
+        lock = _build_locks.setdefault(filepath, threading.Lock())
+    with lock:
+        synopsis = load_synopsis(filepath)
+        if synopsis is None:
+            try:
+                build_synopsis(filepath)
+                synopsis = load_synopsis(filepath)
+            except Exception as e:
+                print(f"Sample and sketches not built for {filepath}: {str(e)}")
+    return synopsis
+
+
+def wants_approximation(user_query, filepath, requested=None):
+    """
+    Whether a question is answered from the sample and sketches: when asked for, or
+    in 'auto' mode for exploratory questions, and only for large uploaded files.
+    Questions about exact figures always use the full data.
+    """
+    if requested is False or _EXACT_PATTERN.search(user_query or ''):
+        return False
+    if requested is None and not (APPROXIMATE_MODE == 'auto' and _EXPLORATORY_PATTERN.search(user_query or '')):
+        return False
+    # SQL tables and partitioned files already aggregate at the source
+    if is_source(filepath):
+        return False
+    try:
+        return get_profile(filepath)['shape'][0] >= APPROXIMATE_MIN_ROWS
+    except Exception as e:
+        print(f"Dataset size unknown, answering exactly: {str(e)}")
+        return False
+
+
+def uniform_sample(synopsis):
+    """The rows of the sample that form a uniform random sample of the whole dataset"""
+    if 'uniform' not in synopsis:
+        sample = synopsis['sample']
+        uniform = sample[sample[_KEY] <= synopsis['fraction']]
+        synopsis['uniform'] = uniform.drop(columns=[_KEY, _STRATUM]).reset_index(drop=True)
+    return synopsis['uniform']
+
+
+def _estimate_total(values, fraction, z):
+    values = pd.to_numeric(pd.Series(values), errors='coerce').dropna().astype('float64')
+    # Horvitz-Thompson total of a Bernoulli sample and its variance
+    margin = z * math.sqrt((1 - fraction) * float((values ** 2).sum())) / fraction
+    return {'estimate': float(values.sum()) / fraction, 'margin': margin, 'confidence': APPROXIMATE_CONFIDENCE}
+
+
+def _estimate_mean(values, fraction, z):
+    values = pd.to_numeric(pd.Series(values), errors='coerce').dropna().astype('float64')
+    if len(values) < 2:
+        return {'estimate': float(values.mean()) if len(values) else None, 'margin': None,
+                'confidence': APPROXIMATE_CONFIDENCE}
+    margin = z * float(values.std()) * math.sqrt(max(1 - fraction, 0) / len(values))
+    return {'estimate': float(values.mean()), 'margin': margin, 'confidence': APPROXIMATE_CONFIDENCE}
+
+
+def code_environment(synopsis):
+    """df and the estimators code runs with in approximate mode"""
+    fraction, z = synopsis['fraction'], _z()
+    return uniform_sample(synopsis), {
+        'sample_fraction': fraction,
+        'estimate_total': lambda values: _estimate_total(values, fraction, z),
+        'estimate_count': lambda mask: _estimate_total(pd.Series(mask).astype('float64'), fraction, z),
+        'estimate_mean': lambda values: _estimate_mean(values, fraction, z),
+    }
+
+
+def result_note(synopsis):
+    """Line put in front of every tool result computed from the sample"""
+    fraction = synopsis['fraction']
+    return (f"[Approximate: computed on a uniform random sample of {fraction:.2%} of {synopsis['rows']:,} rows. "
+            f"Means, shares and rankings carry over; multiply sums and counts by {1 / fraction:,.2f}, or use "
+            f"estimate_total()/estimate_count()/estimate_mean() for {APPROXIMATE_CONFIDENCE:.0%} bounds. "
+            f"Report figures as estimates.]")
+
+
+def approximate_profile_json(filepath, question='', columns=''):
+    """The EDA of eda_json() with the sketch results of the synopsis for the same columns added"""
+    synopsis = load_synopsis(filepath)
+    if synopsis is None:
+        return eda_json(filepath, question, columns)
+    profile = cached_profile(filepath)
+    view = dict(tiered_profile(profile, question, requested_columns(columns, profile)))
+    summary = dict(synopsis['summary'])
+    if 'column_details' in view:
+        # Sketches only for the columns the pruned profile describes
+        for key in _PER_COLUMN_SKETCHES:
+            summary[key] = {c: v for c, v in summary[key].items() if c in view['column_details']}
+    view['approximate'] = dict(summary, note=(
+        "This question is answered approximately: in execute_python_code df is a uniform random sample "
+        "with the estimators estimate_total, estimate_count and estimate_mean. totals_exact and "
+        "missing_exact cover every row."
+    ))
+    return compact_json(view)
+
+
+def open_for_charts(filepath):
+    """What charts bind to: the sample of a large upload in approximate mode, otherwise open_dataset()"""
+    if is_approximate():
+        synopsis = load_synopsis(filepath)
+        if synopsis is not None:
+            return SampleSource(filepath, synopsis)
+    return open_dataset(filepath)
+
+
+class SampleSource(DataSource):
+    """
+    The stratified sample of a large upload, for charts in approximate mode. Groupings
+    return weighted estimates with '<name> ±' confidence half-widths; rows come from
+    the uniform part of the sample.
+    """
+    approximate = True
+
+    def __init__(self, filepath, synopsis):
+        super().__init__(filepath, f"sample of {os.path.basename(filepath)}")
+        self.synopsis = synopsis
+        strata = synopsis['strata']
+        self._sizes = {h: size for h, (size, taken) in strata.items() if taken}
+        self._taken = {h: taken for h, (size, taken) in strata.items() if taken}
+
+    def version(self):
+        return tuple(self.synopsis['source'])
+
+    def load(self, columns=None, filters=None, limit=None):
+        df = filter_frame(uniform_sample(self.synopsis), filters)
+        if columns is not None:
+            df = df[list(dict.fromkeys(columns))]
+        return df if limit is None else df.head(limit)
+
+    def sql(self, query):
+        raise DataSourceError("SQL is not available in approximate mode")
+
+    def _parts(self, df, keys, columns):
+        """Sums and sums of squares of each column per group and stratum, with the stratum's sizes"""
+        frame = pd.DataFrame(index=df.index)
+        for name, values in columns.items():
+            frame[name] = values
+            frame[name + '^2'] = values * values
+        parts = frame.groupby([df[k] for k in keys] + [df[_STRATUM]], observed=True).sum()
+        strata = parts.index.get_level_values(-1)
+        parts['N'] = np.asarray(strata.map(self._sizes), dtype='float64')
+        parts['n'] = np.asarray(strata.map(self._taken), dtype='float64')
+        return parts
+
+    @staticmethod
+    def _per_group(values, keys):
+        if keys:
+            return values.groupby(level=list(range(len(keys))), observed=True).sum()
+        return pd.Series([values.sum()])
+
+    def _total(self, parts, s1, s2, keys):
+        """Stratified estimate of a total per group and its variance"""
+        N, n = parts['N'], parts['n']
+        spread = ((s2 - s1 ** 2 / n) / (n - 1)).where(n > 1, 0.0).clip(lower=0)
+        return self._per_group(s1 * N / n, keys), self._per_group(N ** 2 * (1 - n / N) * spread / n, keys)
+
+    def group(self, keys, aggregations, filters=None):
+        for aggregation, _ in aggregations.values():
+            if aggregation not in GROUP_AGGREGATIONS:
+                raise DataSourceError(f"Unsupported aggregation at the source: {aggregation}")
+        keys = list(keys)
+        df = filter_frame(self.synopsis['sample'], filters)
+        df = df.dropna(subset=keys)
+        z = _z()
+
+        estimates, margins = {}, {}
+        for name, (aggregation, column) in aggregations.items():
+            if aggregation in ('min', 'max'):
+                # Extremes of the sample bound the true ones from inside; there is no interval for them
+                grouped = df.groupby([df[k] for k in keys], observed=True)[column] if keys else df[column]
+                value = getattr(grouped, aggregation)()
+                estimates[name] = value if keys else pd.Series([value])
+                margins[name] = estimates[name] * np.nan
+                continue
+
+            if column is None:
+                present = pd.Series(1.0, index=df.index)
+                values = present
+            else:
+                numeric = pd.to_numeric(df[column], errors='coerce').astype('float64')
+                present = numeric.notna().astype('float64')
+                values = present if aggregation == 'count' else numeric.fillna(0.0)
+            parts = self._parts(df, keys, {'y': values, 'c': present})
+            total, total_var = self._total(parts, parts['y'], parts['y^2'], keys)
+            if aggregation in ('sum', 'count'):
+                estimates[name], margins[name] = total, z * np.sqrt(total_var)
+                continue
+
+            # Mean as a ratio of two totals, with the variance of its linearized residuals
+            count, _ = self._total(parts, parts['c'], parts['c^2'], keys)
+            mean = total / count.where(count > 0)
+            group_mean = mean.reindex(parts.index.droplevel(-1)).to_numpy() if keys else float(mean.iloc[0])
+            s1 = parts['y'] - group_mean * parts['c']
+            s2 = parts['y^2'] - 2 * group_mean * parts['y'] + group_mean ** 2 * parts['c']
+            _, residual_var = self._total(parts, s1, s2, keys)
+            estimates[name], margins[name] = mean, z * np.sqrt(residual_var) / count.where(count > 0)
+
+        result = pd.DataFrame(estimates)
+        for name in aggregations:
+            result[f'{name} ±'] = margins[name]
+        return result.reset_index() if keys else result.reset_index(drop=True)
+
+    def approximation(self, frame=None):
+        """Chart metadata describing the estimate: sample size, confidence and the largest relative error"""
+        note = {
+            'rows': self.synopsis['rows'],
+            'sample_rows': int(len(self.synopsis['sample'])),
+            'confidence': APPROXIMATE_CONFIDENCE,
+        }
+        margins = [c for c in (frame.columns if frame is not None else []) if str(c).endswith(' ±')]
+        relative = []
+        for column in margins:
+            ratio = frame[column] / frame[column[:-2]].abs()
+            relative.extend(ratio.replace([np.inf, -np.inf], np.nan).dropna().tolist())
+        if relative:
+            note['max_relative_error'] = round(float(max(relative)), 4)
+        return note
@@ -0,0 +1,197 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+# Memory for kept results across all chats; least recently used results are evicted first
+CHAT_SESSION_MAX_MB = float(os.environ.get('CHAT_SESSION_MAX_MB', 256))
+# A single result larger than this is not kept
+CHAT_SESSION_RESULT_MAX_MB = float(os.environ.get('CHAT_SESSION_RESULT_MAX_MB', 32))
+# Results kept per chat; older ones are dropped as new ones arrive
+CHAT_SESSION_MAX_RESULTS = int(os.environ.get('CHAT_SESSION_MAX_RESULTS', 8))
+# Chats whose recent turns are remembered
+CHAT_SESSION_MAX_CHATS = int(os.environ.get('CHAT_SESSION_MAX_CHATS', 1000))
+# Earlier questions and answers included in the agents' context
+CHAT_CONTEXT_TURNS = int(os.environ.get('CHAT_CONTEXT_TURNS', 3))
+CHAT_CONTEXT_ANSWER_CHARS = int(os.environ.get('CHAT_CONTEXT_ANSWER_CHARS', 600))
+CHAT_CONTEXT_CODE_CHARS = 300
+
+# Explicit references back to earlier answers: a question that opens with a pronoun
+# or "what about", names the previous result, or asks to break one down. Pronouns
+# elsewhere ("what is its average") are too common in new questions to count.
+_FOLLOW_UP_PATTERN = re.compile(
+    r"^\W*(?:(?:and|but|so|ok|okay)\W+)?(?:that|those|these|it|them|now|instead|same|what about|how about)\b"
+    r"|\b(?:previous|last|above|earlier|same)\s+(?:result|answer|table|chart|query|question|one|number|figure)s?\b"
+    r"|\b(?:that|this|those|these)\s+(?:result|answer|table|chart|breakdown|list|number|figure)s?\b"
+    r"|\b(?:break|split)\s+(?:it|that|this|those|these|them)\s+(?:down|up|out)\b"
+    r"|\bdrill\s+(?:down\s+)?into\s+(?:it|that|this|those|these|them)\b",
+    re.IGNORECASE,
+)
+_RESULT_REFERENCE = re.compile(r"""['"](r\d+)['"]""")
+
+# Chat ID -> {'turns': [(question, answer)], 'results': [name], 'next': int}
+_sessions = OrderedDict()
+# (chat ID, name) -> {'frame', 'code', 'filepath', 'question', 'nbytes'}, least recently used first
+_results = OrderedDict()
+_results_bytes = 0
+_lock = threading.Lock()
+
+
+def storable_result(answer):
+    """The 'answer' of executed code as a DataFrame worth keeping, or None"""
+    if isinstance(answer, pd.Series):
+        answer = answer.to_frame(name=answer.name if answer.name is not None else 'value')
+    if not isinstance(answer, pd.DataFrame) or answer.empty:
+        return None
+    if answer.memory_usage(deep=True).sum() > CHAT_SESSION_RESULT_MAX_MB * 1024**2:
+        return None
+    return answer
+
+
+def _session(chat_id):
+    session = _sessions.get(chat_id)
+    if session is None:
+        session = _sessions[chat_id] = {'turns': [], 'results': [], 'next': 1}
+        while len(_sessions) > CHAT_SESSION_MAX_CHATS:
+            _drop_session(next(iter(_sessions)))
+    _sessions.move_to_end(chat_id)
+    return session
+
+
+def _drop_result(key):
+    global _results_bytes
+    entry = _results.pop(key, None)
+    if entry is None:
+        return
+    _results_bytes -= entry['nbytes']
+    session = _sessions.get(key[0])
+    if session is not None and key[1] in session['results']:
+        session['results'].remove(key[1])
+
+
+def _drop_session(chat_id):
+    session = _sessions.pop(chat_id, None)
+    for name in (session or {}).get('results', []):
+        _drop_result((chat_id, name))
+
+
+def remember_result(chat_id, filepath, code, frame):
+    """Keep a result of chat_id's code for follow-up questions and return its name, e.g. 'r3'"""
+    global _results_bytes
+    nbytes = int(frame.memory_usage(deep=True).sum())
+    with _lock:
+        session = _session(chat_id)
+        name = f"r{session['next']}"
+        session['next'] += 1
+        session['results'].append(name)
+        _results[(chat_id, name)] = {
+            'frame': frame, 'code': code, 'filepath': filepath, 'question': None, 'nbytes': nbytes,
+        }
+        _results_bytes += nbytes
+        while len(session['results']) > CHAT_SESSION_MAX_RESULTS:
+            _drop_result((chat_id, session['results'][0]))
+        while _results_bytes > CHAT_SESSION_MAX_MB * 1024**2 and len(_results) > 1:
+            _drop_result(next(iter(_results)))
+    return name
+
+
+def referenced_results(chat_id, code):
+    """The kept results code refers to as results['<name>'], so only those are sent to the sandbox"""
+    if not chat_id or 'results' not in code:
+        return {}
+    found = {}
+    with _lock:
+        for name in set(_RESULT_REFERENCE.findall(code)):
+            entry = _results.get((chat_id, name))
+            if entry is not None:
+                _results.move_to_end((chat_id, name))
+                found[name] = entry['frame']
+    return found
+
+
+def record_turn(chat_id, question, answer):
+    """Remember a finished question and its answer; results computed for it are labelled with the question"""
+    if not chat_id:
+        return
+    with _lock:
+        session = _session(chat_id)
+        session['turns'] = (session['turns'] + [(question, answer or '')])[-CHAT_CONTEXT_TURNS:]
+        for name in session['results']:
+            entry = _results[(chat_id, name)]
+            if entry['question'] is None:
+                entry['question'] = question
+
+
+def is_follow_up(chat_id, question):
+    """True when question seems to build on earlier turns of the chat, so its answer depends on them"""
+    if not chat_id or not _FOLLOW_UP_PATTERN.search(question or ''):
+        return False
+    with _lock:
+        session = _sessions.get(chat_id)
+        return bool(session and session['turns'])
+
+
+def _shorten(text, limit):
+    text = ' '.join(str(text).split())
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def chat_context(chat_id, filepath):
+    """
+    Compact text of the chat's recent questions and answers and of the results
+    kept for this dataset, for the agents' task. Empty for a new chat.
+    """
+    if not chat_id:
+        return ''
+    with _lock:
+        session = _sessions.get(chat_id)
+        if session is None:
+            return ''
+        turns = list(session['turns'])
+        results = [(name, _results[(chat_id, name)]) for name in session['results']
+                   if _results[(chat_id, name)]['filepath'] == filepath]
+
+    lines = []
+    if turns:
+        lines.append("Earlier in this chat (oldest first):")
+        for question, answer in turns:
+            lines.append(f"Q: {_shorten(question, CHAT_CONTEXT_ANSWER_CHARS)}")
+            lines.append(f"A: {_shorten(answer, CHAT_CONTEXT_ANSWER_CHARS)}")
+    if results:
+        lines.append("DataFrames kept from earlier code; in execute_python_code refine them with "
+                     "results['<name>'] instead of recomputing from df:")
+        for name, entry in results:
+            frame = entry['frame']
+            label = f' for "{_shorten(entry["question"], 120)}"' if entry['question'] else ''
+            columns = ', '.join(str(c) for c in frame.columns[:20])
+            # Group keys of an aggregated result live in the index
+            index = ''
+            if not isinstance(frame.index, pd.RangeIndex):
+                index = f", index [{', '.join(str(n) for n in frame.index.names)}]"
+            lines.append(f"- {name}{label}: {len(frame)} rows, columns [{columns}]{index}; "
+                         f"code: {_shorten(entry['code'], CHAT_CONTEXT_CODE_CHARS)}")
+    return '\n'.join(lines)
+
+
+def forget_session(chat_id=None):
+    """Drop the turns and results of one chat, or of every chat when chat_id is None"""
+    global _results_bytes
+    with _lock:
+        if chat_id is None:
+            _sessions.clear()
+            _results.clear()
+            _results_bytes = 0
+        else:
+            _drop_session(chat_id)
+
+
+def session_stats():
+    with _lock:
+        return {
+            'chats': len(_sessions),
+            'results': len(_results),
+            'size_mb': round(_results_bytes / 1024**2, 2),
+            'max_mb': CHAT_SESSION_MAX_MB,
+        }
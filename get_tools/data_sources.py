@@ -0,0 +1,679 @@
+import os
+import re
+import glob
+import time
+import sqlite3
+import hashlib
+import operator
+import threading
+from urllib.parse import parse_qs
+
+import pandas as pd
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+try:
+    import pyodbc
+except ImportError:
+    pyodbc = None
+
+# Directories that directory, glob and SQLite sources must be inside
+DATA_SOURCE_ROOTS = [p.strip() for p in os.environ.get('DATA_SOURCE_ROOTS', 'data').split(',') if p.strip()]
+# SQL Server tables that may be analyzed, e.g. "dbo.Sales,dbo.Customers"; none by default
+SQLSERVER_SOURCE_TABLES = {t.strip().lower() for t in os.environ.get('SQLSERVER_SOURCE_TABLES', '').split(',') if t.strip()}
+# Defaults to the database that stores the chat history
+DATA_SOURCE_CONNECTION_STRING = os.environ.get(
+    'DATA_SOURCE_CONNECTION_STRING', os.environ.get('DB_CONNECTION_STRING', '<your_db_connection_string>')
+)
+# SQL Server tables are assumed unchanged for this long when caching their profiles and answers
+SQL_SOURCE_TTL_SECONDS = float(os.environ.get('SQL_SOURCE_TTL_SECONDS', 300))
+# Larger sources are not loaded whole into a DataFrame; aggregate them with query() instead
+DATA_SOURCE_MAX_ROWS = int(os.environ.get('DATA_SOURCE_MAX_ROWS', 2_000_000))
+SOURCE_SAMPLE_ROWS = 1000
+PROFILE_TOP_K = int(os.environ.get('PROFILE_TOP_K', 5))
+PROFILE_SAMPLE_ROWS = 5
+
+FILE_EXTENSIONS = ('.csv', '.parquet', '.xlsx', '.xls')
+# Aggregations every source can compute itself
+GROUP_AGGREGATIONS = ('sum', 'mean', 'min', 'max', 'count')
+_SQL_AGGREGATIONS = {'sum': 'SUM', 'mean': 'AVG', 'min': 'MIN', 'max': 'MAX', 'count': 'COUNT'}
+_SQL_OPERATORS = {'==': '=', '!=': '<>', '>': '>', '>=': '>=', '<': '<', '<=': '<='}
+_FRAME_OPERATORS = {
+    '==': operator.eq, '!=': operator.ne, '>': operator.gt, '>=': operator.ge, '<': operator.lt, '<=': operator.le,
+}
+_GLOB_CHARACTERS = re.compile(r'[*?\[]')
+_SELECT_PATTERN = re.compile(r'^\s*(select|with)\b', re.IGNORECASE)
+# Comments, string literals, quoted identifiers, words and single characters of a SQL query
+_SQL_TOKEN_PATTERN = re.compile(
+    r"--[^\n]*|/\*.*?(?:\*/|$)|'(?:[^']|'')*'?|\"(?:[^\"]|\"\")*\"?|\[[^\]]*\]?|`[^`]*`?|\w+|\S", re.DOTALL
+)
+# Words after which a table name or subquery follows
+_SQL_RELATION_WORDS = {'from', 'join', 'apply'}
+# Words that start a query inside parentheses; other parentheses hold expressions such as EXTRACT(YEAR FROM x)
+_SQL_QUERY_WORDS = {'select', 'with', 'values', 'from'}
+# Words that end a FROM list; any other word after a table name is its alias
+_SQL_CLAUSE_WORDS = {
+    'where', 'group', 'order', 'having', 'limit', 'offset', 'fetch', 'union', 'except', 'intersect', 'window',
+    'qualify', 'on', 'using', 'join', 'inner', 'left', 'right', 'full', 'outer', 'cross', 'natural', 'apply',
+    'for', 'option', 'pivot', 'unpivot', 'select', 'from',
+}
+_TABLE_NAME_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?$')
+
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+class DataSourceError(ValueError):
+    """The source does not exist, is not allowed or cannot answer the request"""
+
+
+def is_source(filepath):
+    """True for SQL tables and directories or globs of files; False for a single uploaded file"""
+    filepath = str(filepath)
+    return filepath.startswith(('sqlite:', 'sqlserver:')) or bool(_GLOB_CHARACTERS.search(filepath)) or os.path.isdir(filepath)
+
+
+def _inside_roots(path):
+    real = os.path.realpath(path)
+    for root in DATA_SOURCE_ROOTS:
+        root = os.path.realpath(root)
+        if real == root or real.startswith(root + os.sep):
+            return True
+    return False
+
+
+def _inside_roots_or_raise(spec, files):
+    for path in files:
+        if not _inside_roots(path):
+            raise DataSourceError(f"{spec} matches {path}, which is outside DATA_SOURCE_ROOTS")
+    return files
+
+
+def _sql_tokens(query):
+    """(kind, text) per token with comments dropped; kind is 'string', 'name' or 'symbol'"""
+    tokens = []
+    for token in _SQL_TOKEN_PATTERN.findall(query):
+        if token.startswith(('--', '/*')):
+            continue
+        if token.startswith("'"):
+            tokens.append(('string', token))
+        elif token[0] in '"[`':
+            tokens.append(('name', token[1:-1].lower()))
+        elif token[0].isalnum() or token[0] == '_':
+            tokens.append(('name', token.lower()))
+        else:
+            tokens.append(('symbol', token))
+    return tokens
+
+
+def _cte_names(tokens):
+    """Names the query defines itself with WITH name [(columns)] AS (...)"""
+    names = set()
+    for i, (kind, text) in enumerate(tokens[1:], 1):
+        if kind != 'name' or tokens[i - 1][1] not in ('with', 'recursive', ','):
+            continue
+        j = i + 1
+        if j < len(tokens) and tokens[j][1] == '(':
+            while j < len(tokens) and tokens[j][1] != ')':
+                j += 1
+            j += 1
+        if tokens[j:j + 2] == [('name', 'as'), ('symbol', '(')]:
+            names.add(text)
+    return names
+
+
+def check_select(query):
+    """
+    Refuse anything but one SELECT that reads only the table 'data' and the
+    common table expressions it defines: no second statement, no other table,
+    table function or file, and no SELECT INTO.
+    """
+    if not _SELECT_PATTERN.match(query):
+        raise DataSourceError("Only SELECT queries can be run against a data source")
+    tokens = _sql_tokens(query)
+    while tokens and tokens[-1] == ('symbol', ';'):
+        tokens.pop()
+    allowed = {'data'} | _cte_names(tokens)
+
+    # Per open parenthesis: (in table position so an alias may follow, holds a query)
+    parentheses = []
+    expect = None
+    for i, (kind, text) in enumerate(tokens):
+        following = tokens[i + 1][1] if i + 1 < len(tokens) else None
+        in_query = not parentheses or parentheses[-1][1]
+        if expect == 'relation':
+            if text == '(':
+                # A subquery, or parenthesized tables and joins whose names are checked in turn
+                parentheses.append((True, True))
+                expect = None if following in _SQL_QUERY_WORDS else 'relation'
+                continue
+            if kind != 'name' or text not in allowed or following in ('(', '.'):
+                raise DataSourceError(f"Queries may only read the table 'data'; {text} is not allowed")
+            expect = 'alias'
+            continue
+        if expect == 'alias':
+            if text == ',':
+                expect = 'relation'
+                continue
+            if kind == 'name' and text not in _SQL_CLAUSE_WORDS:
+                continue
+            expect = None
+        if text == ';':
+            raise DataSourceError("Only one SQL statement can be run at a time")
+        if kind == 'name' and text == 'into':
+            raise DataSourceError("SELECT INTO cannot be run against a data source")
+        if kind == 'name' and text in _SQL_RELATION_WORDS and in_query:
+            expect = 'relation'
+        elif text == '(':
+            parentheses.append((False, following in _SQL_QUERY_WORDS))
+        elif text == ')' and parentheses and parentheses.pop()[0]:
+            expect = 'alias'
+    if expect == 'relation':
+        raise DataSourceError("The query ends before naming a table")
+
+
+def _scalar(value):
+    # numpy scalars are not accepted as SQL parameters
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _check_columns(source, names):
+    known = source.columns()
+    for name in names:
+        if name not in known:
+            raise DataSourceError(f"Column not found: {name}")
+
+
+def filter_frame(df, filters):
+    """Apply chart-spec style filters [{'column', 'op', 'value'}] to a DataFrame"""
+    for condition in filters or []:
+        column, op, value = condition.get('column'), condition.get('op', '=='), condition.get('value')
+        series = df[column]
+        if op in ('in', 'not in'):
+            mask = series.isin(value if isinstance(value, list) else [value])
+            if op == 'not in':
+                mask = ~mask
+        elif op in _FRAME_OPERATORS:
+            mask = _FRAME_OPERATORS[op](series, value)
+        else:
+            raise DataSourceError(f"Unsupported filter operator: {op}")
+        df = df[mask]
+    return df
+
+
+class DataSource:
+    """
+    A dataset that is not a single file: a SQL table or a set of partitioned files.
+    Filters, column selection and aggregations are pushed down to it so the whole
+    table does not have to be loaded into pandas.
+    """
+
+    def __init__(self, spec, name):
+        self.spec = spec
+        self.name = name
+        self._sample = None
+        self._sample_version = None
+
+    def version(self):
+        """Changes whenever the data may have changed; part of every cache key"""
+        raise NotImplementedError
+
+    def sample(self):
+        """The first rows, used for column names and types"""
+        version = self.version()
+        if self._sample is None or self._sample_version != version:
+            self._sample = self.load(limit=SOURCE_SAMPLE_ROWS)
+            self._sample_version = version
+        return self._sample
+
+    def columns(self):
+        return list(self.sample().columns)
+
+    def count(self):
+        return int(self.group([], {'rows': ('count', None)})['rows'].iloc[0])
+
+    def load_all(self):
+        """The whole dataset as a DataFrame, refused above DATA_SOURCE_MAX_ROWS rows"""
+        rows = self.count()
+        if rows > DATA_SOURCE_MAX_ROWS:
+            raise DataSourceError(
+                f"{self.name} has {rows:,} rows, more than DATA_SOURCE_MAX_ROWS; "
+                "aggregate it with query('SELECT ... FROM data ...') instead of loading df"
+            )
+        return self.load()
+
+    def load(self, columns=None, filters=None, limit=None):
+        """Rows of the selected columns that pass filters"""
+        raise NotImplementedError
+
+    def group(self, keys, aggregations, filters=None):
+        """
+        Group by keys and compute aggregations {output name: (aggregation, column)}
+        at the source; a None column counts rows. Rows with a missing key are dropped,
+        as in pandas.
+        """
+        raise NotImplementedError
+
+    def sql(self, query):
+        """Run a SELECT in which the dataset is the table 'data'"""
+        raise NotImplementedError
+
+    def profile(self):
+        """The EDA profile computed at the source, or None to profile the loaded data"""
+        return None
+
+
+class SqlSource(DataSource):
+    """A relation queried through a DB-API connection; subclasses set the dialect"""
+
+    quote_open, quote_close = '"', '"'
+    float_type = 'DOUBLE PRECISION'
+
+    def relation(self):
+        raise NotImplementedError
+
+    def connect(self):
+        raise NotImplementedError
+
+    def quote(self, name):
+        return self.quote_open + str(name).replace(self.quote_close, self.quote_close * 2) + self.quote_close
+
+    def select(self, select_list, rest='', limit=None):
+        sql = f"SELECT {select_list} FROM {self.relation()}{rest}"
+        return sql if limit is None else f"{sql} LIMIT {int(limit)}"
+
+    def fetch(self, sql, params=()):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(sql, [_scalar(p) for p in params])
+            columns = [d[0] for d in cursor.description]
+            return pd.DataFrame.from_records([tuple(r) for r in cursor.fetchall()], columns=columns)
+        finally:
+            conn.close()
+
+    def where(self, filters):
+        """SQL WHERE clause and parameters for chart-spec style filters"""
+        clauses, params = [], []
+        for condition in filters or []:
+            column, op, value = condition.get('column'), condition.get('op', '=='), condition.get('value')
+            _check_columns(self, [column])
+            if op in ('in', 'not in'):
+                values = value if isinstance(value, list) else [value]
+                if not values:
+                    clauses.append('1=0' if op == 'in' else '1=1')
+                    continue
+                placeholders = ', '.join('?' * len(values))
+                clauses.append(f"{self.quote(column)} {op.upper()} ({placeholders})")
+                params.extend(values)
+            elif op in _SQL_OPERATORS:
+                clauses.append(f"{self.quote(column)} {_SQL_OPERATORS[op]} ?")
+                params.append(value)
+            else:
+                raise DataSourceError(f"Unsupported filter operator: {op}")
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def load(self, columns=None, filters=None, limit=None):
+        if columns is not None:
+            _check_columns(self, columns)
+            select_list = ', '.join(self.quote(c) for c in dict.fromkeys(columns))
+        else:
+            select_list = '*'
+        where, params = self.where(filters)
+        return self.fetch(self.select(select_list, where, limit), params)
+
+    def _aggregate_sql(self, aggregation, column):
+        if aggregation not in _SQL_AGGREGATIONS:
+            raise DataSourceError(f"Unsupported aggregation at the source: {aggregation}")
+        if column is None:
+            return 'COUNT(*)'
+        quoted = self.quote(column)
+        if aggregation in ('sum', 'mean'):
+            # Integer sums overflow and integer averages truncate in some databases
+            quoted = f"CAST({quoted} AS {self.float_type})"
+        return f"{_SQL_AGGREGATIONS[aggregation]}({quoted})"
+
+    def group(self, keys, aggregations, filters=None):
+        _check_columns(self, list(keys) + [c for _, c in aggregations.values() if c is not None])
+        parts = [self.quote(k) for k in keys]
+        parts += [f"{self._aggregate_sql(agg, col)} AS {self.quote(name)}" for name, (agg, col) in aggregations.items()]
+        where, params = self.where(filters)
+        group_by = ' GROUP BY ' + ', '.join(self.quote(k) for k in keys) if keys else ''
+        result = self.fetch(self.select(', '.join(parts), where + group_by), params)
+        return result.dropna(subset=list(keys)) if keys else result
+
+    def sql(self, query):
+        check_select(query)
+        data = f"data AS (SELECT * FROM {self.relation()})"
+        # The query's own common table expressions follow 'data' in the same WITH
+        own = re.match(r'\s*with\s+(?!recursive\b)', query, re.IGNORECASE)
+        if own:
+            return self.fetch(f"WITH {data}, {query[own.end():]}")
+        return self.fetch(f"WITH {data} {query}")
+
+    def profile(self):
+        """Profile in two passes at the source: one scan for all column statistics, one GROUP BY per text column"""
+        sample = self.sample()
+        columns = list(sample.columns)
+        numeric = sample.select_dtypes(include=['number']).columns.tolist()
+        categorical = sample.select_dtypes(include=['object', 'category', 'string']).columns.tolist()
+
+        parts = ['COUNT(*)']
+        for col in columns:
+            parts += [f"COUNT({self.quote(col)})", f"COUNT(DISTINCT {self.quote(col)})"]
+        for col in numeric:
+            value = f"CAST({self.quote(col)} AS {self.float_type})"
+            parts += [f"MIN({value})", f"MAX({value})", f"AVG({value})", f"AVG({value} * {value})"]
+        stats = iter(self.fetch(self.select(', '.join(parts))).iloc[0].tolist())
+
+        rows = int(next(stats))
+        missing, cardinality = {}, {}
+        for col in columns:
+            missing[col] = rows - int(next(stats))
+            cardinality[col] = int(next(stats))
+        basic_stats = {}
+        for col in numeric:
+            low, high, mean, mean_square = next(stats), next(stats), next(stats), next(stats)
+            count = rows - missing[col]
+            std = None
+            if count > 1 and mean is not None:
+                std = max(0.0, (mean_square - mean ** 2) * count / (count - 1)) ** 0.5
+            basic_stats[col] = {'count': count, 'mean': mean, 'std': std, 'min': low, 'max': high}
+
+        top_values = {}
+        for col in categorical:
+            quoted = self.quote(col)
+            counts = self.fetch(self.select(
+                f"{quoted} AS value, COUNT(*) AS n",
+                f" WHERE {quoted} IS NOT NULL GROUP BY {quoted} ORDER BY COUNT(*) DESC", PROFILE_TOP_K,
+            ))
+            top_values[col] = {str(v): int(n) for v, n in zip(counts['value'], counts['n'])}
+
+        return {
+            "shape": [rows, len(columns)],
+            "columns": columns,
+            "data_types": {col: str(dtype) for col, dtype in sample.dtypes.items()},
+            "missing_values": missing,
+            "numeric_columns": numeric,
+            "categorical_columns": categorical,
+            "basic_stats": basic_stats,
+            "top_values": top_values,
+            "cardinality": cardinality,
+            "sample_data": sample.head(PROFILE_SAMPLE_ROWS).to_dict(),
+            "memory_usage": "not loaded (computed at the source)",
+            "data_source": self.name,
+        }
+
+
+class SqliteTable(SqlSource):
+    float_type = 'REAL'
+
+    def __init__(self, spec, path, table):
+        super().__init__(spec, f"SQLite table {table} in {os.path.basename(path)}")
+        self.path = path
+        self.table = table
+
+    def version(self):
+        stamps = []
+        for path in (self.path, self.path + '-wal'):
+            if os.path.exists(path):
+                stat = os.stat(path)
+                stamps.append(f"{stat.st_size}:{stat.st_mtime_ns}")
+        return '/'.join(stamps)
+
+    def relation(self):
+        return self.quote(self.table)
+
+    def connect(self):
+        # Read-only, so SQL written by the agents cannot change the database
+        return sqlite3.connect(f"file:{os.path.abspath(self.path)}?mode=ro", uri=True, check_same_thread=False)
+
+
+class SqlServerTable(SqlSource):
+    quote_open, quote_close = '[', ']'
+    float_type = 'FLOAT'
+
+    def __init__(self, spec, table):
+        super().__init__(spec, f"SQL Server table {table}")
+        self.table = table
+
+    def version(self):
+        return str(int(time.time() // SQL_SOURCE_TTL_SECONDS))
+
+    def relation(self):
+        return '.'.join(self.quote(part) for part in self.table.split('.'))
+
+    def select(self, select_list, rest='', limit=None):
+        top = f"TOP {int(limit)} " if limit is not None else ''
+        return f"SELECT {top}{select_list} FROM {self.relation()}{rest}"
+
+    def connect(self):
+        if pyodbc is None:
+            raise DataSourceError("pyodbc is required for SQL Server sources")
+        return pyodbc.connect(DATA_SOURCE_CONNECTION_STRING)
+
+
+def _partition_values(base, path):
+    """Hive-style partition columns of a file, e.g. {'year': '2024'} for base/year=2024/part.csv"""
+    values = {}
+    for part in os.path.relpath(os.path.dirname(path), base).split(os.sep):
+        if '=' in part:
+            key, value = part.split('=', 1)
+            values[key] = value
+    return values
+
+
+def _files_version(files):
+    digest = hashlib.sha1()
+    for path in files:
+        stat = os.stat(path)
+        digest.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+    return digest.hexdigest()
+
+
+class PartitionedFiles(DataSource):
+    """
+    A directory or glob of CSV, Parquet or Excel files read as one table, with
+    hive-style key=value directories as extra columns. Without DuckDB the work is
+    done file by file: partitions ruled out by filters are skipped, only needed
+    columns are read and aggregations are combined from per-file partial results.
+    """
+
+    def __init__(self, spec, base, pattern):
+        super().__init__(spec, f"files {spec}")
+        self.base = base
+        self.pattern = pattern
+
+    def files(self):
+        files = sorted(f for f in glob.glob(self.pattern, recursive=True)
+                       if os.path.isfile(f) and f.lower().endswith(FILE_EXTENSIONS))
+        if not files:
+            raise DataSourceError(f"No CSV, Parquet or Excel files found in {self.spec}")
+        # The pattern may climb out of its base with '..' or follow symlinks; every file is checked
+        return _inside_roots_or_raise(self.spec, files)
+
+    def version(self):
+        return _files_version(self.files())
+
+    def _partition_frame(self, files):
+        frame = pd.DataFrame([_partition_values(self.base, f) for f in files])
+        # Typed like the values they stand for, so "year >= 2023" compares numbers
+        for col in frame.columns:
+            numeric = pd.to_numeric(frame[col], errors='coerce')
+            if numeric.notna().all():
+                frame[col] = numeric
+        return frame
+
+    def _pruned_files(self, filters):
+        files = self.files()
+        partition_filters = []
+        partitions = self._partition_frame(files)
+        for condition in filters or []:
+            if condition.get('column') in partitions.columns:
+                partition_filters.append(condition)
+        if not partition_filters:
+            return files, partitions
+        kept = filter_frame(partitions.assign(_file=files), partition_filters)
+        return kept['_file'].tolist(), kept.drop(columns='_file')
+
+    def _read(self, path, columns, partition):
+        file_columns = None if columns is None else [c for c in columns if c not in partition]
+        lower = path.lower()
+        if lower.endswith('.parquet'):
+            df = pd.read_parquet(path, columns=file_columns)
+        else:
+            read = pd.read_csv if lower.endswith('.csv') else pd.read_excel
+            # With only partition columns wanted, one file column still gives the row count
+            df = read(path, usecols=[0]).iloc[:, :0] if file_columns == [] else read(path, usecols=file_columns)
+        for key, value in partition.items():
+            if columns is None or key in columns:
+                df[key] = value
+        return df
+
+    def _frames(self, columns, filters):
+        files, partitions = self._pruned_files(filters)
+        needed = None
+        if columns is not None:
+            needed = list(dict.fromkeys(list(columns) + [c.get('column') for c in filters or []]))
+        for path, (_, partition) in zip(files, partitions.iterrows()):
+            df = self._read(path, needed, partition.dropna().to_dict())
+            yield filter_frame(df, filters)
+
+    def load(self, columns=None, filters=None, limit=None):
+        frames, rows = [], 0
+        for df in self._frames(columns, filters):
+            frames.append(df if columns is None else df[list(dict.fromkeys(columns))])
+            rows += len(df)
+            if limit is not None and rows >= limit:
+                break
+        result = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns or [])
+        return result if limit is None else result.head(limit)
+
+    def group(self, keys, aggregations, filters=None):
+        for aggregation, _ in aggregations.values():
+            if aggregation not in GROUP_AGGREGATIONS:
+                raise DataSourceError(f"Unsupported aggregation at the source: {aggregation}")
+        keys = list(keys)
+        columns = keys + [c for _, c in aggregations.values() if c is not None]
+
+        # Partial results per file: sums and counts add up, minimums and maximums combine
+        partials = []
+        for df in self._frames(columns, filters):
+            parts = {}
+            grouped = df.groupby(keys, observed=True) if keys else None
+            for name, (aggregation, column) in aggregations.items():
+                if column is None:
+                    parts[f'{name}:count'] = grouped.size() if keys else pd.Series([len(df)])
+                    continue
+                source = grouped[column] if keys else df[column]
+                if aggregation in ('sum', 'mean'):
+                    parts[f'{name}:sum'] = source.sum() if keys else pd.Series([source.sum()])
+                if aggregation in ('count', 'mean'):
+                    parts[f'{name}:count'] = source.count() if keys else pd.Series([source.count()])
+                if aggregation in ('min', 'max'):
+                    value = getattr(source, aggregation)()
+                    parts[f'{name}:{aggregation}'] = value if keys else pd.Series([value])
+            partials.append(pd.DataFrame(parts))
+
+        if not partials:
+            # Every partition was ruled out by the filters
+            empty = {name: [0 if aggregation == 'count' or column is None else None]
+                     for name, (aggregation, column) in aggregations.items()}
+            return pd.DataFrame(columns=keys + list(aggregations)) if keys else pd.DataFrame(empty)
+        combined = pd.concat(partials)
+        how = {part: ('sum' if part.rsplit(':', 1)[1] in ('sum', 'count') else part.rsplit(':', 1)[1])
+               for part in combined.columns}
+        combined = combined.groupby(level=list(range(len(keys)))).agg(how) if keys else combined.agg(how).to_frame().T
+
+        result = pd.DataFrame(index=combined.index)
+        for name, (aggregation, column) in aggregations.items():
+            if column is None or aggregation == 'count':
+                result[name] = combined[f'{name}:count']
+            elif aggregation == 'mean':
+                result[name] = combined[f'{name}:sum'] / combined[f'{name}:count'].where(combined[f'{name}:count'] > 0)
+            else:
+                result[name] = combined[f'{name}:{aggregation}']
+        return result.reset_index() if keys else result.reset_index(drop=True)
+
+    def sql(self, query):
+        check_select(query)
+        # Without DuckDB, SQL runs on an in-memory SQLite copy of the data
+        conn = sqlite3.connect(':memory:')
+        try:
+            self.load_all().to_sql('data', conn, index=False)
+            return pd.read_sql_query(query, conn)
+        finally:
+            conn.close()
+
+
+class DuckDBFiles(SqlSource):
+    """CSV or Parquet files queried in place by DuckDB, which prunes partitions and reads only needed columns"""
+
+    def __init__(self, listing, reader):
+        super().__init__(listing.spec, listing.name)
+        self.listing = listing
+        self.reader = reader
+
+    def version(self):
+        return self.listing.version()
+
+    def relation(self):
+        files = ', '.join("'" + f.replace("'", "''") + "'" for f in self.listing.files())
+        return f"{self.reader}([{files}], hive_partitioning=true, union_by_name=true)"
+
+    def connect(self):
+        return duckdb.connect()
+
+    def fetch(self, sql, params=()):
+        conn = self.connect()
+        try:
+            return conn.execute(sql, [_scalar(p) for p in params]).df()
+        finally:
+            conn.close()
+
+
+def _open(spec):
+    if spec.startswith('sqlite:'):
+        path, _, query = spec[len('sqlite:'):].partition('?')
+        table = (parse_qs(query).get('table') or [''])[0]
+        if not table or not _TABLE_NAME_PATTERN.match(table):
+            raise DataSourceError("SQLite sources look like sqlite:<database file>?table=<table>")
+        if not _inside_roots(path):
+            raise DataSourceError(f"{path} is outside DATA_SOURCE_ROOTS")
+        if not os.path.isfile(path):
+            raise DataSourceError(f"SQLite database not found: {path}")
+        return SqliteTable(spec, path, table)
+
+    if spec.startswith('sqlserver:'):
+        table = spec[len('sqlserver:'):]
+        if not _TABLE_NAME_PATTERN.match(table) or table.lower() not in SQLSERVER_SOURCE_TABLES:
+            raise DataSourceError(f"SQL Server table {table} is not listed in SQLSERVER_SOURCE_TABLES")
+        return SqlServerTable(spec, table)
+
+    if os.path.isdir(spec):
+        base, pattern = spec, os.path.join(spec, '**', '*')
+    else:
+        base, pattern = os.path.dirname(_GLOB_CHARACTERS.split(spec, 1)[0]) or '.', spec
+    if not _inside_roots(base):
+        raise DataSourceError(f"{spec} is outside DATA_SOURCE_ROOTS")
+    listing = PartitionedFiles(spec, base, pattern)
+    extensions = {os.path.splitext(f)[1].lower() for f in listing.files()}
+    if duckdb is not None and extensions == {'.csv'}:
+        return DuckDBFiles(listing, 'read_csv_auto')
+    if duckdb is not None and extensions == {'.parquet'}:
+        return DuckDBFiles(listing, 'read_parquet')
+    return listing
+
+
+def open_source(spec):
+    """Return the data source for a 'sqlite:', 'sqlserver:', directory or glob spec"""
+    with _sources_lock:
+        source = _sources.get(spec)
+    if source is None:
+        source = _open(spec)
+        with _sources_lock:
+            _sources[spec] = source
+    return source
@@ -0,0 +1,124 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from get_tools.ingestion import read_columnar
+from get_tools.data_sources import is_source, open_source
+from metrics import span
+
+# Memory budget for parsed DataFrames kept in this process (in MB)
+DATASET_CACHE_MAX_MB = float(os.environ.get('DATASET_CACHE_MAX_MB', 1024))
+
+# (absolute path, size, mtime) -> (DataFrame, size in bytes)
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_bytes = 0
+
+# One lock per key so concurrent requests for the same file parse it only once
+_load_locks = {}
+
+
+def dataset_key(filepath):
+    """Return the cache key for a dataset file: path, size and modification time"""
+    if is_source(filepath):
+        # SQL tables and partitioned files: the spec and the source's own version
+        return (filepath, None, open_source(filepath).version())
+    stat = os.stat(filepath)
+    return (os.path.abspath(filepath), stat.st_size, stat.st_mtime_ns)
+
+
+def dataset_fingerprint(filepath):
+    """Return a short identifier of the current version of a dataset file"""
+    return hashlib.sha1(repr(dataset_key(filepath)).encode()).hexdigest()
+
+
+def read_dataset(filepath):
+    """Load a dataset from its columnar copy when one exists, else parse the CSV or Excel file"""
+    if is_source(filepath):
+        with span('dataset.load_source'):
+            return open_source(filepath).load_all()
+    with span('dataset.load_columnar'):
+        df = read_columnar(filepath)
+    if df is not None:
+        return df
+    with span('dataset.parse'):
+        if filepath.endswith('.csv'):
+            return pd.read_csv(filepath)
+        elif filepath.endswith(('.xlsx', '.xls')):
+            return pd.read_excel(filepath)
+    raise ValueError("Unsupported file format. Use CSV or Excel files.")
+
+
+def _evict(budget_bytes):
+    global _cache_bytes
+    while _cache and _cache_bytes > budget_bytes:
+        key, (_, size) = _cache.popitem(last=False)
+        _cache_bytes -= size
+        print(f"Dataset cache evicted {key[0]}")
+
+
+def load_dataset(filepath):
+    """
+    Return the parsed DataFrame for filepath, parsing the file only when it is
+    not cached yet or has changed on disk since it was cached.
+    """
+    global _cache_bytes
+    key = dataset_key(filepath)
+
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key][0]
+        load_lock = _load_locks.setdefault(key, threading.Lock())
+
+    with load_lock:
+        with _cache_lock:
+            if key in _cache:
+                _cache.move_to_end(key)
+                return _cache[key][0]
+
+        df = read_dataset(filepath)
+        size = int(df.memory_usage(deep=True).sum())
+
+        with _cache_lock:
+            # Drop stale entries for older versions of the same file
+            for stale in [k for k in _cache if k[0] == key[0]]:
+                _cache_bytes -= _cache.pop(stale)[1]
+            _cache[key] = (df, size)
+            _cache_bytes += size
+            _evict(DATASET_CACHE_MAX_MB * 1024**2)
+            _load_locks.pop(key, None)
+
+        return df
+
+
+def open_dataset(filepath):
+    """
+    The cached DataFrame of an uploaded file, or the DataSource of a SQL table or
+    partitioned files so callers can push their work down to it.
+    """
+    if is_source(filepath):
+        return open_source(filepath)
+    return load_dataset(filepath)
+
+
+def invalidate_dataset(filepath):
+    """Remove every cached version of filepath"""
+    global _cache_bytes
+    path = filepath if is_source(filepath) else os.path.abspath(filepath)
+    with _cache_lock:
+        for key in [k for k in _cache if k[0] == path]:
+            _cache_bytes -= _cache.pop(key)[1]
+
+
+def cache_info():
+    """Return the number of cached datasets and their total size in MB"""
+    with _cache_lock:
+        return {
+            'datasets': len(_cache),
+            'size_mb': round(_cache_bytes / 1024**2, 2),
+            'max_mb': DATASET_CACHE_MAX_MB,
+        }
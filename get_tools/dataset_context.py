@@ -0,0 +1,86 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+
+from get_tools.dataset_cache import load_dataset
+
+# Dataset bound to the current request: {'filepath': ..., 'chat_id': ..., 'approximate': ..., 'question': ...}
+_active_dataset = contextvars.ContextVar('active_dataset', default=None)
+
+# Chat ID -> filepath of the dataset that chat is working on
+_chat_datasets = {}
+_chat_datasets_lock = threading.Lock()
+
+
+def bind_dataset(filepath, chat_id=None, approximate=False, question=None):
+    """Bind filepath to the current context and return the token to reset it"""
+    if chat_id:
+        with _chat_datasets_lock:
+            _chat_datasets[chat_id] = filepath
+    return _active_dataset.set({'filepath': filepath, 'chat_id': chat_id, 'approximate': approximate,
+                                'question': question})
+
+
+@contextmanager
+def dataset_context(filepath, chat_id=None, approximate=False, question=None):
+    """
+    Make filepath the dataset the agent tools resolve for the duration of the block;
+    with approximate the tools and charts work from its sample and sketches, and
+    question is what get_data_eda ranks the columns of wide tables by
+    """
+    token = bind_dataset(filepath, chat_id, approximate, question)
+    try:
+        yield
+    finally:
+        _active_dataset.reset(token)
+
+
+def current_dataset():
+    """Return the dataset binding of the current context, or None"""
+    return _active_dataset.get()
+
+
+def dataset_for_chat(chat_id):
+    """Return the filepath last used by chat_id, or None"""
+    with _chat_datasets_lock:
+        return _chat_datasets.get(chat_id)
+
+
+def forget_chat(chat_id=None):
+    """Drop the dataset binding of one chat, or of every chat when chat_id is None"""
+    with _chat_datasets_lock:
+        if chat_id is None:
+            _chat_datasets.clear()
+        else:
+            _chat_datasets.pop(chat_id, None)
+
+
+def resolve_filepath(filepath=None):
+    """
+    Resolve which dataset a tool call refers to: an explicit filepath first,
+    then the dataset bound to the current context, then the chat's last dataset.
+    """
+    if filepath:
+        return filepath
+    binding = _active_dataset.get()
+    if binding is None:
+        return None
+    if binding.get('filepath'):
+        return binding['filepath']
+    if binding.get('chat_id'):
+        return dataset_for_chat(binding['chat_id'])
+    return None
+
+
+def is_approximate():
+    """True when the current request is answered from samples and sketches"""
+    binding = _active_dataset.get()
+    return bool(binding and binding.get('approximate'))
+
+
+def resolve_dataframe(filepath=None):
+    """Return the cached DataFrame for the resolved dataset, or None if there is none"""
+    resolved = resolve_filepath(filepath)
+    if not resolved:
+        return None
+    return load_dataset(resolved)
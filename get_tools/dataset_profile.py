@@ -0,0 +1,258 @@
+import os
+import json
+import math
+import hashlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+from get_tools.dataset_cache import dataset_key, load_dataset
+from get_tools.ingestion import iter_chunks
+from get_tools.data_sources import is_source, open_source
+from get_tools.result_shaping import compact_json
+
+# Number of most frequent values reported per categorical column
+PROFILE_TOP_K = int(os.environ.get('PROFILE_TOP_K', 5))
+PROFILE_SAMPLE_ROWS = 5
+
+# CSV files larger than this are profiled in chunks instead of being loaded whole
+PROFILE_CHUNK_THRESHOLD_MB = float(os.environ.get('PROFILE_CHUNK_THRESHOLD_MB', 200))
+PROFILE_CHUNK_ROWS = 100_000
+
+# Stop tracking distinct values of a column in chunked mode above this many
+PROFILE_MAX_TRACKED_VALUES = 100_000
+
+# Profiles of SQL tables and partitioned files, which have no file to sit next to
+SOURCE_PROFILE_DIR = os.path.join('uploads', 'sources')
+
+# dataset key -> (profile, serialized profile), so repeated get_data_eda calls are O(1)
+_profile_memo = {}
+_profile_lock = threading.Lock()
+
+
+def profile_path(filepath):
+    """Return the path of the profile stored next to the dataset file"""
+    if is_source(filepath):
+        os.makedirs(SOURCE_PROFILE_DIR, exist_ok=True)
+        return os.path.join(SOURCE_PROFILE_DIR, hashlib.sha1(filepath.encode()).hexdigest() + '.profile.json')
+    return filepath + '.profile.json'
+
+
+def _categorical_columns(df, include_bool=True):
+    kinds = ['object', 'category', 'string'] + (['bool'] if include_bool else [])
+    return df.select_dtypes(include=kinds).columns.tolist()
+
+
+def build_profile(df):
+    """Compute the dataset profile of an in-memory DataFrame"""
+    numeric_columns = df.select_dtypes(include=['number']).columns.tolist()
+    categorical_columns = _categorical_columns(df)
+
+    top_values = {}
+    for col in categorical_columns:
+        counts = df[col].value_counts().head(PROFILE_TOP_K)
+        top_values[col] = {str(k): int(v) for k, v in counts.items()}
+
+    return {
+        "shape": list(df.shape),
+        "columns": df.columns.tolist(),
+        "data_types": {col: str(dtype) for col, dtype in df.dtypes.items()},
+        "missing_values": df.isnull().sum().to_dict(),
+        "numeric_columns": numeric_columns,
+        "categorical_columns": _categorical_columns(df, include_bool=False),
+        "basic_stats": df.describe().to_dict() if numeric_columns else {},
+        "top_values": top_values,
+        "cardinality": df.nunique().to_dict(),
+        "sample_data": df.head(PROFILE_SAMPLE_ROWS).to_dict(),
+        "memory_usage": str(df.memory_usage(deep=True).sum() / 1024**2) + " MB",
+    }
+
+
+def _merge_numeric(stats, series):
+    """Merge count/mean/M2/min/max of series into stats (Chan et al. parallel variance)"""
+    values = series.dropna()
+    n = len(values)
+    if n == 0:
+        return
+    mean = float(values.mean())
+    m2 = float(((values - mean) ** 2).sum())
+    if stats['count'] == 0:
+        stats.update(count=n, mean=mean, m2=m2, min=float(values.min()), max=float(values.max()))
+        return
+    total = stats['count'] + n
+    delta = mean - stats['mean']
+    stats['m2'] += m2 + delta ** 2 * stats['count'] * n / total
+    stats['mean'] += delta * n / total
+    stats['count'] = total
+    stats['min'] = min(stats['min'], float(values.min()))
+    stats['max'] = max(stats['max'], float(values.max()))
+
+
+def build_profile_chunked(filepath, chunksize=PROFILE_CHUNK_ROWS):
+    """
+    Compute the dataset profile of a large file chunk by chunk, merging partial
+    results so the whole file never has to fit in memory. Quantiles are not
+    available in this mode and cardinalities are capped.
+    """
+    rows = 0
+    memory = 0
+    columns = None
+    dtypes = {}
+    missing = {}
+    numeric = {}
+    value_counts = {}
+    capped = set()
+    sample = None
+
+    for chunk in iter_chunks(filepath, chunksize):
+        if columns is None:
+            columns = chunk.columns.tolist()
+            sample = chunk.head(PROFILE_SAMPLE_ROWS)
+        rows += len(chunk)
+        memory += int(chunk.memory_usage(deep=True).sum())
+
+        for col, count in chunk.isnull().sum().items():
+            missing[col] = missing.get(col, 0) + int(count)
+        for col, dtype in chunk.dtypes.items():
+            dtypes.setdefault(col, set()).add(dtype)
+
+        for col in chunk.select_dtypes(include=['number']).columns:
+            stats = numeric.setdefault(col, {'count': 0, 'mean': 0.0, 'm2': 0.0, 'min': None, 'max': None})
+            _merge_numeric(stats, chunk[col])
+
+        for col in chunk.columns:
+            if col in capped:
+                continue
+            merged = value_counts.get(col)
+            counts = chunk[col].value_counts()
+            merged = counts if merged is None else merged.add(counts, fill_value=0)
+            if len(merged) > PROFILE_MAX_TRACKED_VALUES:
+                capped.add(col)
+                value_counts.pop(col, None)
+            else:
+                value_counts[col] = merged
+
+    if columns is None:
+        return build_profile(pd.read_csv(filepath))
+
+    data_types = {}
+    for col in columns:
+        kinds = list(dtypes[col])
+        if all(isinstance(k, np.dtype) and pd.api.types.is_numeric_dtype(k) for k in kinds):
+            data_types[col] = str(np.result_type(*kinds))
+        else:
+            data_types[col] = 'object'
+
+    numeric_columns = [col for col in columns if col in numeric and data_types[col] != 'object']
+    categorical_columns = [col for col in columns if data_types[col] in ('object', 'bool')]
+
+    basic_stats = {}
+    for col in numeric_columns:
+        stats = numeric[col]
+        std = math.sqrt(stats['m2'] / (stats['count'] - 1)) if stats['count'] > 1 else None
+        basic_stats[col] = {
+            'count': stats['count'], 'mean': stats['mean'], 'std': std,
+            'min': stats['min'], 'max': stats['max'],
+        }
+
+    top_values = {}
+    for col in categorical_columns:
+        if col in value_counts:
+            counts = value_counts[col].sort_values(ascending=False).head(PROFILE_TOP_K)
+            top_values[col] = {str(k): int(v) for k, v in counts.items()}
+
+    cardinality = {}
+    for col in columns:
+        if col in capped:
+            cardinality[col] = f">{PROFILE_MAX_TRACKED_VALUES}"
+        else:
+            cardinality[col] = int(len(value_counts.get(col, ())))
+
+    return {
+        "shape": [rows, len(columns)],
+        "columns": columns,
+        "data_types": data_types,
+        "missing_values": missing,
+        "numeric_columns": numeric_columns,
+        "categorical_columns": [col for col in columns if data_types[col] == 'object'],
+        "basic_stats": basic_stats,
+        "top_values": top_values,
+        "cardinality": cardinality,
+        "sample_data": sample.to_dict(),
+        "memory_usage": str(memory / 1024**2) + " MB",
+        "chunked": True,
+    }
+
+
+def compute_profile(filepath):
+    """Compute the profile of filepath, in chunks for large CSV files and at the source for SQL tables"""
+    if is_source(filepath):
+        profile = open_source(filepath).profile() or build_profile(load_dataset(filepath))
+    elif filepath.endswith('.csv') and os.path.getsize(filepath) / 1024**2 > PROFILE_CHUNK_THRESHOLD_MB:
+        profile = build_profile_chunked(filepath)
+    else:
+        profile = build_profile(load_dataset(filepath))
+    _, size, mtime_ns = dataset_key(filepath)
+    profile['source'] = {'size': size, 'mtime_ns': mtime_ns}
+    return profile
+
+
+def save_profile(filepath, profile):
+    """Persist the profile next to the dataset file"""
+    tmp_path = f"{profile_path(filepath)}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(profile, f, default=str)
+    os.replace(tmp_path, profile_path(filepath))
+
+
+def load_profile(filepath):
+    """Return the stored profile of filepath, or None if it is missing or stale"""
+    try:
+        with open(profile_path(filepath), encoding='utf-8') as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    _, size, mtime_ns = dataset_key(filepath)
+    if profile.get('source') != {'size': size, 'mtime_ns': mtime_ns}:
+        return None
+    return profile
+
+
+def get_profile(filepath):
+    """Return the profile of filepath, computing and storing it when needed"""
+    profile = load_profile(filepath)
+    if profile is None:
+        profile = compute_profile(filepath)
+        save_profile(filepath, profile)
+    return profile
+
+
+def _memoized_profile(filepath):
+    key = dataset_key(filepath)
+    with _profile_lock:
+        cached = _profile_memo.get(key)
+    if cached is not None:
+        return cached
+
+    profile = dict(get_profile(filepath))
+    profile.pop('source', None)
+    serialized = compact_json(profile)
+    # Parsed back so a freshly computed profile has the same plain types as a stored one
+    cached = (json.loads(serialized), serialized)
+
+    with _profile_lock:
+        for stale in [k for k in _profile_memo if k[0] == key[0]]:
+            del _profile_memo[stale]
+        _profile_memo[key] = cached
+    return cached
+
+
+def cached_profile(filepath):
+    """Return the profile of filepath without its version stamp, memoized per file version; treat it as read-only"""
+    return _memoized_profile(filepath)[0]
+
+
+def profile_json(filepath):
+    """Return the serialized profile of filepath, memoized per file version"""
+    return _memoized_profile(filepath)[1]
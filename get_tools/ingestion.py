@@ -0,0 +1,264 @@
+import os
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+INGEST_CHUNK_ROWS = int(os.environ.get('INGEST_CHUNK_ROWS', 100_000))
+INGEST_SAMPLE_ROWS = 50_000
+
+# Text columns whose sample has at most this share of distinct values become categories
+CATEGORY_MAX_RATIO = 0.5
+
+# Order in which a column's storage type is widened when a chunk does not fit it
+_WIDENING = {
+    'int8': 'int16', 'int16': 'int32', 'int32': 'int64', 'int64': 'float64',
+    'float32': 'float64', 'float64': 'string', 'bool': 'string', 'timestamp': 'string',
+}
+
+_ARROW_TYPES = {
+    'int8': 'int8', 'int16': 'int16', 'int32': 'int32', 'int64': 'int64',
+    'float32': 'float32', 'float64': 'float64', 'bool': 'bool_',
+    'category': 'string', 'string': 'string', 'timestamp': 'timestamp',
+}
+
+
+class _ChunkDoesNotFit(Exception):
+    def __init__(self, column, wider):
+        super().__init__(column)
+        self.column = column
+        self.wider = wider
+
+
+def columnar_path(filepath):
+    """Return the path of the columnar copy stored next to the dataset file"""
+    return filepath + '.arrow'
+
+
+def _source_stamp(filepath):
+    stat = os.stat(filepath)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _smallest_int(series):
+    low, high = series.min(), series.max()
+    for kind in ('int8', 'int16', 'int32'):
+        info = np.iinfo(kind)
+        if info.min <= low and high <= info.max:
+            return kind
+    return 'int64'
+
+
+def _wider_kind(kind, series):
+    """Return the storage type a column needs after series did not fit kind"""
+    if kind.startswith('int') and pd.api.types.is_numeric_dtype(series):
+        values = series.dropna()
+        if (values == values.round()).all():
+            needed = _smallest_int(values)
+            return max(kind, needed, key=lambda k: np.iinfo(k).bits)
+    return _WIDENING.get(kind, 'string')
+
+
+def infer_compact_dtypes(sample):
+    """
+    Choose a compact storage type for every column from a sample: the smallest
+    integer type, float32 when it is lossless, timestamps for datetime columns,
+    category for repetitive text and plain strings otherwise. These types are
+    for the file on disk only; read_columnar widens numbers back to 64 bits.
+    """
+    plan = {}
+    for col in sample.columns:
+        series = sample[col]
+        values = series.dropna()
+        if pd.api.types.is_bool_dtype(series):
+            plan[col] = 'bool'
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            # Excel dates arrive as datetime64 and keep working with .dt
+            plan[col] = 'timestamp'
+        elif pd.api.types.is_integer_dtype(series):
+            plan[col] = _smallest_int(series) if len(values) else 'int64'
+        elif pd.api.types.is_float_dtype(series):
+            if len(values) and (values == values.round()).all() and values.abs().max() < 2**53:
+                plan[col] = _smallest_int(values)
+            elif (values.astype('float32').astype('float64') == values).all():
+                plan[col] = 'float32'
+            else:
+                plan[col] = 'float64'
+        elif len(values) and values.nunique() <= CATEGORY_MAX_RATIO * len(values):
+            plan[col] = 'category'
+        else:
+            plan[col] = 'string'
+    return plan
+
+
+def _arrow_schema(plan, metadata):
+    fields = []
+    for col, kind in plan.items():
+        arrow_type = pa.timestamp('ns') if kind == 'timestamp' else getattr(pa, _ARROW_TYPES[kind])()
+        fields.append(pa.field(str(col), arrow_type))
+    return pa.schema(fields, metadata=metadata)
+
+
+def _standard_types(table):
+    """
+    Widen compact integer and float32 columns back to int64 and float64, so
+    arithmetic in analysis code cannot silently overflow the storage types
+    """
+    fields = []
+    for field in table.schema:
+        if pa.types.is_integer(field.type):
+            field = field.with_type(pa.int64())
+        elif pa.types.is_float32(field.type):
+            field = field.with_type(pa.float64())
+        fields.append(field)
+    widened = pa.schema(fields, metadata=table.schema.metadata)
+    return table if widened.equals(table.schema) else table.cast(widened)
+
+
+def _to_arrow(chunk, plan, schema):
+    """Convert one chunk to an Arrow record batch, raising _ChunkDoesNotFit for the first column that overflows its planned type"""
+    arrays = []
+    for (col, kind), field in zip(plan.items(), schema):
+        series = chunk[col]
+        if kind in ('category', 'string') and not isinstance(series.dtype, pd.StringDtype):
+            # A column widened to text may hold datetime64 or numbers; cast them all
+            series = series.astype(object).where(series.notna(), None)
+            series = series.where(series.isna(), series.astype(str))
+        elif kind == 'float32':
+            values = series.dropna()
+            if not (values.astype('float32').astype('float64') == values).all():
+                raise _ChunkDoesNotFit(col, 'float64')
+        try:
+            arrays.append(pa.array(series, type=field.type, from_pandas=True))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError, ValueError, OverflowError):
+            raise _ChunkDoesNotFit(col, _wider_kind(kind, series))
+    return pa.record_batch(arrays, schema=schema)
+
+
+def _iter_source_chunks(filepath):
+    # pandas cannot stream Excel files; they are read whole and then split
+    if filepath.endswith('.csv'):
+        yield from pd.read_csv(filepath, chunksize=INGEST_CHUNK_ROWS)
+    else:
+        df = pd.read_excel(filepath)
+        for start in range(0, max(len(df), 1), INGEST_CHUNK_ROWS):
+            yield df.iloc[start:start + INGEST_CHUNK_ROWS]
+
+
+def convert_to_columnar(filepath):
+    """
+    Convert a CSV or Excel file into an uncompressed Arrow IPC file with compact
+    column types, chunk by chunk. Returns the path of the columnar copy, or None
+    when pyarrow is not installed.
+    """
+    if pa is None:
+        return None
+
+    if filepath.endswith('.csv'):
+        sample = pd.read_csv(filepath, nrows=INGEST_SAMPLE_ROWS)
+    else:
+        sample = next(_iter_source_chunks(filepath))
+    plan = infer_compact_dtypes(sample)
+    del sample
+
+    metadata = {'source': json.dumps(_source_stamp(filepath))}
+    target = columnar_path(filepath)
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    try:
+        # A later chunk may not fit the types inferred from the sample; widen that column and start over
+        while True:
+            metadata['compact_dtypes'] = json.dumps({str(k): v for k, v in plan.items()})
+            schema = _arrow_schema(plan, metadata)
+            try:
+                with pa.OSFile(tmp_path, 'wb') as sink, pa.ipc.new_file(sink, schema) as writer:
+                    for chunk in _iter_source_chunks(filepath):
+                        writer.write_batch(_to_arrow(chunk, plan, schema))
+                break
+            except _ChunkDoesNotFit as e:
+                if plan[e.column] == e.wider:
+                    raise ValueError(f"Column {e.column} does not fit any storage type")
+                plan[e.column] = e.wider
+                print(f"Widening column {e.column} to {plan[e.column]}")
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return target
+
+
+def columnar_is_current(filepath):
+    """True when the columnar copy of filepath exists and was built from its current version"""
+    target = columnar_path(filepath)
+    if pa is None or not os.path.exists(target):
+        return False
+    try:
+        metadata = pa.ipc.open_file(pa.memory_map(target, 'r')).schema.metadata or {}
+    except (OSError, pa.ArrowInvalid):
+        return False
+    return json.loads(metadata.get(b'source', b'null')) == _source_stamp(filepath)
+
+
+def read_columnar(filepath):
+    """
+    Return the DataFrame stored in the columnar copy of filepath. The copy is
+    memory-mapped, which saves re-parsing the original, but the whole table is
+    still read into memory: numbers are widened back to int64 and float64 and
+    converted to pandas. Returns None when the copy is missing, stale or
+    pyarrow is not installed.
+    """
+    target = columnar_path(filepath)
+    if pa is None or not os.path.exists(target):
+        return None
+
+    reader = pa.ipc.open_file(pa.memory_map(target, 'r'))
+    metadata = reader.schema.metadata or {}
+    if json.loads(metadata.get(b'source', b'null')) != _source_stamp(filepath):
+        return None
+
+    plan = json.loads(metadata.get(b'compact_dtypes', b'{}'))
+    table = _standard_types(reader.read_all())
+    for i, name in enumerate(table.column_names):
+        if plan.get(name) == 'category':
+            table = table.set_column(i, name, table.column(i).dictionary_encode())
+
+    string_dtype = pd.StringDtype('pyarrow')
+    return table.to_pandas(split_blocks=True, types_mapper={pa.string(): string_dtype}.get)
+
+
+def ingest_file(filepath):
+    """Build the columnar copy of an uploaded file, logging instead of failing the upload"""
+    try:
+        if columnar_is_current(filepath):
+            # The same content was uploaded before
+            return columnar_path(filepath)
+        return convert_to_columnar(filepath)
+    except Exception as e:
+        print(f"Columnar conversion failed for {filepath}: {str(e)}")
+        return None
+
+
+def iter_chunks(filepath, chunksize=INGEST_CHUNK_ROWS):
+    """
+    Yield the dataset as DataFrame chunks, from the columnar copy's record batches
+    when it is fresh. Without one a CSV file is read in chunks of chunksize rows,
+    but an Excel file is yielded whole, since pandas cannot stream it.
+    """
+    target = columnar_path(filepath)
+    if pa is not None and os.path.exists(target):
+        reader = pa.ipc.open_file(pa.memory_map(target, 'r'))
+        metadata = reader.schema.metadata or {}
+        if json.loads(metadata.get(b'source', b'null')) == _source_stamp(filepath):
+            for i in range(reader.num_record_batches):
+                yield _standard_types(pa.Table.from_batches([reader.get_batch(i)])).to_pandas()
+            return
+    if filepath.endswith('.csv'):
+        yield from pd.read_csv(filepath, chunksize=chunksize)
+    else:
+        yield pd.read_excel(filepath)
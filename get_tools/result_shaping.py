@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import uuid
+
+import pandas as pd
+
+# Largest tool result, in characters, passed to the LLM as is
+RESULT_MAX_CHARS = int(os.environ.get('RESULT_MAX_CHARS', 20000))
+# Rows shown from each end of an oversized table
+RESULT_PREVIEW_ROWS = int(os.environ.get('RESULT_PREVIEW_ROWS', 5))
+# Columns described in the summary of an oversized table
+RESULT_STATS_MAX_COLUMNS = int(os.environ.get('RESULT_STATS_MAX_COLUMNS', 50))
+# Oversized results are stored here so follow-up code can slice them with load_result()
+RESULT_HANDLE_DIR = os.environ.get('RESULT_HANDLE_DIR', os.path.join('uploads', 'results'))
+RESULT_HANDLE_TTL_SECONDS = int(os.environ.get('RESULT_HANDLE_TTL_SECONDS', 3600))
+
+
+def compact_json(value):
+    """Serialize without indentation or spaces after separators"""
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False, default=str)
+
+
+def _frame_records(frame):
+    # pandas' native encoder is much faster than json.dumps over to_dict() rows
+    return frame.to_json(orient='records', date_format='iso', default_handler=str)
+
+
+def _handle_path(handle):
+    return os.path.join(RESULT_HANDLE_DIR, f'{handle}.pkl')
+
+
+def _purge_expired_handles():
+    cutoff = time.time() - RESULT_HANDLE_TTL_SECONDS
+    try:
+        entries = list(os.scandir(RESULT_HANDLE_DIR))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def save_result(frame):
+    """Store an oversized result and return its handle, or None if it cannot be stored"""
+    try:
+        os.makedirs(RESULT_HANDLE_DIR, exist_ok=True)
+        _purge_expired_handles()
+        handle = uuid.uuid4().hex[:16]
+        tmp_path = _handle_path(handle) + '.tmp'
+        frame.to_pickle(tmp_path)
+        os.replace(tmp_path, _handle_path(handle))
+        return handle
+    except Exception as e:
+        print(f"Result handle not stored: {str(e)}")
+        return None
+
+
+def load_result(handle):
+    """Return the DataFrame stored under a handle from an earlier summarized result"""
+    # Handles are hex ids; reject anything that could point outside the directory
+    if not isinstance(handle, str) or not handle.isalnum():
+        raise ValueError(f"Invalid result handle: {handle!r}")
+    try:
+        return pd.read_pickle(_handle_path(handle))
+    except FileNotFoundError:
+        raise ValueError(f"Result handle {handle} has expired, run the query again")
+
+
+def _scalar(value):
+    # numpy scalars would otherwise be serialized as strings
+    return value.item() if hasattr(value, 'item') else value
+
+
+def _column_stats(frame):
+    stats = {}
+    for column in list(frame.columns)[:RESULT_STATS_MAX_COLUMNS]:
+        series = frame[column]
+        entry = {'dtype': str(series.dtype), 'nulls': int(series.isna().sum())}
+        try:
+            if pd.api.types.is_numeric_dtype(series) and not pd.api.types.is_bool_dtype(series):
+                entry.update({name: _scalar(getattr(series, name)()) for name in ('min', 'max', 'mean', 'sum')})
+            else:
+                counts = series.value_counts(dropna=True)
+                entry['unique'] = int(series.nunique(dropna=True))
+                if not counts.empty:
+                    entry['top'] = _scalar(counts.index[0])
+                    entry['top_count'] = int(counts.iloc[0])
+        except Exception:
+            pass
+        stats[str(column)] = entry
+    return stats
+
+
+def summarize_frame(frame, store=True):
+    """Bounded description of a large DataFrame: size, head/tail, column stats and a handle"""
+    rows = RESULT_PREVIEW_ROWS
+    head = frame.head(rows)
+    tail = frame.iloc[max(rows, len(frame) - rows):]
+    # Keep index labels such as group keys, which are dropped by orient='records'
+    if not isinstance(frame.index, pd.RangeIndex):
+        head, tail = head.reset_index(), tail.reset_index()
+
+    summary = {
+        'truncated': True,
+        'row_count': int(len(frame)),
+        'column_count': int(frame.shape[1]),
+        'columns': [str(c) for c in frame.columns],
+        'head': json.loads(_frame_records(head)),
+        'tail': json.loads(_frame_records(tail)),
+        'column_stats': _column_stats(frame),
+    }
+    handle = save_result(frame) if store else None
+    if handle:
+        summary['handle'] = handle
+        summary['note'] = (
+            f"Result too large to return in full. Aggregate it further, or continue from it with "
+            f"result = load_result('{handle}') in execute_python_code."
+        )
+    else:
+        summary['note'] = "Result too large to return in full. Aggregate or filter it further."
+    return compact_json(summary)
+
+
+def _truncate_text(text):
+    if len(text) <= RESULT_MAX_CHARS:
+        return text
+    return text[:RESULT_MAX_CHARS] + f"\n... [truncated {len(text) - RESULT_MAX_CHARS} of {len(text)} characters]"
+
+
+def _summarize_collection(value):
+    """First items of an oversized dict or list that fit in half the result budget"""
+    is_dict = isinstance(value, dict)
+    items = value.items() if is_dict else value
+    preview, used = [], 0
+    for item in items:
+        used += len(compact_json(list(item) if is_dict else item)) + 1
+        if used > RESULT_MAX_CHARS // 2:
+            break
+        preview.append(item)
+    preview = {str(k): v for k, v in preview} if is_dict else preview
+    return compact_json({'truncated': True, 'length': len(value), 'preview': preview})
+
+
+def shape_result(result, output):
+    """
+    Turn the 'answer' of executed code, or its printed output, into the tool's
+    string result. Small results are returned in full as compact JSON; results
+    over RESULT_MAX_CHARS are replaced by a bounded summary.
+    """
+    if result is None:
+        return _truncate_text(output) if output else "Code executed successfully"
+
+    if isinstance(result, pd.Series):
+        # Every element takes at least one character, so long ones are summarized unencoded
+        if len(result) <= RESULT_MAX_CHARS:
+            encoded = compact_json(result.to_dict())
+            if len(encoded) <= RESULT_MAX_CHARS:
+                return encoded
+        return summarize_frame(result.to_frame(name=result.name if result.name is not None else 'value'))
+
+    if isinstance(result, pd.DataFrame):
+        if result.size <= RESULT_MAX_CHARS:
+            encoded = _frame_records(result)
+            if len(encoded) <= RESULT_MAX_CHARS:
+                return encoded
+        return summarize_frame(result)
+
+    if isinstance(result, (dict, list, tuple)):
+        encoded = compact_json(result)
+        if len(encoded) > RESULT_MAX_CHARS:
+            return _summarize_collection(result)
+        return encoded
+
+    return _truncate_text(str(result))
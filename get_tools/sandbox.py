@@ -0,0 +1,341 @@
+import os
+import re
+import sys
+import json
+import queue
+import atexit
+import threading
+import multiprocessing
+from io import StringIO
+from contextlib import contextmanager
+
+import pandas as pd
+
+from get_tools.dataset_cache import load_dataset
+from get_tools.data_sources import is_source, open_source
+from get_tools.result_shaping import shape_result, load_result
+from get_tools.chat_session import storable_result
+from get_tools.approximate import load_synopsis, code_environment
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; limits are then enforced by the wall-clock timeout only
+    resource = None
+
+# 'process' runs code in the worker pool, 'inline' in the calling thread
+EXECUTION_SANDBOX = os.environ.get('EXECUTION_SANDBOX', 'process')
+SANDBOX_WORKERS = int(os.environ.get('SANDBOX_WORKERS', min(4, os.cpu_count() or 1)))
+SANDBOX_TIMEOUT_SECONDS = float(os.environ.get('SANDBOX_TIMEOUT_SECONDS', 60))
+SANDBOX_CPU_SECONDS = int(os.environ.get('SANDBOX_CPU_SECONDS', 30))
+# Address-space limit of each worker; memory-mapped datasets count towards it
+SANDBOX_MEMORY_MB = int(os.environ.get('SANDBOX_MEMORY_MB', 4096))
+
+
+_capture = threading.local()
+_capture_lock = threading.Lock()
+
+
+class _ThreadStdout:
+    """sys.stdout that sends a thread's writes to its capture buffer while its code runs"""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def _target(self):
+        return getattr(_capture, 'buffer', None) or self.stream
+
+    def write(self, text):
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+
+
+@contextmanager
+def _captured_stdout(buffer):
+    """
+    Like contextlib.redirect_stdout, but only for the calling thread, so inline
+    execution in a web thread does not capture other requests' output
+    """
+    with _capture_lock:
+        if not isinstance(sys.stdout, _ThreadStdout):
+            sys.stdout = _ThreadStdout(sys.stdout)
+    _capture.buffer = buffer
+    try:
+        yield
+    finally:
+        _capture.buffer = None
+
+
+def _no_query(sql):
+    raise ValueError("query() is only available for SQL tables and partitioned datasets; use df")
+
+
+def load_for_code(filepath, code, approximate=False):
+    """
+    The df code runs with and any further names it can use. A SQL table or
+    partitioned dataset is only loaded whole when the code uses df; otherwise the
+    code aggregates at the source with query(). In approximate mode df is a uniform
+    sample of a large upload, with estimators that report confidence bounds.
+    """
+    if approximate:
+        synopsis = load_synopsis(filepath)
+        if synopsis is not None:
+            return code_environment(synopsis)
+    if not is_source(filepath):
+        return load_dataset(filepath), {}
+    df = load_dataset(filepath) if re.search(r'\bdf\b', code) else None
+    return df, {'query': open_source(filepath).sql}
+
+
+def run_code(df, code, env=None, results=None):
+    """
+    Execute code against df and return (formatted 'answer', answer DataFrame worth
+    keeping or None). env adds names such as query(sql) for a data source, and
+    results holds DataFrames kept from earlier questions of the chat.
+    """
+    try:
+        # Everything the code writes to stdout: print, df.info(), sys.stdout.write
+        output_buffer = StringIO()
+
+        # Create a safe execution environment
+        local_env = {
+            # Shallow copy so column changes made by the code do not leak into the cache
+            'df': df.copy(deep=False) if df is not None else None,
+            'pd': pd,
+            'json': json,
+            'load_result': load_result,
+            'query': _no_query,
+            'results': {name: frame.copy(deep=False) for name, frame in (results or {}).items()},
+            'answer': None,
+            **(env or {}),
+        }
+
+        try:
+            # Execute the code
+            with _captured_stdout(output_buffer):
+                exec(code, local_env)
+            result = local_env.get('answer', None)
+        except MemoryError:
+            return "Error in code execution: the computation exceeded the memory limit", None
+        except Exception as exec_error:
+            return f"Error in code execution: {str(exec_error)}", None
+
+        return shape_result(result, output_buffer.getvalue()), storable_result(result)
+    except Exception as e:
+        return f"Error: {str(e)}", None
+
+
+def _set_cpu_limit(seconds):
+    """Allow this process `seconds` more CPU time; the kernel sends SIGXCPU past it"""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = used + seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _worker_main(conn, memory_mb):
+    if resource is not None and memory_mb > 0:
+        try:
+            limit = memory_mb * 1024**2
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ValueError, OSError) as e:
+            print(f"Sandbox memory limit not applied: {str(e)}", file=sys.stderr)
+
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            return
+        command = message[0]
+        if command == 'stop':
+            return
+        if command == 'preload':
+            try:
+                load_dataset(message[1])
+            except Exception:
+                pass
+            conn.send(('preloaded',))
+            continue
+
+        _, filepath, code, cpu_seconds, results, approximate = message
+        try:
+            if resource is not None and cpu_seconds > 0:
+                _set_cpu_limit(cpu_seconds)
+            df, env = load_for_code(filepath, code, approximate)
+            reply = run_code(df, code, env, results)
+        except MemoryError:
+            reply = "Error in code execution: the computation exceeded the memory limit", None
+        except Exception as e:
+            reply = f"Error loading dataset: {str(e)}", None
+        conn.send(reply)
+
+
+class _Worker:
+    def __init__(self, context):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main, args=(child_conn, SANDBOX_MEMORY_MB), daemon=True, name='sandbox-worker'
+        )
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.join(1)
+        finally:
+            self.conn.close()
+
+
+class SandboxPool:
+    """
+    Pre-started worker processes that execute LLM-written code. Each worker loads
+    datasets itself from the memory-mapped columnar copy, so the page cache is
+    shared instead of pickling DataFrames across. A worker that runs out of CPU
+    time, memory or wall-clock time is killed and replaced; the web process is
+    never affected.
+    """
+
+    def __init__(self, size=SANDBOX_WORKERS):
+        # forkserver forks workers from a clean single-threaded process; spawn elsewhere
+        method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        self._context = multiprocessing.get_context(method)
+        self._idle = queue.Queue()
+        self._all = []
+        self._lock = threading.Lock()
+        self._closed = False
+        for _ in range(size):
+            self._add_worker()
+
+    def _add_worker(self):
+        worker = _Worker(self._context)
+        with self._lock:
+            self._all.append(worker)
+        self._idle.put(worker)
+
+    def _replace(self, worker):
+        worker.kill()
+        with self._lock:
+            if worker in self._all:
+                self._all.remove(worker)
+        if not self._closed:
+            self._add_worker()
+
+    def _acquire(self, timeout):
+        while True:
+            worker = self._idle.get(timeout=timeout)
+            if worker.process.is_alive():
+                return worker
+            self._replace(worker)
+
+    def execute(self, filepath, code, results=None, approximate=False,
+                timeout=SANDBOX_TIMEOUT_SECONDS, cpu_seconds=SANDBOX_CPU_SECONDS):
+        try:
+            worker = self._acquire(timeout)
+        except queue.Empty:
+            return "Error: all code execution workers are busy, please retry", None
+
+        try:
+            worker.conn.send(('run', filepath, code, cpu_seconds, results or {}, approximate))
+            if not worker.conn.poll(timeout):
+                self._replace(worker)
+                return f"Error in code execution: timed out after {timeout:g} seconds", None
+            reply = worker.conn.recv()
+        except (EOFError, OSError, BrokenPipeError):
+            # The worker was killed by its CPU or memory limit
+            self._replace(worker)
+            return "Error in code execution: the computation exceeded the CPU or memory limit", None
+
+        self._idle.put(worker)
+        return reply
+
+    def preload(self, filepath):
+        """
+        Have the idle workers load a dataset ahead of the first question. They are
+        taken out of the pool until they have, so no code is queued behind a load.
+        """
+        workers = []
+        while True:
+            try:
+                workers.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        if workers:
+            threading.Thread(target=self._preload, args=(workers, filepath), daemon=True,
+                             name='sandbox-preload').start()
+
+    def _preload(self, workers, filepath):
+        loading = []
+        for worker in workers:
+            try:
+                worker.conn.send(('preload', filepath))
+                loading.append(worker)
+            except (OSError, BrokenPipeError):
+                self._replace(worker)
+        for worker in loading:
+            try:
+                if worker.conn.poll(SANDBOX_TIMEOUT_SECONDS):
+                    worker.conn.recv()
+                    self._idle.put(worker)
+                    continue
+            except (EOFError, OSError):
+                pass
+            self._replace(worker)
+
+    def close(self):
+        self._closed = True
+        with self._lock:
+            workers = list(self._all)
+            self._all.clear()
+        for worker in workers:
+            try:
+                worker.conn.send(('stop',))
+            except (OSError, BrokenPipeError):
+                pass
+            worker.process.join(1)
+            if worker.process.is_alive():
+                worker.kill()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SandboxPool()
+                atexit.register(_pool.close)
+    return _pool
+
+
+def start_sandbox_pool():
+    """Start the worker processes ahead of the first question"""
+    if EXECUTION_SANDBOX == 'process':
+        get_pool()
+
+
+def preload_dataset(filepath):
+    if EXECUTION_SANDBOX == 'process' and _pool is not None:
+        _pool.preload(filepath)
+
+
+def execute_code(filepath, code, results=None, approximate=False):
+    """
+    Execute code against the dataset at filepath, isolated in a worker process unless
+    configured inline. Returns (tool result, answer DataFrame worth keeping or None).
+    """
+    if EXECUTION_SANDBOX == 'process':
+        return get_pool().execute(filepath, code, results, approximate)
+    df, env = load_for_code(filepath, code, approximate)
+    return run_code(df, code, env, results)
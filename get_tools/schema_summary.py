@@ -0,0 +1,169 @@
+import os
+import re
+import difflib
+
+from get_tools.dataset_profile import cached_profile, profile_json
+from get_tools.result_shaping import compact_json
+
+# Tables with at most this many columns get their whole profile from get_data_eda
+EDA_FULL_PROFILE_MAX_COLUMNS = int(os.environ.get('EDA_FULL_PROFILE_MAX_COLUMNS', 40))
+# Columns of a wider table described in detail, the most relevant to the question first
+EDA_DETAIL_COLUMNS = int(os.environ.get('EDA_DETAIL_COLUMNS', 12))
+EDA_SAMPLE_VALUES = 3
+# Column name words at least this similar to a question word count as a match
+NAME_SIMILARITY = 0.85
+# Numeric columns with at least this share of distinct values are taken for identifiers
+IDENTIFIER_MIN_DISTINCT_RATIO = 0.95
+
+_WORD_PATTERN = re.compile(r'[a-z]+|\d+')
+_CAMEL_CASE = re.compile(r'([a-z])([A-Z])')
+_STOP_WORDS = frozenset(
+    "a an and are as at be by do does for from give has have how i in is it me my of on or per show "
+    "tell than that the their them there these this to was we were what when where which who why with "
+    "would you your top most each all data dataset table column".split()
+)
+
+
+def _words(text):
+    """Lowercase words of text, splitting camelCase and snake_case, without plural 's'"""
+    words = []
+    for word in _WORD_PATTERN.findall(_CAMEL_CASE.sub(r'\1 \2', str(text)).lower()):
+        if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+def _matches(word, question_words):
+    if word in question_words:
+        return True
+    if len(word) <= 3:
+        return False
+    for other in question_words:
+        matcher = difflib.SequenceMatcher(None, word, other)
+        # The quick ratios are upper bounds, so most pairs are ruled out cheaply
+        if (matcher.real_quick_ratio() >= NAME_SIMILARITY and matcher.quick_ratio() >= NAME_SIMILARITY
+                and matcher.ratio() >= NAME_SIMILARITY):
+            return True
+    return False
+
+
+def is_identifier(profile, column):
+    """
+    True for columns named like an ID (CustomerID, order_id, "Order ID"), and for
+    integers that are distinct in (nearly) every row. Float measures such as
+    prices are often distinct per row too, so they never count.
+    """
+    words = _words(column)
+    if words and words[-1] == 'id':
+        return True
+    cardinality = profile.get('cardinality', {}).get(column)
+    rows = profile.get('shape', [0])[0]
+    if 'int' not in str(profile.get('data_types', {}).get(column, '')).lower():
+        return False
+    return isinstance(cardinality, int) and rows > 1 and cardinality >= IDENTIFIER_MIN_DISTINCT_RATIO * rows
+
+
+def _prior(profile, column):
+    """Small bonus for likely measures and dimensions; orders the columns no question word matches"""
+    cardinality = profile.get('cardinality', {}).get(column)
+    if not isinstance(cardinality, int) or is_identifier(profile, column):
+        return 0.0
+    if column in profile.get('numeric_columns', []):
+        return 0.5
+    return 0.5 if 1 < cardinality <= 50 else 0.0
+
+
+def rank_columns(profile, question):
+    """
+    Columns of the profile ordered by relevance to question: columns named in it,
+    then columns sharing words with it or holding a value it mentions, then
+    likely measures and dimensions, otherwise in table order
+    """
+    text = f" {' '.join(_words(question))} "
+    question_words = set(text.split()) - _STOP_WORDS
+    top_values = profile.get('top_values', {})
+
+    scores = {}
+    for column in profile['columns']:
+        column = str(column)
+        name_words = [w for w in _words(column) if w not in _STOP_WORDS] or _words(column)
+        score = _prior(profile, column)
+        if name_words and f" {' '.join(name_words)} " in text:
+            score += 3
+        if name_words and question_words:
+            score += 2 * sum(_matches(w, question_words) for w in name_words) / len(name_words)
+        for value in top_values.get(column, {}):
+            value_words = _words(value)
+            if len(''.join(value_words)) > 2 and f" {' '.join(value_words)} " in text:
+                score += 1.5
+                break
+        scores[column] = score
+    return sorted(scores, key=lambda column: -scores[column])
+
+
+def _column_detail(profile, column):
+    detail = {
+        'type': profile.get('data_types', {}).get(column),
+        'missing': profile.get('missing_values', {}).get(column),
+        'distinct': profile.get('cardinality', {}).get(column),
+    }
+    if column in profile.get('basic_stats', {}):
+        detail['stats'] = profile['basic_stats'][column]
+    if profile.get('top_values', {}).get(column):
+        detail['top_values'] = profile['top_values'][column]
+    sample = profile.get('sample_data', {}).get(column)
+    if sample:
+        detail['sample'] = list(sample.values())[:EDA_SAMPLE_VALUES]
+    return {key: value for key, value in detail.items() if value is not None}
+
+
+def requested_columns(columns, profile):
+    """Parse the columns argument of get_data_eda: one column name or a comma separated list"""
+    names = [str(c) for c in profile['columns']]
+    columns = (columns or '').strip()
+    if not columns:
+        return None
+    if columns in names:
+        return [columns]
+    return [c.strip().strip('\'"') for c in columns.split(',') if c.strip()]
+
+
+def tiered_profile(profile, question='', columns=None):
+    """
+    What get_data_eda returns: the whole profile of a narrow table. For a wide one,
+    every column name grouped by type, with details for the requested columns or
+    for the columns most relevant to question.
+    """
+    names = [str(c) for c in profile['columns']]
+    if columns is None and len(names) <= EDA_FULL_PROFILE_MAX_COLUMNS:
+        return profile
+
+    view = {'shape': profile['shape']}
+    if columns is None:
+        detailed = rank_columns(profile, question)[:EDA_DETAIL_COLUMNS]
+        by_type = {}
+        for name in names:
+            by_type.setdefault(profile.get('data_types', {}).get(name, 'unknown'), []).append(name)
+        view['columns_by_type'] = by_type
+        view['columns_with_missing'] = {c: n for c, n in profile.get('missing_values', {}).items() if n}
+        view['note'] = (
+            f"Wide table: details cover the {len(detailed)} columns most relevant to the question. "
+            "Call get_data_eda again with columns='<name>,<name>' for details of others."
+        )
+    else:
+        detailed = [c for c in columns if c in names]
+        unknown = [c for c in columns if c not in names]
+        if unknown:
+            view['unknown_columns'] = {c: difflib.get_close_matches(c, names, n=3, cutoff=0.5) for c in unknown}
+    view['column_details'] = {c: _column_detail(profile, c) for c in detailed}
+    return view
+
+
+def eda_json(filepath, question='', columns=''):
+    """Serialized get_data_eda result for filepath; the whole stored profile when nothing is pruned"""
+    profile = cached_profile(filepath)
+    view = tiered_profile(profile, question, requested_columns(columns, profile))
+    if view is profile:
+        return profile_json(filepath)
+    return compact_json(view)
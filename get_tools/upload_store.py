@@ -0,0 +1,172 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from get_tools.ingestion import columnar_path
+from get_tools.dataset_profile import profile_path
+from get_tools.dataset_cache import invalidate_dataset
+from get_tools.approximate import synopsis_path
+import answer_cache
+
+UPLOAD_FOLDER = 'uploads'
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+INDEX_FILENAME = 'uploads_index.json'
+# Unreferenced uploads are kept this long after their last use before they are deleted
+UPLOAD_GC_GRACE_SECONDS = float(os.environ.get('UPLOAD_GC_GRACE_SECONDS', 24 * 3600))
+
+_index_lock = threading.Lock()
+
+
+def _index_path(folder):
+    return os.path.join(folder, INDEX_FILENAME)
+
+
+@contextmanager
+def _locked_index(folder):
+    """
+    Yield the upload index for read-modify-write, saving it afterwards. The index
+    maps stored name -> {'filenames', 'chats', 'size', 'last_used'} and is shared
+    by every server process through a file lock where the platform has one.
+    """
+    with _index_lock, open(os.path.join(folder, '.index.lock'), 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            index = _read_index(folder)
+            before = json.dumps(index, sort_keys=True)
+            yield index
+            if json.dumps(index, sort_keys=True) != before:
+                tmp_path = f"{_index_path(folder)}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(index, f)
+                os.replace(tmp_path, _index_path(folder))
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read_index(folder):
+    try:
+        with open(_index_path(folder), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        print(f"Upload index is unreadable, starting a new one: {str(e)}")
+        return {}
+
+
+def _stored_name(filepath):
+    return os.path.basename(filepath)
+
+
+def store_upload(file_storage, filename, folder=UPLOAD_FOLDER):
+    """
+    Stream an uploaded file to disk while hashing it and store it under its
+    content hash, so identical files share one copy and its derived artifacts.
+    Returns (filepath, is_new).
+    """
+    extension = filename.rsplit('.', 1)[1].lower()
+    digest = hashlib.sha256()
+    tmp_path = os.path.join(folder, f".upload.{os.getpid()}.{threading.get_ident()}.part")
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = file_storage.stream.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+
+        stored_name = f"{digest.hexdigest()}.{extension}"
+        filepath = os.path.join(folder, stored_name)
+        with _locked_index(folder) as index:
+            is_new = not os.path.exists(filepath)
+            if is_new:
+                os.replace(tmp_path, filepath)
+            entry = index.setdefault(stored_name, {'filenames': [], 'chats': [], 'size': os.path.getsize(filepath)})
+            if filename not in entry['filenames']:
+                entry['filenames'].append(filename)
+            entry['last_used'] = time.time()
+        return filepath, is_new
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def retain_upload(filepath, chat_id, folder=UPLOAD_FOLDER):
+    """Record that chat_id uses the stored upload at filepath so it is kept until the chat is deleted"""
+    with _locked_index(folder) as index:
+        entry = index.get(_stored_name(filepath))
+        if entry is None:
+            # Not a content-addressed upload, e.g. a file stored before the index existed
+            return
+        if chat_id not in entry['chats']:
+            entry['chats'].append(chat_id)
+            entry['last_used'] = time.time()
+
+
+def release_chat(chat_id=None, folder=UPLOAD_FOLDER):
+    """Drop the references of one deleted chat, or of every chat when chat_id is None"""
+    with _locked_index(folder) as index:
+        for entry in index.values():
+            if chat_id is None:
+                entry['chats'] = []
+            elif chat_id in entry['chats']:
+                entry['chats'].remove(chat_id)
+
+
+def _remove_artifacts(filepath):
+    """Delete a stored upload together with everything derived from it"""
+    if os.path.exists(filepath):
+        # Answer cache entries are keyed by the file's current version, so drop them first
+        answer_cache.invalidate(filepath)
+    invalidate_dataset(filepath)
+    for path in (filepath, columnar_path(filepath), profile_path(filepath), synopsis_path(filepath)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def collect_garbage(folder=UPLOAD_FOLDER, grace_seconds=UPLOAD_GC_GRACE_SECONDS, keep=()):
+    """
+    Delete uploads no chat refers to that have not been used for grace_seconds,
+    except the filepaths in keep. Returns the freed bytes.
+    """
+    cutoff = time.time() - grace_seconds
+    keep = {_stored_name(filepath) for filepath in keep}
+    freed = 0
+    with _locked_index(folder) as index:
+        expired = [n for n, e in index.items() if not e['chats'] and e.get('last_used', 0) <= cutoff and n not in keep]
+        for stored_name in expired:
+            filepath = os.path.join(folder, stored_name)
+            try:
+                _remove_artifacts(filepath)
+            except OSError as e:
+                print(f"Could not delete upload {stored_name}: {str(e)}")
+                continue
+            freed += index.pop(stored_name).get('size', 0)
+    if freed:
+        print(f"Upload garbage collection freed {freed / 1024**2:.1f} MB")
+    return freed
+
+
+def upload_stats(folder=UPLOAD_FOLDER):
+    """Number of stored uploads, their total size and how many are referenced by chats"""
+    with _locked_index(folder) as index:
+        return {
+            'uploads': len(index),
+            'size_mb': round(sum(e.get('size', 0) for e in index.values()) / 1024**2, 2),
+            'referenced': sum(1 for e in index.values() if e['chats']),
+            'filenames': sum(len(e['filenames']) for e in index.values()),
+        }
+
@@ -0,0 +1,70 @@
+import os
+import gzip
+import hashlib
+
+from flask import current_app, request
+
+from metrics import increment
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# JSON responses smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def make_etag(*parts):
+    """ETag value for a response identified by parts, e.g. a chat's ID and version"""
+    return hashlib.sha1('\x1f'.join(str(part) for part in parts).encode('utf-8')).hexdigest()
+
+
+def not_modified(etag):
+    """A 304 response when the client's copy (If-None-Match) is still current, otherwise None"""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    increment('http_not_modified_total')
+    response = current_app.response_class(status=304)
+    return _revalidated(response, etag)
+
+
+def _revalidated(response, etag):
+    # Weak, as the same JSON is served gzip-, brotli- or un-encoded
+    response.set_etag(etag, weak=True)
+    # Clients may keep the response but must check it is current before reusing it
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def _encode(body):
+    """Compress body with the best encoding the client accepts: (body, encoding or None)"""
+    if len(body) < COMPRESS_MIN_BYTES:
+        return body, None
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    if accepted['gzip']:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), 'gzip'
+    return body, None
+
+
+def cacheable_json(payload, etag=None):
+    """
+    JSON response that clients revalidate with If-None-Match, compressed when they
+    accept gzip or brotli. Without an etag it is derived from the body.
+    """
+    body = current_app.json.dumps(payload).encode('utf-8')
+    etag = etag or hashlib.sha1(body).hexdigest()
+    response = not_modified(etag)
+    if response is not None:
+        return response
+
+    body, encoding = _encode(body)
+    response = current_app.response_class(body, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return _revalidated(response, etag)
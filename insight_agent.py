@@ -1,17 +1,76 @@
-from crewai import Agent, Task, Crew, Process, LLM
+from crewai import Agent, Task, Crew, Process
 from get_tools.agent_tools import get_data_eda, execute_python_code
+from job_queue import report_agent_step
+from agent_runtime import get_llm, get_crew, run_crew
 import pandas as pd
 
-llm = LLM(
-    model="<your_model>",
-    api_version="<your_api_version>",
-    base_url="<your_endpoint>",
-    api_key="<your_api_key>"
-)
+def _build_extraction_crew():
+    extraction_agent = Agent(
+        role='data_extraction_agent',
+        goal='Extract exactly the data values needed to answer a question about a dataset.',
+        backstory='''
+        You are a data engineer who prepares data for analysts and chart designers.
+        You do not write insights or charts yourself; you extract the numbers they need.
+
+        WORKFLOW:
+        =========
+        1. Call get_data_eda to understand the dataset structure
+        2. Write pandas code that computes the aggregates, rankings, distributions or
+           time series the question needs, and store them in the 'answer' variable
+        3. Prefer a few compact aggregations over raw rows
+        4. If the question is generic (e.g. "Provide insights"), extract the key metrics
+           and breakdowns that would support around 10 business insights
+
+        RESPONSE FORMAT:
+        ================
+        - Return ONLY a JSON object whose keys describe each extracted result
+          (e.g. "revenue_by_brand") and whose values are the extracted data
+        - Round numbers to 2 decimal places
+        - No explanations, no markdown
+        ''',
+        tools=[get_data_eda, execute_python_code],
+        llm=get_llm(),
+        allow_delegation=False,
+        cache=False,
+        verbose=True,
+    )
 
-def Multi_agent_Conversation(user_query, filepath):
-    user_question = user_query
-    
+    task = Task(
+        description="User Question: {user_query}\n\nDataset filepath: {filepath}{chat_context}{chart_note}",
+        expected_output='A JSON object with the extracted data values',
+        agent=extraction_agent
+    )
+    crew = Crew(
+        agents=[extraction_agent],
+        tasks=[task],
+        process=Process.sequential,
+        cache=False,
+        step_callback=report_agent_step
+    )
+    return crew, task
+
+def chat_note(chat_context):
+    '''Task text for the earlier turns and kept results of the chat, if there are any'''
+    if not chat_context:
+        return ""
+    return f"\n\n{chat_context}\nUse them to resolve follow-up questions such as \"break that down by region\"."
+
+def extract_query_data(user_query, filepath, chart_enabled=False, chat_context=''):
+    '''
+    Shared extraction phase: compute the aggregates the question needs once, so the
+    insight and visualization agents can both work from the result in parallel.
+    '''
+    chart_note = "\n\nThe results will also be charted, so include labels and values for a chart." if chart_enabled else ""
+    crew, task = get_crew('extraction', _build_extraction_crew)
+    try:
+        run_crew('extraction', crew, {'user_query': user_query, 'filepath': filepath,
+                                      'chat_context': chat_note(chat_context), 'chart_note': chart_note})
+        return task.output.raw
+    except Exception as e:
+        print(f"Data extraction failed: {str(e)}")
+        return None
+
+def _build_insight_crew():
     insight_agent = Agent(
         role='insight_agent',
         goal='Expertly analyze datasets and provide clear, human-readable responses and insights.',
@@ -54,23 +113,38 @@ def Multi_agent_Conversation(user_query, filepath):
         - Round numbers to 2 decimal places for clarity
         ''',
         tools=[get_data_eda, execute_python_code],
-        llm=llm,
+        llm=get_llm(),
         allow_delegation=False,
+        cache=False,
         verbose=True,
     )
 
     task = Task(
-        description=f"User Question: {user_question}\n\nDataset filepath: {filepath}",
+        description="User Question: {user_query}\n\nDataset filepath: {filepath}{chat_context}{extracted_data}",
         expected_output='Provide insights or answer the user query based on the data available',
         agent=insight_agent
     )
     crew = Crew(
         agents=[insight_agent],
         tasks=[task],
-        process=Process.sequential
+        process=Process.sequential,
+        cache=False,
+        step_callback=report_agent_step
     )
+    return crew, task
+
+def Multi_agent_Conversation(user_query, filepath, extracted_data=None, chat_context=''):
+    extracted_note = ""
+    if extracted_data:
+        extracted_note = (
+            "\n\nData already extracted for this question (use it directly and only "
+            f"call the tools if something is missing):\n{extracted_data}"
+        )
+
+    crew, task = get_crew('insight', _build_insight_crew)
     try:
-        crew.kickoff()
+        run_crew('insight', crew, {'user_query': user_query, 'filepath': filepath,
+                                   'chat_context': chat_note(chat_context), 'extracted_data': extracted_note})
         task_output = task.output
         result = task_output.raw
         return result 
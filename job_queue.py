@@ -0,0 +1,147 @@
+import os
+import time
+import uuid
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import record_llm_call
+
+# Number of queries processed at the same time
+QUERY_WORKERS = int(os.environ.get('QUERY_WORKERS', 4))
+# Maximum number of queued plus running queries before new ones are rejected
+QUERY_QUEUE_SIZE = int(os.environ.get('QUERY_QUEUE_SIZE', 32))
+# Finished jobs are kept this long for status polling
+JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', 3600))
+
+_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS, thread_name_prefix='query-worker')
+_slots = threading.BoundedSemaphore(QUERY_QUEUE_SIZE)
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+# Job being processed by the current worker thread, used to report progress
+_current_job = contextvars.ContextVar('current_job', default=None)
+
+
+class QueueFullError(Exception):
+    """Raised when the query queue has no free slot"""
+
+
+class Job:
+    def __init__(self):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'
+        self.events = []
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self._changed = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in ('completed', 'failed')
+
+    def emit(self, event_type, data=None):
+        """Append a progress event and wake up any stream waiting on this job"""
+        with self._changed:
+            self.events.append({'type': event_type, 'data': data, 'time': time.time()})
+            self._changed.notify_all()
+
+    def _finish(self, status, result=None, error=None):
+        with self._changed:
+            self.status = status
+            self.result = result
+            self.error = error
+            self.finished_at = time.time()
+            self.events.append({'type': status, 'data': result if error is None else {'error': error}, 'time': self.finished_at})
+            self._changed.notify_all()
+
+    def wait_for_events(self, after, timeout):
+        """Block until there are events past index after, the job finishes or timeout expires"""
+        with self._changed:
+            self._changed.wait_for(lambda: len(self.events) > after or self.done, timeout)
+            return self.events[after:]
+
+    def snapshot(self, after=0):
+        with self._changed:
+            return {
+                'jobId': self.id,
+                'status': self.status,
+                'events': self.events[after:],
+                'result': self.result,
+                'error': self.error,
+            }
+
+
+def _run(job, fn, args, kwargs):
+    job.status = 'running'
+    job.emit('started')
+    token = _current_job.set(job)
+    try:
+        job._finish('completed', result=fn(*args, **kwargs))
+    except Exception as e:
+        print(f"Job {job.id} failed: {str(e)}")
+        job._finish('failed', error=str(e))
+    finally:
+        _current_job.reset(token)
+        _slots.release()
+
+
+def _purge_expired():
+    cutoff = time.time() - JOB_TTL_SECONDS
+    with _jobs_lock:
+        for job_id in [j.id for j in _jobs.values() if j.done and j.finished_at < cutoff]:
+            del _jobs[job_id]
+
+
+def submit_job(fn, *args, **kwargs):
+    """Queue fn(*args, **kwargs) on the worker pool and return its Job, or raise QueueFullError"""
+    if not _slots.acquire(blocking=False):
+        raise QueueFullError('Too many queries in progress, please retry shortly')
+    _purge_expired()
+    job = Job()
+    with _jobs_lock:
+        _jobs[job.id] = job
+    try:
+        # Each job starts from an empty context rather than the submitting request's
+        _executor.submit(contextvars.Context().run, _run, job, fn, args, kwargs)
+    except Exception:
+        _slots.release()
+        raise
+    return job
+
+
+def completed_job(result):
+    """Register a job that is already finished, for answers served without running the agents"""
+    _purge_expired()
+    job = Job()
+    job._finish('completed', result=result)
+    with _jobs_lock:
+        _jobs[job.id] = job
+    return job
+
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def emit_progress(event_type, data=None):
+    """Report progress on the job running in the current thread; a no-op outside jobs"""
+    job = _current_job.get()
+    if job is not None:
+        job.emit(event_type, data)
+
+
+def report_agent_step(step):
+    """CrewAI step callback that forwards tool calls and intermediate agent text as job progress"""
+    # Every agent step is one LLM response
+    record_llm_call()
+    tool = getattr(step, 'tool', None)
+    if tool:
+        emit_progress('tool_call', {'tool': tool, 'input': str(getattr(step, 'tool_input', ''))[:500]})
+        return
+    text = getattr(step, 'output', None) or getattr(step, 'text', None) or str(step)
+    emit_progress('agent_step', {'text': str(text)[:2000]})
@@ -0,0 +1,228 @@
+import os
+import sys
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Upper bounds, in seconds, of the stage duration histogram buckets
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, float('inf'))
+
+_lock = threading.Lock()
+# stage -> [bucket counts, sum, count]
+_histograms = {}
+# (metric name, sorted label items) -> value
+_counters = {}
+_peak_request_rss = [0]
+
+_current_request = contextvars.ContextVar('request_metrics', default=None)
+# Seconds spent in tools by the agent run of the current thread, to separate LLM time
+_tool_seconds = contextvars.ContextVar('tool_seconds', default=None)
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def current_rss_bytes():
+    """Resident memory of this process now, or its peak where the current value is unavailable"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RequestMetrics:
+    """Timings and counts of one /query, shared by the threads that work on it"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.llm_calls = 0
+        self.tokens = {'prompt': 0, 'completion': 0, 'total': 0}
+        self.tool_calls = {}
+        self.peak_rss_bytes = current_rss_bytes()
+
+    def add_stage(self, stage, seconds):
+        with self._lock:
+            entry = self.stages.setdefault(stage, {'seconds': 0.0, 'count': 0})
+            entry['seconds'] += seconds
+            entry['count'] += 1
+            self.peak_rss_bytes = max(self.peak_rss_bytes, current_rss_bytes())
+
+    def summary(self):
+        with self._lock:
+            return {
+                'total_seconds': round(time.perf_counter() - self.started, 4),
+                'stages': {k: {'seconds': round(v['seconds'], 4), 'count': v['count']} for k, v in self.stages.items()},
+                'llm_calls': self.llm_calls,
+                'tokens': dict(self.tokens),
+                'tool_calls': dict(self.tool_calls),
+                'peak_rss_mb': round(self.peak_rss_bytes / 1024**2, 1),
+            }
+
+
+def start_request():
+    """Begin collecting metrics for the request handled in the current context"""
+    request = RequestMetrics()
+    _current_request.set(request)
+    return request
+
+
+def current_request():
+    return _current_request.get()
+
+
+def _labels_key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def increment(name, amount=1, **labels):
+    with _lock:
+        key = _labels_key(name, labels)
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(stage, seconds):
+    """Record one duration of stage in the histogram and the current request"""
+    with _lock:
+        entry = _histograms.get(stage)
+        if entry is None:
+            entry = _histograms[stage] = [[0] * len(_BUCKETS), 0.0, 0]
+        for i, bound in enumerate(_BUCKETS):
+            if seconds <= bound:
+                entry[0][i] += 1
+        entry[1] += seconds
+        entry[2] += 1
+
+    request = _current_request.get()
+    if request is not None:
+        request.add_stage(stage, seconds)
+        with _lock:
+            _peak_request_rss[0] = max(_peak_request_rss[0], request.peak_rss_bytes)
+
+
+@contextmanager
+def span(stage):
+    """Time the enclosed block as stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+@contextmanager
+def tool_span(tool):
+    """Time and count one tool invocation made by an agent"""
+    increment('tool_calls_total', tool=tool)
+    request = _current_request.get()
+    if request is not None:
+        with request._lock:
+            request.tool_calls[tool] = request.tool_calls.get(tool, 0) + 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe(f'tool.{tool}', elapsed)
+        spent = _tool_seconds.get()
+        if spent is not None:
+            spent[0] += elapsed
+
+
+@contextmanager
+def agent_span(agent):
+    """Time an agent run; the part not spent in tools is recorded as llm.<agent>"""
+    token = _tool_seconds.set([0.0])
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        tools = _tool_seconds.get()[0]
+        _tool_seconds.reset(token)
+        observe(f'agent.{agent}', elapsed)
+        observe(f'llm.{agent}', max(0.0, elapsed - tools))
+
+
+def record_llm_call():
+    increment('llm_calls_total')
+    request = _current_request.get()
+    if request is not None:
+        with request._lock:
+            request.llm_calls += 1
+
+
+def record_token_usage(usage):
+    """Add a CrewAI usage_metrics / token_usage object or dict to the token counters"""
+    if usage is None:
+        return
+    if not isinstance(usage, dict):
+        usage = usage.model_dump() if hasattr(usage, 'model_dump') else vars(usage)
+    counts = {
+        'prompt': int(usage.get('prompt_tokens') or 0),
+        'completion': int(usage.get('completion_tokens') or 0),
+        'total': int(usage.get('total_tokens') or 0),
+    }
+    for kind, count in counts.items():
+        if count:
+            increment('llm_tokens_total', count, type=kind)
+    request = _current_request.get()
+    if request is not None:
+        with request._lock:
+            for kind, count in counts.items():
+                request.tokens[kind] += count
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in labels) + '}'
+
+
+def render_prometheus():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    with _lock:
+        histograms = {k: (list(v[0]), v[1], v[2]) for k, v in _histograms.items()}
+        counters = dict(_counters)
+        peak_request_rss = _peak_request_rss[0]
+
+    lines.append('# HELP stage_duration_seconds Time spent per processing stage')
+    lines.append('# TYPE stage_duration_seconds histogram')
+    for stage in sorted(histograms):
+        buckets, total, count = histograms[stage]
+        for bound, bucket_count in zip(_BUCKETS, buckets):
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f'stage_duration_seconds_bucket{_format_labels([("stage", stage), ("le", le)])} {bucket_count}')
+        lines.append(f'stage_duration_seconds_sum{_format_labels([("stage", stage)])} {total}')
+        lines.append(f'stage_duration_seconds_count{_format_labels([("stage", stage)])} {count}')
+
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f'# TYPE {name} counter')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+
+    lines.append('# HELP process_resident_memory_bytes Resident memory of the server process')
+    lines.append('# TYPE process_resident_memory_bytes gauge')
+    lines.append(f'process_resident_memory_bytes {current_rss_bytes()}')
+    lines.append('# HELP request_peak_resident_memory_bytes Highest resident memory observed during a query')
+    lines.append('# TYPE request_peak_resident_memory_bytes gauge')
+    lines.append(f'request_peak_resident_memory_bytes {peak_request_rss}')
+    return '\n'.join(lines) + '\n'
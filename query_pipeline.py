@@ -0,0 +1,86 @@
+import os
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from insight_agent import Multi_agent_Conversation, extract_query_data
+from visualization import execute_visualization_agent
+from dashboard import generate_dashboard
+from job_queue import emit_progress, QUERY_WORKERS
+from query_planner import try_fast_path
+from get_tools.chat_session import chat_context, is_follow_up
+from metrics import span, increment
+
+# 'parallel': one shared extraction step, then insight and chart agents side by side
+# 'sequential': chart agent starts after the insight agent, as before
+QUERY_PIPELINE_MODE = os.environ.get('QUERY_PIPELINE_MODE', 'parallel')
+
+# Two agents per running query
+_agent_executor = ThreadPoolExecutor(max_workers=QUERY_WORKERS * 2, thread_name_prefix='query-agent')
+
+
+def _submit(fn, *args, **kwargs):
+    # Run in a copy of the caller's context so the dataset binding and job progress carry over
+    return _agent_executor.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def visualize(user_query, response, filepath, chart_type, extracted_data=None, context=''):
+    # Dashboards build their panels concurrently from one planning call
+    if chart_type == 'dashboard':
+        return generate_dashboard(user_query, response, filepath, extracted_data=extracted_data, chat_context=context)
+    return execute_visualization_agent(user_query, response, filepath, chart_type,
+                                       extracted_data=extracted_data, chat_context=context)
+
+
+def run_sequential(user_query, filepath, chart_enabled, chart_type, context=''):
+    emit_progress('stage', {'name': 'insight'})
+    response = Multi_agent_Conversation(user_query, filepath, chat_context=context)
+
+    visualization = None
+    if chart_enabled:
+        emit_progress('stage', {'name': 'visualization'})
+        emit_progress('partial', {'response': response})
+        visualization = visualize(user_query, response, filepath, chart_type, context=context)
+    return response, visualization
+
+
+def run_parallel(user_query, filepath, chart_enabled, chart_type, context=''):
+    # Without a chart there is nothing to share the extraction with
+    if not chart_enabled:
+        return run_sequential(user_query, filepath, chart_enabled, chart_type, context)
+
+    emit_progress('stage', {'name': 'extraction'})
+    extracted_data = extract_query_data(user_query, filepath, chart_enabled=True, chat_context=context)
+    if not extracted_data:
+        return run_sequential(user_query, filepath, chart_enabled, chart_type, context)
+
+    emit_progress('stage', {'name': 'insight'})
+    emit_progress('stage', {'name': 'visualization'})
+    insight_future = _submit(Multi_agent_Conversation, user_query, filepath, extracted_data=extracted_data,
+                             chat_context=context)
+    visualization_future = _submit(visualize, user_query, None, filepath, chart_type, extracted_data=extracted_data,
+                                   context=context)
+
+    response = insight_future.result()
+    emit_progress('partial', {'response': response})
+    return response, visualization_future.result()
+
+
+def run_agents(user_query, filepath, chart_enabled=False, chart_type='auto', chat_id=None):
+    """Return (insight text, visualization dict or None) for one question"""
+    # A follow-up such as "break that down by region" depends on the earlier turns,
+    # which only the agents see
+    if not is_follow_up(chat_id, user_query):
+        # Simple aggregations are computed directly, without any LLM round-trip
+        with span('fast_path'):
+            answered = try_fast_path(user_query, filepath, chart_enabled, chart_type)
+        if answered is not None:
+            increment('queries_total', path='fast_path')
+            emit_progress('stage', {'name': 'fast_path'})
+            return answered
+    increment('queries_total', path='agents')
+
+    # Earlier questions, answers and kept results of the chat
+    context = chat_context(chat_id, filepath)
+    if QUERY_PIPELINE_MODE == 'sequential':
+        return run_sequential(user_query, filepath, chart_enabled, chart_type, context)
+    return run_parallel(user_query, filepath, chart_enabled, chart_type, context)
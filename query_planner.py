@@ -0,0 +1,371 @@
+import os
+import re
+
+import pandas as pd
+
+from get_tools.dataset_cache import open_dataset
+from get_tools.dataset_profile import get_profile
+from chart_binding import echarts_option
+
+# Answer simple aggregation questions without the agents; 'false' always uses the agents
+QUERY_FAST_PATH = os.environ.get('QUERY_FAST_PATH', 'true').lower() == 'true'
+# Groups listed in a fast-path answer before the rest are summarized
+FAST_PATH_MAX_ROWS = int(os.environ.get('FAST_PATH_MAX_ROWS', 20))
+DEFAULT_TOP_N = 10
+
+_AGGREGATIONS = {
+    'total': 'sum', 'sum': 'sum',
+    'average': 'mean', 'avg': 'mean', 'mean': 'mean',
+    'median': 'median',
+    'maximum': 'max', 'max': 'max',
+    'minimum': 'min', 'min': 'min',
+    'count': 'count', 'number': 'count', 'many': 'count',
+}
+_AGGREGATION_LABELS = {
+    'sum': 'total', 'mean': 'average', 'median': 'median', 'max': 'maximum', 'min': 'minimum', 'count': 'number of rows',
+}
+# "how many unique customers": count distinct values of the counted column
+_DISTINCT_WORDS = {'unique', 'distinct', 'different'}
+_DESCENDING = {'top', 'highest', 'largest', 'biggest', 'most', 'best'}
+_ASCENDING = {'bottom', 'lowest', 'smallest', 'least', 'worst', 'fewest'}
+_GROUP_WORDS = {'by', 'per', 'each', 'across', 'every'}
+_TIME_GRAINS = {
+    'daily': 'D', 'day': 'D',
+    'weekly': 'W', 'week': 'W',
+    'monthly': 'M', 'month': 'M',
+    'quarterly': 'Q', 'quarter': 'Q',
+    'yearly': 'Y', 'year': 'Y', 'annual': 'Y', 'annually': 'Y',
+}
+_GRAIN_LABELS = {'D': 'day', 'W': 'week', 'M': 'month', 'Q': 'quarter', 'Y': 'year'}
+_TREND_WORDS = {'trend', 'time', 'over'}
+_ROW_WORDS = {'row', 'record', 'entry', 'line'}
+# Words that do not change the computation
+_FILLER_WORDS = {
+    'what', 'whats', 'which', 'who', 'is', 'are', 'was', 'were', 'the', 'a', 'an', 'of', 'in', 'for',
+    'to', 'show', 'me', 'give', 'tell', 'list', 'display', 'get', 'find', 'please', 'can', 'could',
+    'you', 'i', 'want', 'see', 'how', 'do', 'does', 'we', 'have', 'has', 'had', 'there', 'with', 'and',
+    'data', 'dataset', 'value', 'amount', 'overall', 'all', 'their', 'its', 'wise', 'based', 'on',
+}
+_DATE_NAME_WORDS = {'date', 'time', 'timestamp', 'datetime', 'day', 'month', 'period'}
+
+_CHART_TYPES = {'auto', 'bar', 'line', 'area', 'pie', 'treemap'}
+
+
+class _NoMatch(Exception):
+    """The question or the data does not fit a fast-path plan"""
+
+
+def _singular(word):
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+# Compare vocabulary in the same singular form as the question words
+_FILLER_WORDS = {_singular(w) for w in _FILLER_WORDS}
+
+
+def _words(text):
+    # Split camelCase and snake_case names the same way as free text
+    text = re.sub(r'([a-z])([A-Z])', r'\1 \2', str(text))
+    return [_singular(w) for w in re.findall(r'[a-z0-9]+', text.lower())]
+
+
+def _match_columns(words, columns):
+    """Replace the longest runs of words that spell a column name by ('column', name)"""
+    names = sorted(((_words(c), c) for c in columns), key=lambda item: -len(item[0]))
+    tokens, i = [], 0
+    while i < len(words):
+        for name_words, column in names:
+            if name_words and words[i:i + len(name_words)] == name_words:
+                tokens.append(('column', column))
+                i += len(name_words)
+                break
+        else:
+            tokens.append(('word', words[i]))
+            i += 1
+    return tokens
+
+
+def is_date_column(column, profile):
+    """Datetime columns, and text columns named like dates"""
+    dtype = str(profile['data_types'].get(column, ''))
+    if 'datetime' in dtype:
+        return True
+    if column in profile['numeric_columns']:
+        return False
+    return bool(set(_words(column)) & _DATE_NAME_WORDS)
+
+
+def plan_query(user_query, profile):
+    """Return a plan dict for a simple aggregation question, or None to use the agents"""
+    numeric = set(profile['numeric_columns'])
+    tokens = _match_columns(_words(user_query), profile['columns'])
+
+    aggregation, ascending, limit, grain = None, None, None, None
+    trend = False
+    dimensions, others, counted = [], [], []
+    group_next = False
+    # Right after "how many", "number of", "count of": a column here is what is counted
+    count_next = False
+    distinct = False
+
+    for kind, value in tokens:
+        if kind == 'column':
+            if count_next:
+                counted.append(value)
+            else:
+                (dimensions if group_next else others).append(value)
+            group_next = count_next = False
+            continue
+        if value in _DISTINCT_WORDS:
+            # A modifier, never the counted noun itself
+            distinct = True
+            continue
+        if value in _GROUP_WORDS:
+            group_next = True
+        elif value in _AGGREGATIONS:
+            found = _AGGREGATIONS[value]
+            if aggregation not in (None, found):
+                return None
+            aggregation = found
+            count_next = found == 'count'
+            continue
+        elif value in _DESCENDING or value in _ASCENDING:
+            ascending = value in _ASCENDING
+        elif value.isdigit():
+            if limit is not None:
+                return None
+            limit = int(value)
+        elif value in _TIME_GRAINS:
+            grain = _TIME_GRAINS[value]
+            group_next = False
+        elif value in _TREND_WORDS:
+            trend = True
+        elif value in _ROW_WORDS or value in _FILLER_WORDS:
+            # "how many rows"; any other counted noun ("how many returns") needs the agents
+            pass
+        else:
+            return None
+        if value not in _FILLER_WORDS:
+            count_next = False
+
+    if limit is not None and ascending is None:
+        return None
+    # A count of a numeric column ("count of revenue") or of distinct values of no column is ambiguous
+    if len(counted) > 1 or (counted and counted[0] in numeric) or (distinct and not counted):
+        return None
+    # "how many products have revenue": a distinct count with a condition on another column
+    if counted and (any(c in numeric for c in dimensions + others) or (others and ascending is None)):
+        return None
+
+    if ascending is not None:
+        # "top 5 brands by revenue": the ranked column is the label, "by" names the measure
+        matched = dimensions + others
+        measures = [c for c in matched if c in numeric]
+        labels = [c for c in matched if c not in numeric]
+        if len(measures) > 1 or len(labels) > 1:
+            return None
+        dimension = labels[0] if labels else None
+    else:
+        measures = [c for c in others if c in numeric]
+        labels = [c for c in others if c not in numeric]
+        if len(measures) > 1 or len(dimensions) > 1:
+            return None
+        dimension = dimensions[0] if dimensions else None
+        if dimension is None and len(labels) == 1:
+            dimension = labels.pop()
+        if labels:
+            return None
+    measure = measures[0] if measures else None
+
+    if dimension is not None and is_date_column(dimension, profile):
+        grain = grain or 'M'
+    if grain or trend:
+        if dimension is None:
+            dates = [c for c in profile['columns'] if is_date_column(c, profile)]
+            if len(dates) != 1:
+                return None
+            dimension = dates[0]
+        elif not is_date_column(dimension, profile):
+            return None
+        grain = grain or 'M'
+
+    if aggregation is None:
+        # "revenue by brand", "top 5 brands by revenue"
+        aggregation = 'sum' if measure else ('count' if dimension else None)
+    if aggregation is None or (aggregation != 'count' and measure is None):
+        return None
+    if aggregation == 'count':
+        measure = None
+    if counted:
+        # "how many customers", "number of regions": distinct values, not rows per value
+        aggregation, measure = 'nunique', counted[0]
+
+    if grain:
+        return {'kind': 'series', 'aggregation': aggregation, 'measure': measure, 'dimension': dimension, 'grain': grain}
+    if dimension is None:
+        if ascending is not None or limit is not None:
+            return None
+        return {'kind': 'scalar', 'aggregation': aggregation, 'measure': measure}
+    if ascending is not None:
+        return {
+            'kind': 'rank', 'aggregation': aggregation, 'measure': measure, 'dimension': dimension,
+            'ascending': ascending, 'limit': limit or (1 if 'which' in user_query.lower() else DEFAULT_TOP_N),
+        }
+    return {'kind': 'group', 'aggregation': aggregation, 'measure': measure, 'dimension': dimension}
+
+
+# Partial aggregates a source computes for each plan aggregation, and how partials combine
+_PARTIALS = {'sum': ('sum',), 'count': ('count',), 'min': ('min',), 'max': ('max',), 'mean': ('sum', 'count')}
+_COMBINE = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+
+
+def _period_keys(plan, keys):
+    dates = keys if pd.api.types.is_datetime64_any_dtype(keys) else pd.to_datetime(keys, errors='coerce')
+    if dates.notna().mean() < 0.8:
+        raise _NoMatch(f"{plan['dimension']} is not a date column")
+    return dates.dt.to_period(plan['grain'])
+
+
+def _order(plan, result, numeric_keys):
+    if plan['kind'] == 'series':
+        result = result.sort_index()
+        result.index = result.index.astype(str)
+        return result
+    if plan['kind'] == 'rank':
+        result = result.dropna()
+        return result.nsmallest(plan['limit']) if plan['ascending'] else result.nlargest(plan['limit'])
+    if numeric_keys:
+        # Numeric groups such as years read best in order
+        return result.sort_index()
+    return result.sort_values(ascending=False)
+
+
+def _execute_on_source(plan, source):
+    """Group at the source by the raw dimension with partial aggregates, then finish the plan in pandas"""
+    aggregation, measure, dimension = plan['aggregation'], plan['measure'], plan.get('dimension')
+    if aggregation not in _PARTIALS:
+        # A median or distinct count cannot be combined from partials; load just the two columns
+        return execute_plan(plan, source.load(columns=[c for c in (dimension, measure) if c]))
+
+    keys = [dimension] if plan['kind'] != 'scalar' else []
+    frame = source.group(keys, {part: (part, measure) for part in _PARTIALS[aggregation]})
+    if plan['kind'] == 'series':
+        frame[dimension] = _period_keys(plan, frame[dimension])
+    if keys:
+        numeric_keys = pd.api.types.is_numeric_dtype(frame[dimension])
+        frame = frame.groupby(dimension, observed=True).agg({part: _COMBINE[part] for part in _PARTIALS[aggregation]})
+
+    result = frame['sum'] / frame['count'] if aggregation == 'mean' else frame[aggregation]
+    if not keys:
+        value = result.iloc[0]
+        return int(value) if aggregation == 'count' else value
+    return _order(plan, result, numeric_keys)
+
+
+def execute_plan(plan, df):
+    """Compute a plan with vectorized pandas, or at the data source; returns a scalar or a Series"""
+    if not isinstance(df, pd.DataFrame):
+        return _execute_on_source(plan, df)
+    if plan['kind'] == 'scalar':
+        if plan['aggregation'] == 'count':
+            return len(df)
+        return getattr(df[plan['measure']], plan['aggregation'])()
+
+    keys = df[plan['dimension']]
+    if plan['kind'] == 'series':
+        keys = _period_keys(plan, keys)
+
+    if plan['aggregation'] == 'count':
+        result = keys.value_counts(dropna=True)
+    else:
+        result = df[plan['measure']].groupby(keys, observed=True).agg(plan['aggregation'])
+    return _order(plan, result, pd.api.types.is_numeric_dtype(keys))
+
+
+def _format_number(value):
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float):
+        if value.is_integer():
+            return f"{int(value):,}"
+        return f"{value:,.2f}"
+    if isinstance(value, int):
+        return f"{value:,}"
+    return str(value)
+
+
+def _subject(plan):
+    if plan['aggregation'] == 'count':
+        return 'number of rows'
+    if plan['aggregation'] == 'nunique':
+        return f"number of distinct {plan['measure']} values"
+    return f"{_AGGREGATION_LABELS[plan['aggregation']]} {plan['measure']}"
+
+
+def describe_result(plan, result):
+    """Human-readable answer in the same register as the insight agent"""
+    if plan['kind'] == 'scalar':
+        if plan['aggregation'] == 'count':
+            return f"The dataset contains {_format_number(result)} rows."
+        if plan['aggregation'] == 'nunique':
+            return f"There are {_format_number(result)} distinct {plan['measure']} values."
+        return f"The {_subject(plan)} is {_format_number(result)}."
+
+    if plan['kind'] == 'rank':
+        order = 'bottom' if plan['ascending'] else 'top'
+        if len(result) == 1:
+            return (f"{result.index[0]} has the {'lowest' if plan['ascending'] else 'highest'} "
+                    f"{_subject(plan)} at {_format_number(result.iloc[0])}.")
+        header = f"Here are the {order} {len(result)} {plan['dimension']} values by {_subject(plan)}:"
+    elif plan['kind'] == 'series':
+        header = f"Here is the {_subject(plan)} per {_GRAIN_LABELS[plan['grain']]} of {plan['dimension']}:"
+    else:
+        header = f"Here is the {_subject(plan)} by {plan['dimension']}:"
+
+    shown = result.iloc[:FAST_PATH_MAX_ROWS]
+    lines = [f"{i}. {label}: {_format_number(value)}" for i, (label, value) in enumerate(shown.items(), 1)]
+    if len(result) > len(shown):
+        lines.append(f"... and {len(result) - len(shown)} more.")
+    return header + "\n\n" + "\n".join(lines)
+
+
+def chart_spec(plan, result, chart_type='auto'):
+    """ECharts visualization for a grouped result, in the visualization agent's output format"""
+    chart_type = chart_type if chart_type != 'auto' else ('line' if plan['kind'] == 'series' else 'bar')
+    title = f"{_subject(plan).capitalize()} by {plan['dimension']}"
+    values = [None if pd.isna(v) else round(float(v), 2) for v in result.values]
+    option = echarts_option(chart_type, [str(label) for label in result.index], {_subject(plan): values}, title)
+    return {
+        'visualizationType': chart_type,
+        'meta': {'title': title, 'description': describe_result(plan, result).split('\n')[0]},
+        'echartsOption': option,
+    }
+
+
+def try_fast_path(user_query, filepath, chart_enabled=False, chart_type='auto'):
+    """
+    Answer a simple aggregation question directly from the data. Returns
+    (response, visualization dict or None) like run_agents, or None when the
+    question needs the agents.
+    """
+    if not QUERY_FAST_PATH:
+        return None
+    if chart_enabled and chart_type not in _CHART_TYPES:
+        return None
+    try:
+        plan = plan_query(user_query, get_profile(filepath))
+        if plan is None or (chart_enabled and plan['kind'] == 'scalar'):
+            return None
+        result = execute_plan(plan, open_dataset(filepath))
+    except _NoMatch:
+        return None
+    except Exception as e:
+        print(f"Fast path failed, using the agents: {str(e)}")
+        return None
+
+    visualization = chart_spec(plan, result, chart_type) if chart_enabled else None
+    return describe_result(plan, result), visualization
@@ -0,0 +1,121 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from get_tools import data_sources
+from get_tools.data_sources import DataSourceError, check_select
+
+
+ACCEPTED = [
+    "SELECT * FROM data",
+    "select Region, sum(Revenue) from data group by Region order by 2 desc limit 5;",
+    "SELECT * FROM data AS d JOIN data AS e ON d.Region = e.Region",
+    "SELECT * FROM data d, data e WHERE d.Id = e.Id",
+    "SELECT * FROM (SELECT Region, Revenue FROM data) s WHERE s.Revenue > 0",
+    "SELECT * FROM data WHERE Region IN (SELECT Region FROM data WHERE Revenue > 100)",
+    "SELECT (SELECT max(Revenue) FROM data) AS top FROM data",
+    "WITH big AS (SELECT * FROM data WHERE Revenue > 100) SELECT count(*) FROM big",
+    "WITH a AS (SELECT * FROM data), b(Region) AS (SELECT Region FROM a) SELECT * FROM a JOIN b ON a.Region = b.Region",
+    "SELECT EXTRACT(YEAR FROM \"Order Date\") AS year, count(*) FROM data GROUP BY 1",
+    "SELECT SUBSTRING(Region FROM 1 FOR 3) FROM data",
+    "SELECT TOP 5 * FROM [data] ORDER BY Revenue DESC",
+    "SELECT 'from secrets; drop table data' AS note FROM data",
+    "SELECT * FROM data /* ; */ -- trailing; comment",
+]
+
+REJECTED = [
+    "SELECT * FROM secrets",
+    "SELECT * FROM data JOIN secrets ON 1 = 1",
+    "SELECT * FROM data, secrets",
+    "SELECT * FROM data JOIN dbo.Secrets s ON 1 = 1",
+    "SELECT * FROM data.secrets",
+    "SELECT * FROM (secrets)",
+    "SELECT (SELECT max(x) FROM secrets) FROM data",
+    "SELECT * FROM data WHERE x IN (FROM secrets)",
+    "SELECT * FROM data UNION SELECT * FROM sqlite_master",
+    "WITH x AS (SELECT * FROM secrets) SELECT * FROM x",
+    "SELECT * FROM read_csv('/etc/passwd')",
+    "SELECT * FROM read_parquet(['other.parquet'])",
+    "SELECT * FROM OPENROWSET('SQLNCLI', 'Server=x', 'SELECT 1')",
+    "SELECT * FROM '/etc/passwd'",
+    "SELECT * INTO copy FROM data",
+    "ATTACH DATABASE 'other.db' AS other",
+    "PRAGMA table_info(data)",
+    "DROP TABLE data",
+    "SELECT * FROM data; DROP TABLE data",
+    "SELECT * FROM data; SELECT * FROM secrets",
+    "SELECT * FROM data -- comment\n; DELETE FROM data",
+    "SELECT * FROM data /* comment */; ATTACH DATABASE 'x' AS y",
+    "SELECT * FROM",
+]
+
+
+class CheckSelectTest(unittest.TestCase):
+
+    def test_accepts_queries_over_data(self):
+        for query in ACCEPTED:
+            with self.subTest(query=query):
+                check_select(query)
+
+    def test_rejects_other_tables_and_statements(self):
+        for query in REJECTED:
+            with self.subTest(query=query):
+                with self.assertRaises(DataSourceError):
+                    check_select(query)
+
+
+class SqliteSourceTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.roots = data_sources.DATA_SOURCE_ROOTS
+        data_sources.DATA_SOURCE_ROOTS = [self.directory.name]
+        self.addCleanup(setattr, data_sources, 'DATA_SOURCE_ROOTS', self.roots)
+
+        self.path = os.path.join(self.directory.name, 'sales.db')
+        conn = sqlite3.connect(self.path)
+        conn.execute('CREATE TABLE sales (Region TEXT, Revenue REAL)')
+        conn.executemany('INSERT INTO sales VALUES (?, ?)', [('North', 10), ('South', 20), ('North', 5)])
+        conn.execute('CREATE TABLE secrets (value TEXT)')
+        conn.commit()
+        conn.close()
+        self.source = data_sources._open(f'sqlite:{self.path}?table=sales')
+
+    def test_query_reads_the_source_table(self):
+        result = self.source.sql('SELECT Region, SUM(Revenue) AS total FROM data GROUP BY Region ORDER BY Region')
+        self.assertEqual(result['total'].tolist(), [15, 20])
+
+    def test_query_with_its_own_cte(self):
+        result = self.source.sql('WITH north AS (SELECT * FROM data WHERE Region = \'North\') SELECT COUNT(*) AS n FROM north')
+        self.assertEqual(result['n'].tolist(), [2])
+
+    def test_query_cannot_read_other_tables(self):
+        with self.assertRaises(DataSourceError):
+            self.source.sql('SELECT * FROM secrets')
+
+
+class FileSourceRootsTest(unittest.TestCase):
+
+    def test_glob_cannot_climb_out_of_the_roots(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for folder in ('data/a', 'outside'):
+                os.makedirs(os.path.join(directory, folder))
+            for path in ('data/a/part.csv', 'outside/secret.csv'):
+                with open(os.path.join(directory, path), 'w') as f:
+                    f.write('x\n1\n')
+            roots = data_sources.DATA_SOURCE_ROOTS
+            data_sources.DATA_SOURCE_ROOTS = [os.path.join(directory, 'data')]
+            try:
+                pattern = os.path.join(directory, 'data', '*', '..', '..', 'outside', '*.csv')
+                with self.assertRaises(DataSourceError):
+                    data_sources._open(pattern)
+                inside = data_sources._open(os.path.join(directory, 'data', '*', '*.csv'))
+                self.assertEqual(len(inside.files()), 1)
+            finally:
+                data_sources.DATA_SOURCE_ROOTS = roots
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+import json
+import zlib
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Stored visualizations and style templates start with this marker; older rows hold plain JSON
+PACKED_PREFIX = 'vz1:'
+COMPRESSION_LEVEL = 6
+# Keys of an ECharts option that hold the chart's own content rather than its styling
+CONTENT_KEYS = frozenset({'data', 'source', 'text', 'subtext', 'name'})
+# Style templates kept in memory by hash; they never change, so entries are only evicted
+STYLE_CACHE_SIZE = 1024
+
+_style_cache = OrderedDict()
+_style_lock = threading.Lock()
+
+
+def _compress(text):
+    return PACKED_PREFIX + base64.b64encode(zlib.compress(text.encode('utf-8'), COMPRESSION_LEVEL)).decode('ascii')
+
+
+def _decompress(stored):
+    return zlib.decompress(base64.b64decode(stored[len(PACKED_PREFIX):])).decode('utf-8')
+
+
+def _split(node, path, content):
+    """Copy node without its content values, collecting them in content as [path, value]"""
+    if isinstance(node, dict):
+        template = {}
+        for key, value in node.items():
+            if key in CONTENT_KEYS:
+                content.append([path + [key], value])
+            else:
+                template[key] = _split(value, path + [key], content)
+        return template
+    if isinstance(node, list):
+        return [_split(value, path + [i], content) for i, value in enumerate(node)]
+    return node
+
+
+def _remember_styles(styles):
+    with _style_lock:
+        for key, template in styles.items():
+            _style_cache[key] = template
+            _style_cache.move_to_end(key)
+        while len(_style_cache) > STYLE_CACHE_SIZE:
+            _style_cache.popitem(last=False)
+
+
+def pack_visualization(visualization):
+    """
+    Split every ECharts option of a visualization into a style template, shared by
+    all charts styled alike, and the chart's own content. Returns the compressed
+    text to store and {hash: template} of the templates it refers to.
+    """
+    styles = {}
+
+    def pack(node):
+        if isinstance(node, dict):
+            packed = {}
+            for key, value in node.items():
+                if key == 'echartsOption' and isinstance(value, dict):
+                    content = []
+                    template = json.dumps(_split(value, [], content), separators=(',', ':'), sort_keys=True)
+                    style = hashlib.sha256(template.encode('utf-8')).hexdigest()[:32]
+                    styles[style] = template
+                    packed[key] = {'style': style, 'content': content}
+                else:
+                    packed[key] = pack(value)
+            return packed
+        if isinstance(node, list):
+            return [pack(value) for value in node]
+        return node
+
+    text = json.dumps(pack(visualization), separators=(',', ':'))
+    _remember_styles(styles)
+    return _compress(text), styles
+
+
+def compress_style(template):
+    """Text of a style template as stored in VisualizationStyle"""
+    return _compress(template)
+
+
+def _style_keys(node, keys):
+    if isinstance(node, dict):
+        option = node.get('echartsOption')
+        if isinstance(option, dict) and 'style' in option:
+            keys.add(option['style'])
+        for key, value in node.items():
+            if key != 'echartsOption':
+                _style_keys(value, keys)
+    elif isinstance(node, list):
+        for value in node:
+            _style_keys(value, keys)
+    return keys
+
+
+def _unpack(node, templates):
+    if isinstance(node, dict):
+        unpacked = {}
+        for key, value in node.items():
+            if key == 'echartsOption' and isinstance(value, dict) and 'style' in value:
+                option = json.loads(templates[value['style']])
+                for path, content in value['content']:
+                    target = option
+                    for step in path[:-1]:
+                        target = target[step]
+                    target[path[-1]] = content
+                unpacked[key] = option
+            else:
+                unpacked[key] = _unpack(value, templates)
+        return unpacked
+    if isinstance(node, list):
+        return [_unpack(value, templates) for value in node]
+    return node
+
+
+def unpack_visualizations(texts, fetch_styles):
+    """
+    Decode stored visualization texts, plain JSON or packed. fetch_styles(keys)
+    returns {hash: stored template} for templates that are not cached.
+    """
+    # (packed, decoded JSON) per text
+    decoded = []
+    for text in texts:
+        if not text:
+            decoded.append((False, None))
+        elif text.startswith(PACKED_PREFIX):
+            decoded.append((True, json.loads(_decompress(text))))
+        else:
+            decoded.append((False, json.loads(text)))
+
+    keys = set()
+    for packed, node in decoded:
+        if packed:
+            _style_keys(node, keys)
+    with _style_lock:
+        templates = {key: _style_cache[key] for key in keys if key in _style_cache}
+    missing = keys - templates.keys()
+    if missing:
+        fetched = {key: _decompress(stored) for key, stored in fetch_styles(sorted(missing)).items()}
+        _remember_styles(fetched)
+        templates.update(fetched)
+
+    visualizations = []
+    for packed, node in decoded:
+        if not packed:
+            visualizations.append(node)
+            continue
+        try:
+            visualizations.append(_unpack(node, templates))
+        except KeyError as e:
+            print(f"Visualization style {str(e)} is missing")
+            visualizations.append(None)
+    return visualizations